@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Measures the startup time of the ``molflow`` command line entry point.
+
+Each trial starts a fresh interpreter that imports ``molflow.__main__`` and builds its
+argument parser (everything ``molflow --help`` does before printing), and reports:
+ - the median wall time of the trials
+ - the modules that took the longest to import (from ``python -X importtime``)
+ - any modules that should only be imported by the commands that use them (GitPython, yaml,
+   termcolor, pyccc, the workflow configuration, ...)
+
+Exits with an error if any of those modules were imported, or if the median time is over
+``--max-ms``, so it can guard against regressions.
+
+Usage:
+    python benchmarks/bench_cli_startup.py [--trials 10] [--max-ms 500]
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+STARTUP = 'import molflow.__main__ as cli; cli.parser()'
+
+# modules that parsing the command line shouldn't need
+DEFERRED = ['git', 'semver', 'termcolor', 'yaml', 'pyccc', 'molflow.config',
+            'molflow.versioning', 'molflow.run', 'molflow.convert', 'molflow.info',
+            'molflow.runners.localstep', 'molflow.runners.localrunner']
+
+CHECK_IMPORTS = STARTUP + """
+import sys
+print(' '.join(name for name in %r if name in sys.modules))
+""" % DEFERRED
+
+
+def run_python(code, *options):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(ROOT)] +
+                                        [p for p in [env.get('PYTHONPATH')] if p])
+    return subprocess.run([sys.executable] + list(options) + ['-c', code], env=env,
+                          check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def time_startup(trials):
+    times = []
+    for i in range(trials):
+        start = time.time()
+        run_python(STARTUP)
+        times.append(time.time() - start)
+    return sorted(times)[len(times) // 2]
+
+
+def slowest_imports(num=15):
+    """ Parse ``-X importtime`` output into the modules with the longest cumulative times """
+    imports = []
+    for line in run_python(STARTUP, '-X', 'importtime').stderr.splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[1].isdigit():
+            imports.append((int(fields[1]), fields[2].strip()))
+    return sorted(imports, reverse=True)[:num]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--trials', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='Fail if the median startup time is longer than this')
+    args = parser.parse_args()
+
+    median = time_startup(args.trials)
+    print('Median startup time over %d trials: %.1f ms' % (args.trials, median * 1000))
+
+    print('\nSlowest imports (cumulative):')
+    for microseconds, name in slowest_imports():
+        print('  %8.1f ms  %s' % (microseconds / 1000.0, name))
+
+    failed = False
+    imported = run_python(CHECK_IMPORTS).stdout.split()
+    if imported:
+        print('\nFAILED: startup imported modules that should be deferred: %s'
+              % ', '.join(imported))
+        failed = True
+    if args.max_ms is not None and median * 1000 > args.max_ms:
+        print('\nFAILED: startup took longer than %.1f ms' % args.max_ms)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Measures molflow's own scheduling overhead on synthetic workflows.
+
+Workflows of a controlled shape and size run through ``LocalRunner`` with a no-op engine,
+whose jobs do nothing and finish instantly (or after scripted delays), so everything that's
+measured is molflow's overhead: building the DAG, the runner's setup (deduplication,
+indexing the graph, critical path priorities), and launching and finishing jobs.
+
+For each workflow, this reports:
+ - build: time to create the workflow's steps
+ - dedupe: time to look for duplicate steps (the synthetic steps all call the same function
+   on the same inputs, so the runner itself runs them without deduplication)
+ - setup: time to construct the runner
+ - run: wall time of ``LocalRunner.run``, and its excess over the ideal makespan (the longer
+   of the critical path, and the total step duration divided by ``--maxcpus``)
+ - CPU time used by the whole process and by the scheduler thread, per step
+ - idle: time the scheduler spent waiting for jobs to finish
+ - peak RSS growth of the process
+
+Usage:
+    python benchmarks/bench_scheduler.py                   # the default suite
+    python benchmarks/bench_scheduler.py --shape chain --steps 500 1000 --duration 0.01
+"""
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import os
+import random
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from molflow import definitions as df
+from molflow.runners.dedupe import deduplicate_steps
+from molflow.runners.localrunner import LocalRunner
+from molflow.static.runstep import PICKLE_PROTOCOL
+
+DEFAULT_SUITE = [('fanout', 10000), ('fanout', 100000),
+                 ('chain', 100), ('chain', 10000),
+                 ('diamond', 1000), ('diamond', 10000),
+                 ('layered', 10000), ('layered', 100000)]
+
+NOOP = df.Function('noop', python_module='molflow_benchmark', num_returnvals=1,
+                   docker_image='molflow-benchmark:none')
+
+
+class SyntheticWorkflow(object):
+    """ Builds a workflow step by step, keeping each step's dependencies in creation order
+    (which is a topological order) to compute the ideal makespan
+    """
+    def __init__(self, name):
+        self.workflow = df.WorkflowDefinition(name)
+        self.seed = self.workflow.add_input('seed')
+        self.steps = []
+        self.upstream = {}
+        self.consumed = set()
+
+    def add(self, *upstream):
+        step = df.Step(NOOP, tuple(s.get_result(0) for s in upstream) or (self.seed,), {},
+                       execount=len(self.steps) + 1)
+        self.steps.append(step)
+        self.upstream[step] = upstream
+        self.consumed.update(upstream)
+        return step
+
+    def finish(self):
+        """ Join every step whose results aren't used into one output, so that all of the
+        steps are part of the workflow's DAG
+        """
+        sinks = [step for step in self.steps if step not in self.consumed]
+        final = self.add(*sinks) if len(sinks) > 1 else sinks[0]
+        self.workflow.set_output(final.get_result(0), 'out')
+        return self
+
+
+def fanout(numsteps, rng):
+    """ One step feeding all of the others """
+    wf = SyntheticWorkflow('fanout')
+    root = wf.add()
+    for i in range(numsteps - 2):
+        wf.add(root)
+    return wf.finish()
+
+
+def chain(numsteps, rng):
+    """ Each step consumes the previous one """
+    wf = SyntheticWorkflow('chain')
+    step = wf.add()
+    for i in range(numsteps - 1):
+        step = wf.add(step)
+    return wf.finish()
+
+
+def diamond(numsteps, rng):
+    """ A chain of diamonds: each step feeds two steps, which feed the next join """
+    wf = SyntheticWorkflow('diamond')
+    join = wf.add()
+    while len(wf.steps) + 3 <= numsteps:
+        join = wf.add(wf.add(join), wf.add(join))
+    return wf.finish()
+
+
+def layered(numsteps, rng):
+    """ Random layered DAG: about sqrt(N) layers of about sqrt(N) steps, each step consuming
+    one to three random steps from the previous layer
+    """
+    wf = SyntheticWorkflow('layered')
+    width = max(int(numsteps ** 0.5), 1)
+    layer = [wf.add() for i in range(width)]
+    while len(wf.steps) + width < numsteps:
+        layer = [wf.add(*rng.sample(layer, rng.randint(1, min(3, len(layer)))))
+                 for i in range(width)]
+    return wf.finish()
+
+
+SHAPES = collections.OrderedDict([('fanout', fanout), ('chain', chain),
+                                  ('diamond', diamond), ('layered', layered)])
+
+
+class NoOpEngine(object):
+    """ Engine whose jobs do nothing; each finishes ``durations(step)`` seconds after it's
+    submitted
+
+    Args:
+        durations (callable): maps each step to its duration (default: 0)
+        blocking (bool): if False, the runner can't wait on jobs, and has to poll them
+    """
+    name = 'noop'
+    cache_tag = name
+    supports_caching = False
+    supports_fusion = False
+    uses_images = False
+
+    def __init__(self, durations=None, blocking=True):
+        self.durations = durations or (lambda step: 0.0)
+        self.blocking = blocking
+        self._jobids = iter(range(sys.maxsize))
+
+    def __str__(self):
+        return self.name
+
+    def make_job(self, step, defdir, inputs, protocol=None, formats=None):
+        return NoOpJob(self, self.durations(step), next(self._jobids))
+
+    def pickle_protocol(self, image):
+        return PICKLE_PROTOCOL
+
+    def wait(self, job):
+        if not self.blocking:
+            raise NotImplementedError()
+        delay = job.finish_at - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def shutdown(self):
+        pass
+
+
+class NoOpJob(object):
+    image = None
+    command = 'noop'
+    stdout = stderr = ''
+    inputs = {}
+    rundata = {}
+    OUTPUTS = {'return.0.pkl': None}
+
+    def __init__(self, engine, duration, jobid):
+        self.engine = engine
+        self.duration = duration
+        self.jobid = jobid
+        self.finish_at = None
+
+    def submit(self):
+        self.finish_at = time.time() + self.duration
+
+    @property
+    def status(self):
+        return 'finished' if time.time() >= self.finish_at else 'running'
+
+    def get_output(self, filename=None):
+        if filename:
+            return self.OUTPUTS[filename]
+        return self.OUTPUTS
+
+    def kill(self):
+        pass
+
+
+class MeasuredRunner(LocalRunner):
+    """ Records how long the scheduler spends idle, waiting for jobs to finish """
+    idle_time = 0.0
+
+    def _wait_for_completion(self):
+        start = time.time()
+        super(MeasuredRunner, self)._wait_for_completion()
+        self.idle_time += time.time() - start
+
+
+def ideal_makespan(synthetic, durations, maxproc):
+    finish = {}
+    for step in synthetic.steps:
+        finish[step] = (max([finish[dep] for dep in synthetic.upstream[step]] or [0.0]) +
+                        durations(step))
+    total = sum(durations(step) for step in synthetic.steps)
+    return max(max(finish.values()), total / maxproc)
+
+
+def process_cpu_time():
+    if hasattr(time, 'process_time'):  # python 3.3+
+        return time.process_time()
+    return time.clock()
+
+
+def thread_cpu_time():
+    if hasattr(time, 'thread_time'):  # python 3.7+
+        return time.thread_time()
+    return float('nan')
+
+
+def peak_rss():
+    if resource is None:
+        return float('nan')
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+@contextlib.contextmanager
+def quiet():
+    """ Discard the runner's log messages (writing them is still part of the overhead) """
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            yield
+        finally:
+            sys.stdout = stdout
+
+
+def run_benchmark(shape, numsteps, duration=0.0, jitter=0.0, maxproc=4,
+                  schedule='critical-path', blocking=True, seed=0):
+    """ Run one synthetic workflow, and return its measurements """
+    rng = random.Random(seed)
+    scripted = {}
+
+    def durations(step):
+        if step not in scripted:
+            scripted[step] = duration + rng.uniform(0.0, jitter)
+        return scripted[step]
+
+    result = collections.OrderedDict([('shape', shape), ('steps', None)])
+    rss_start = peak_rss()
+    start = time.time()
+    synthetic = SHAPES[shape](numsteps, rng)
+    result['steps'] = len(synthetic.steps)
+    result['build'] = time.time() - start
+
+    engine = NoOpEngine(durations, blocking=blocking)
+    cpu_start, thread_start = process_cpu_time(), thread_cpu_time()
+    try:
+        start = time.time()
+        deduplicate_steps(synthetic.workflow)
+        result['dedupe'] = time.time() - start
+
+        start = time.time()
+        runner = MeasuredRunner(synthetic.workflow, {'seed': b''}, maxproc=maxproc,
+                                polltime=0.5, schedule=schedule, engine=engine,
+                                deduplicate=False)
+        result['setup'] = time.time() - start
+
+        start = time.time()
+        with quiet():
+            runner.run()
+        result['run'] = time.time() - start
+    except RuntimeError as e:  # e.g., exceeding the recursion limit on deep graphs
+        result['error'] = '%s: %s' % (type(e).__name__, str(e).split('\n')[0][:60])
+        return result
+
+    ideal = ideal_makespan(synthetic, durations, maxproc)
+    result['ideal'] = ideal
+    result['excess'] = result['run'] - ideal
+    result['cpu/step'] = (process_cpu_time() - cpu_start) / result['steps']
+    result['sched cpu/step'] = (thread_cpu_time() - thread_start) / result['steps']
+    result['idle'] = runner.idle_time
+    result['rss growth'] = peak_rss() - rss_start
+    return result
+
+
+def format_result(result):
+    fields = []
+    for key, value in result.items():
+        if key == 'rss growth':
+            fields.append('%s=%.1fMiB' % (key, value / 1024.0**2))
+        elif key.endswith('/step'):
+            fields.append('%s=%.1fus' % (key, value * 1e6))
+        elif isinstance(value, float):
+            fields.append('%s=%.3fs' % (key, value))
+        else:
+            fields.append('%s=%s' % (key, value))
+    return '  '.join(fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--shape', choices=list(SHAPES), nargs='+',
+                        help='Workflow shapes (default: run the default suite)')
+    parser.add_argument('--steps', type=int, nargs='+', default=[1000],
+                        help='Number of steps in each workflow (with --shape)')
+    parser.add_argument('--duration', type=float, default=0.0,
+                        help='Duration of each step, in seconds (default: 0)')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Add a random delay of up to this many seconds to each step')
+    parser.add_argument('--maxcpus', type=int, default=4)
+    parser.add_argument('--schedule', default='critical-path')
+    parser.add_argument('--poll', action='store_true',
+                        help="Make the runner poll jobs, instead of waiting on them")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.shape:
+        suite = [(shape, numsteps) for shape in args.shape for numsteps in args.steps]
+    else:
+        suite = DEFAULT_SUITE
+
+    for shape, numsteps in suite:
+        result = run_benchmark(shape, numsteps, args.duration, args.jitter, args.maxcpus,
+                               args.schedule, blocking=not args.poll, seed=args.seed)
+        print(format_result(result))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -16,19 +16,31 @@
 
 from __future__ import print_function
 import argparse
-from pathlib import Path
+import importlib
 
-from . import info, convert, versioning
-from .run import run_workflow
-from .runners import cwl
+from .runners.scheduling import SCHEDULES
 
 
 DESCRIPTION = 'Command line interface for running workflows in the molecular-workflow-repository.'
 
+# names of the engines in molflow.runners.localstep.ENGINES, which isn't imported here because
+# it pulls in pyccc and the workflow configuration
+ENGINE_NAMES = ['docker', 'docker-pool', 'pool', 'subprocess']
+
 workflow_name_parser = argparse.ArgumentParser(add_help=False)
 workflow_name_parser.add_argument('workflow_name', help='Name or path of the workflow')
 
 
+def command(modulename, funcname):
+    """ A command's implementation, which is only imported when the command runs, so that
+    parsing the command line doesn't pay for every command's imports
+    """
+    def run_command(args):
+        module = importlib.import_module(modulename, __package__)
+        return getattr(module, funcname)(args)
+    return run_command
+
+
 def parser():
     parser = argparse.ArgumentParser('molflow', description=DESCRIPTION,
                                      epilog="Run 'molflow [cmd] --help' for detailed "
@@ -54,7 +66,7 @@ def info_argparser(cmdparser):
     infoparser = cmdparser.add_parser('info', help='Examine a workflow',
                                        parents=[workflow_name_parser])
     infoparser.add_argument('--show-tasks', help='Show all tasks in this workflow')
-    infoparser.set_defaults(func=info.print_metadata)
+    infoparser.set_defaults(func=command('.info', 'print_metadata'))
 
 
 def list_argparser(cmdparser):
@@ -62,7 +74,7 @@ def list_argparser(cmdparser):
     lister.add_argument('--verbose','-v',help='Verbose output: will show all versions for each workflow',action='store_true')
     lister.add_argument('keywords', nargs='*',
                         help="Only list workflows with these keywords")
-    lister.set_defaults(func=info.list_workflows)
+    lister.set_defaults(func=command('.info', 'list_workflows'))
 
 
 def run_argparser(cmdparser):
@@ -72,32 +84,77 @@ def run_argparser(cmdparser):
     run.add_argument('inputs', nargs='*',
                      help='Inputs in the form "name=value", OR path to a JSON or YAML file'
                           'specifying the inputs')
+    run.add_argument('--sweep', metavar='FILE',
+                     help='Run the workflow for each set of inputs in a JSON-lines or CSV file, '
+                          'sharing steps whose inputs are the same. Each set\'s outputs are '
+                          'written to [outputdir]/[row id]')
     run.add_argument('--outputdir', '-o',
                      help='Directory to write output to. The directory is '
                      "created if it doesn't exist. (default: '[workflow name].run)'")
     run.add_argument('--overwrite', action='store_true',
                      help='Overwrite the old output directory')
+    run.add_argument('--resume', action='store_true',
+                     help='Resume an interrupted run in the output directory, skipping steps '
+                          'whose recorded results are still valid (not supported by the '
+                          '"pool" engine)')
     run.add_argument('--saveall', action='store_true',
                      help="Save each intermediate step's outputs as well as the workflow's outputs")
     run.add_argument('--maxcpus', type=int, default=4,
                      help='Maximum number of CPUs to allocate (default: 4)')
+    run.add_argument('--schedule', choices=list(SCHEDULES), default='critical-path',
+                     help='Order in which to launch steps that are ready to run: '
+                          '"critical-path" prioritizes steps with the longest chain of work '
+                          'downstream of them, weighing each function by how long its steps '
+                          'took in earlier runs; "fifo" launches steps as they become ready '
+                          '(default: critical-path)')
+    run.add_argument('--engine', choices=ENGINE_NAMES, default='docker',
+                     help='Where to run each step: "docker" runs it in a new container, '
+                          '"docker-pool" runs it in one of a pool of long-lived containers '
+                          'per image (up to --maxcpus each), "subprocess" runs it directly on '
+                          'this machine, "pool" runs pure-python functions in a pool of local '
+                          'worker processes (default: docker)')
+    run.add_argument('--python',
+                     help='With "--engine subprocess": python interpreter, virtualenv '
+                          'directory, or conda environment name to run steps with '
+                          '(default: the interpreter running molflow). With "--engine docker" '
+                          'or "docker-pool": python command inside the containers')
+    run.add_argument('--fuse', action='store_true',
+                     help='Run each chain of steps that share a docker image, where every '
+                          "step's results are only used by the next one, as a single job "
+                          '(not supported with "--engine pool")')
+    run.add_argument('--trace', metavar='FILE',
+                     help="Record when each step was queued, submitted, running, and "
+                          "collecting its results, as a Chrome trace-event JSON file (open it "
+                          "in https://ui.perfetto.dev or chrome://tracing)")
+    run.add_argument('--profile-step', action='append', default=[], metavar='LABEL',
+                     help='Profile the step with this label (e.g. "minimize.2") with cProfile, '
+                          "and save the profile in the step's directory in the output "
+                          'directory. Can be passed more than once')
+    run.add_argument('--profile-function', action='append', default=[], metavar='NAME',
+                     help='Profile every step that calls this function (like --profile-step)')
+    run.add_argument('--profile-memory', action='store_true',
+                     help='Also trace the profiled steps\' memory allocations with '
+                          'tracemalloc (python 3 only)')
+    run.add_argument('--no-cache', action='store_true',
+                     help="Don't read or write cached step results")
+    run.add_argument('--refresh', action='store_true',
+                     help='Re-run every step, replacing any cached results')
     run.add_argument('--quiet', '-q', action='store_true',
                      help='Only print final output and fatal errors (no logging messages)')
-    run.set_defaults(func=run_workflow)
+    run.set_defaults(func=command('.run', 'run_workflow'))
 
 
 def convert_argparser(cmdparser):
     converter = cmdparser.add_parser('convert',
                                       help='Convert molecular files, strings, and python objects',
-                                      epilog=convert.get_help().replace('\n', '|n'),
-                                      formatter_class=MultilineFormatter)
+                                      formatter_class=ConvertHelpFormatter)
     converter.add_argument('input', help='Input file or string')
     converter.add_argument('--input-format', '--fi',
                            help='Input format (default: determined from input)')
     converter.add_argument('output', help='Output filename')
     converter.add_argument('--output-format', '--fo',
                            help='Input format (default: determined from output filename)')
-    converter.set_defaults(func=convert.drive_converter)
+    converter.set_defaults(func=command('.convert', 'drive_converter'))
 
 
 def cwl_argparser(cmdparser):
@@ -107,7 +164,7 @@ def cwl_argparser(cmdparser):
     cwlexporter.add_argument('--outputdir', '-o', default=None,
                              help='Directory to write output to. The directory is '
                                   "created if it doesn't exist. (default: [workflow name].cwl)")
-    cwlexporter.set_defaults(func=cwl.export_cwl)
+    cwlexporter.set_defaults(func=command('.runners.cwl', 'export_cwl'))
 
 
 
@@ -126,6 +183,16 @@ class MultilineFormatter(argparse.HelpFormatter):
         return multiline_text
 
 
+class ConvertHelpFormatter(MultilineFormatter):
+    """ Ends the help with the list of supported formats, which is only read (from
+    static/formats.yml) when the help is shown
+    """
+    def format_help(self):
+        from . import convert
+        self.add_text(convert.get_help().replace('\n', '|n'))
+        return super(ConvertHelpFormatter, self).format_help()
+
+
 def main():
     args = parser().parse_args()
     args.func(args)
@@ -24,6 +24,10 @@
      - Workflow Metadata
      - Workflow Versions
   It is used by most command line functions in order to retrieve specific workflows, get information about them, run them, etc.
+
+ Reading the configuration and discovering workflows is deferred until the configuration is
+ first used, so commands that don't need it (e.g. `molflow --help` or `molflow convert`)
+ start quickly. For the same reason, yaml, termcolor and GitPython are imported when needed.
 """
 
 from pathlib import Path                # All path operations. Note that we have
@@ -32,23 +36,16 @@ from pathlib import Path                # All path operations. Note that we have
                                         # aren't implemented in the 2.7 pypi
                                         # version.
 
-import yaml                             # Used for reading metadata.
-
-from past.builtins import basestring    # Used for checking if something is str
-                                        # or unicode. May no longer be needed if
-                                        # we update the formatter. 
-
-from termcolor import cprint, colored   # For colorizing warning/error
-                                        # messages. Should not be needed if we
-                                        # update the formatter to have a better
-                                        # range of error messaging.
-          
+import atexit                           # Saves the workflow index on exit
 
 import configparser                     # Config file reader
 
+from .discovery import (WorkflowIndex, INDEX_FILENAME,  # Caches discovered workflows
+                        find_workflows, read_metadata)   # between runs
 
-from .versioning import WorkflowVersions  # Component of WorkflowConfig object.
 
+VERSION_CACHE_DIRNAME = 'versions'  # read-only copies of specific versions of workflows
+PLAN_CACHE_DIRNAME = 'plans'  # workflow definitions built by previous runs of workflow.py
 
 # Configuration file used if none is found. 
 sample_config_file = u"\
@@ -80,8 +77,12 @@ class Config( object ):
        1. Information contained within the configuration file.
        2. State information for all local and remote workflows.
     """
-    def __init__(self, config_file_location = "~/.molflow/config"):
-        """ Initializes a configuration object based on the path in which to find the configuration file. """
+    def __init__(self, config_file_location = "~/.molflow/config", use_index = True):
+        """ Initializes a configuration object based on the path in which to find the configuration file.
+
+        Unless ``use_index`` is False, discovered workflows and their metadata are cached in an
+        index next to the configuration file (see :mod:`molflow.discovery`).
+        """
         config_file_path = Path(config_file_location)
 
         try:
@@ -98,6 +99,14 @@ class Config( object ):
             self.create_config( config_file_path )
             self._configdata = self.load_config( config_file_path )
 
+        self.version_cache = config_file_path.parent / VERSION_CACHE_DIRNAME
+        self.plan_cache = config_file_path.parent / PLAN_CACHE_DIRNAME
+
+        self._index = None
+        if use_index:
+            self._index = WorkflowIndex( config_file_path.parent / INDEX_FILENAME )
+            atexit.register( self._index.save )
+
         self._config_paths = [Path(i) for i in self._configdata['Local Workflow Locations']['paths'].split('\n')]
                 
         try:
@@ -158,13 +167,18 @@ class Config( object ):
 
         self._all_local_workflows = []
         for p in paths:
-            possible_workflows = [item for item in p.iterdir() if item.is_dir()]
-            for workflow in possible_workflows:
-                if (workflow / 'workflow.py').exists() and (workflow / 'metadata.yml').exists():
-                    wf = WorkflowConfiguration( name = workflow.stem,
-                                                path = Path(workflow),
-                                                config_path = self.get_config_path( workflow ))
-                    self._all_local_workflows.append( wf )
+            if self._index is not None:
+                workflows = self._index.find_workflows( p )
+            else:
+                workflows = find_workflows( p )
+            for workflow in workflows:
+                wf = WorkflowConfiguration( name = workflow.stem,
+                                            path = Path(workflow),
+                                            config_path = self.get_config_path( workflow ),
+                                            index = self._index,
+                                            version_cache = self.version_cache,
+                                            plan_cache = self.plan_cache )
+                self._all_local_workflows.append( wf )
 
 
         self._index_local_workflows()
@@ -211,6 +225,7 @@ class Config( object ):
 
     def get_workflow_by_name( self, name , raise_issues=False ):
         # Note: currently hooked up to local only, needs to check both local and remotes eventually.
+        from termcolor import cprint, colored   # For colorizing warning/error messages.
         try:
             workflows = self._workflows_by_name[name]
         except KeyError:
@@ -254,11 +269,28 @@ class Config( object ):
 
 
 
+def load_versions( workflows ):
+    """ Determine the versions of several workflows at once (in parallel, and using the
+    workflow index where possible) """
+    from .versioning import discover_versions  # imports GitPython
+    workflows = [wf for wf in workflows if wf._versions is None]
+    if len(workflows) == 0:
+        return
+    # all workflows found by one configuration share its index
+    versions = discover_versions( [wf.path for wf in workflows], workflows[0]._index )
+    for wf, wf_versions in zip( workflows, versions ):
+        wf._versions = wf_versions
+
+
 class WorkflowConfiguration( object ):
-    def __init__( self, name, path, config_path ):
+    def __init__( self, name, path, config_path, index=None, version_cache=None,
+                  plan_cache=None ):
         self.name = name
         self.path = path
         self.config_path = config_path
+        self.version_cache = version_cache
+        self.plan_cache = plan_cache
+        self._index = index
         self._metadata = None
         self._workflow = None
         self._versions = None
@@ -266,33 +298,84 @@ class WorkflowConfiguration( object ):
     @property
     def metadata( self ):
         if self._metadata is None:
-            self._metadata = WorkflowMetadata( self.path / 'metadata.yml' )
+            if self._index is None:
+                self._metadata = WorkflowMetadata( self.path / 'metadata.yml' )
+            else:
+                self._metadata = WorkflowMetadata( self.path / 'metadata.yml',
+                                                   self._index.metadata( self.path ) )
+                interface = self._index.interface( self.path )
+                if interface is not None:
+                    self._metadata.set_interface( *interface )
         return self._metadata
 
+    def load_interface( self ):
+        """ Get the metadata, including descriptions of the workflow's inputs and outputs.
+        Those come from the index if it has them, and otherwise from loading the workflow. """
+        if not self.metadata.has_interface:
+            self.workflow
+        return self.metadata
+
     @property
     def workflow( self ):
         if self._workflow is None:
-            namespace = {}
-            workflow_path = self.path / 'workflow.py'
-            with workflow_path.open("r") as wflowfile:
-                code = compile(wflowfile.read(), "workflow.py", 'exec')
-                exec(code, namespace)
+            plans = None
+            if self.plan_cache is not None:
+                from .plans import PlanCache
+                plans = PlanCache( self.plan_cache )
+                self._workflow = plans.load( self.path )
+
+            if self._workflow is None:
+                namespace = {}
+                workflow_path = self.path / 'workflow.py'
+                with workflow_path.open("r") as wflowfile:
+                    code = compile(wflowfile.read(), "workflow.py", 'exec')
+                    exec(code, namespace)
+                self._workflow = namespace['__workflow__']
+                if plans is not None:
+                    plans.save( self.path, self._workflow )
 
             # load metadata only if available
-            self._workflow = namespace['__workflow__']
-            
             self.metadata.add_workflow_information( self._workflow )
             self._workflow.metadata = self.metadata.metadata
             self._workflow.definition_path = self.path
+            if self._index is not None:
+                self._index.record_interface( self.path, self.metadata.inputs,
+                                              self.metadata.outputs )
             
         return self._workflow
 
     @property
     def versions( self ):
         if self._versions is None:
-            self._versions = WorkflowVersions( self.path )
+            load_versions( [self] )
         return self._versions
 
+    def at_version( self, version_name=None ):
+        """ This workflow at a specific version (a tag or branch name), or at its default version.
+
+        Versions other than the repository's current state are loaded from read-only copies
+        in the version cache (see :class:`molflow.versioning.VersionCache`), so the
+        repository's working tree is never changed and different versions can run at once.
+
+        Returns:
+            WorkflowConfiguration: this workflow if the version is its current state, or the
+               workflow at that version
+        """
+        if version_name is None:
+            commit = self.versions.default_version_commit()
+        else:
+            commit = self.versions.version_commit( version_name )
+        if commit is None:
+            return self
+
+        from .versioning import VersionCache
+        path = VersionCache( self.version_cache ).get( self.versions.git_repo, commit )
+        return WorkflowConfiguration( name = self.name,
+                                      path = path,
+                                      config_path = self.config_path,
+                                      version_cache = self.version_cache,
+                                      plan_cache = self.plan_cache )
+
     def __repr__( self ):
         return "\
 WorkflowConfiguration: Name: {self.name}\n\
@@ -307,29 +390,37 @@ class WorkflowMetadata(object):
     """
     Args:
         path (pathlib.Path): path to the metadata file
+        metadata (dict): the file's already-parsed contents (e.g., from the workflow index)
     """
-    def __init__(self, path):
-        if path.exists():
-            with path.open('r') as ymlfile:
-                self.metadata = yaml.load(ymlfile)
+    def __init__(self, path, metadata=None):
+        if metadata is not None:
+            self.metadata = metadata
+        elif path.exists():
+            self.metadata = read_metadata(path)
         else:
             self.metadata = {}
-        if self.metadata == None:
-            self.metadata = {}
         self.inputs = []
         self.outputs = []
+        self.has_interface = False  # whether the inputs and outputs are known
 
     def add_workflow_information(self, workflow):
-        self.inputs = []
-        self.outputs = []
+        inputs = []
+        outputs = []
         for key, val in workflow.inputs.items():
-            self._format_item(key, val, self.inputs)
+            self._format_item(key, val, inputs)
 
         for key, val in workflow.outputs.items():
-            self._format_item(key, val, self.outputs)
+            self._format_item(key, val, outputs)
+        self.set_interface(inputs, outputs)
+
+    def set_interface(self, inputs, outputs):
+        self.inputs = inputs
+        self.outputs = outputs
+        self.has_interface = True
 
     @staticmethod
     def _format_item(key, val, l):
+        from past.builtins import basestring
         if val.description is None:
             val.description = ''
         inputstr = val.description.strip()
@@ -351,8 +442,22 @@ class WorkflowMetadata(object):
 #end class WorkflowMetadata(object)
 
 
+class LazyConfig(object):
+    """ Stands in for a :class:`Config`, which is only created (reading the configuration
+    file and discovering workflows) when one of its attributes is first used.
+    """
+    def __init__(self, config_file_location="~/.molflow/config"):
+        self._config_file_location = config_file_location
+        self._config = None
+
+    def __getattr__(self, name):
+        if self._config is None:
+            self._config = Config(self._config_file_location)
+        return getattr(self._config, name)
+
+
 # Important - this object is what typically gets used by all of the command
 # options. We rarely need to create more than one Config, but it's occasionally
 # useful if using this module interactively.
 
-configuration = Config()
+configuration = LazyConfig()
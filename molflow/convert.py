@@ -20,8 +20,8 @@ import pickle
 from .config import configuration
 from .utils import RMODE, WMODE
 from .serializers import BUILTIN_TYPES
+from .static.runstep import CODECS, PICKLE_PROTOCOL, to_pickle
 
-PICKLE_PROTOCOL = 2
 CONVERTPOLLTIME = 2
 MAXCONVERTCPU = 1
 
@@ -64,7 +64,7 @@ def drive_converter(args):
     runner.run()
     result = runner.output_files['result']
     with outpath.open(WMODE) as outfile:  # TODO: handle python objects (don't deserialize them)
-        outfile.write(pickle.loads(result.open('rb').read()))
+        outfile.write(CODECS[runner.output_formats['result']].loads(result.open('rb').read()))
     print('Wrote file to %s' % outpath)
 
 
@@ -96,7 +96,7 @@ def load_argument(s):
 def get_help():
     formatpath = Path(__file__).parents[0] / 'static' / 'formats.yml'
     with formatpath.open('r') as ymlfile:
-        formats = yaml.load(ymlfile)
+        formats = yaml.safe_load(ymlfile)
 
     helpstrs = ['Supported formats:']
     for key, value in formats.items():
@@ -152,4 +152,5 @@ def translate_cli_input(clidata, desired):
 
         runner = LocalRunner(get_converter(), inputs, MAXCONVERTCPU, CONVERTPOLLTIME)
         runner.run()
-        return runner.output_files['result'].open('rb').read()
+        return to_pickle(runner.output_files['result'].open('rb').read(),
+                         runner.output_formats['result'])
@@ -18,6 +18,8 @@ import pickle
 class ExternalInput(object):
     """ Placeholder for external (i.e., user) input
     """
+    __slots__ = ('name', 'description', 'type', 'workflow', 'default')
+
     def __init__(self, name, workflow, description=None,
                  type=None, default=None):
         self.name = name
@@ -42,6 +44,8 @@ class ExternalInput(object):
 class WorkflowOutput(object):
     """ Placeholder for a worfklow's output field
     """
+    __slots__ = ('name', 'workflow', 'source', 'help', 'type', 'description')
+
     def __init__(self, name, workflow, source, description=None, type=None):
         self.name = name
         self.workflow = workflow
@@ -12,33 +12,73 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import weakref
 from pathlib import Path
 
 import yaml
 from past.builtins import basestring
 
-from .steps import Step
+from ..static.runstep import CODECS, FORMATS
+from .steps import Step, MapStep
 
 FILEARRAY = {'type': 'array', 'items': 'File'}
 INTARRAY = {'type': 'array', 'items': 'int'}
+CWL_UNROLL = {'type': ['null', {'type': 'array', 'items': 'int',
+                                'inputBinding': {'prefix': '--unroll'}}],
+              'inputBinding': {'position': -1}}  # options go before the function name
 
 
 class Function(object):
     """ A function in the DAG
+
+    ``output_formats`` chooses the file format that each return value is passed to other steps
+    in: ``'pkl'`` (pickle; the default), ``'txt'`` (strings, as UTF-8 text), ``'bin'`` (bytes),
+    ``'npy'`` (numpy arrays, memory-mapped when they're large) or ``'msgpack'`` (plain dicts and
+    lists; needs msgpack in the images). Pass one format for all return values, or a list with
+    one per return value (``None`` for the default). Values that a format can't store are
+    pickled instead.
     """
     def __init__(self, funcname, sourcefile=None, python_module=None,
-                 num_args=None, num_returnvals=None, docker_image=None):
+                 num_args=None, num_returnvals=None, docker_image=None, output_formats=None):
         if (sourcefile and python_module) or not (sourcefile or python_module):
             raise ValueError("Define *either* `sourcefile` or `python_module`, not both.")
+        if isinstance(output_formats, basestring):
+            output_formats = [output_formats]
+        for fmt in output_formats or ():
+            if fmt is not None and fmt not in CODECS:
+                raise ValueError('Unknown output format "%s"; expected one of: %s'
+                                 % (fmt, ', '.join(codec.extension for codec in FORMATS)))
 
         self._docker_image = docker_image
-        self.sourcefile = Path(sourcefile)
+        self.sourcefile = Path(sourcefile) if sourcefile else None
         self.python_module = python_module
         self.funcname = funcname
         self.name = funcname
         self.execount = 0
         self.num_args = num_args
         self.num_returnvals = num_returnvals
+        self.mapped = False
+        self.output_formats = output_formats
+        self._source_images = {}  # docker images read from source files, by path
+
+    def output_format(self, position):
+        """ The format chosen for a return value, or None for the default (pickle) """
+        if not self.output_formats:
+            return None
+        if len(self.output_formats) == 1:  # one format for all return values
+            return self.output_formats[0]
+        if position < len(self.output_formats):
+            return self.output_formats[position]
+        return None
+
+    def format_options(self):
+        """ runstep.py's ``--format`` options for this function's return values """
+        options = []
+        for position in range(self.num_returnvals or 0):
+            fmt = self.output_format(position)
+            if fmt is not None:
+                options.extend(['--format', '%d:%s' % (position, fmt)])
+        return options
 
     def __str__(self):
         if self.sourcefile:
@@ -50,13 +90,81 @@ class Function(object):
         return '<%s>' % self
 
     def __call__(self, *args):  # , **kwargs): -- kwargs disabled for now
+        """ Add a step that calls this function to the workflow.
+
+        If the function was created without ``num_returnvals``, the number of return values is
+        inferred from the calling code (e.g. ``x, y = fn(a)`` expects two). Pass
+        ``num_returnvals`` when creating the function, or use :meth:`call`, to skip that.
+        """
+        if self.num_returnvals is None:
+            nout = _expecting_args()
+        else:
+            nout = self.num_returnvals
+        return self._add_step(args, nout)
+
+    def call(self, *args, **kwargs):
+        """ Add a step that calls this function, with an explicit number of return values.
+
+        Args:
+            *args: the function's arguments
+            nout (int): number of values the function returns (default: ``num_returnvals``, or
+               1 if that isn't set)
+
+        Returns:
+            StepResult or Tuple[StepResult]: the return value, or a tuple of them if ``nout``
+               isn't 1
+        """
+        nout = kwargs.pop('nout', None)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kwargs))
+        return self._add_step(args, self._resolve_nout(nout))
+
+    def call_many(self, arglists, nout=None):
+        """ Add one step calling this function for each list of arguments.
+
+        This is the fastest way to build large workflows: the number of arguments and return
+        values is only checked once.
+
+        Args:
+            arglists (Iterable[tuple]): arguments for each call
+            nout (int): number of values the function returns (see :meth:`call`)
+
+        Returns:
+            list: the return value (or tuple of return values) of each call, in order
+        """
+        nout = self._resolve_nout(nout)
+        results = []
+        num_args = self.num_args
+        for args in arglists:
+            args = tuple(args)
+            if num_args is None:
+                num_args = self.num_args = len(args)
+            elif len(args) != num_args:
+                raise ValueError('Inconsistent number of arguments for %s' % self)
+            self.execount += 1
+            step = Step(self, args, {}, execount=self.execount)
+            if nout == 1:
+                results.append(step.get_result(0))
+            else:
+                results.append(tuple(step.get_result(i) for i in range(nout)))
+        return results
+
+    def _resolve_nout(self, nout):
+        if nout is None:
+            nout = self.num_returnvals if self.num_returnvals is not None else 1
+        if self.num_returnvals is None:
+            self.num_returnvals = nout
+        elif nout != self.num_returnvals:
+            raise ValueError("Inconsistent number of return values for %s" % self)
+        return nout
+
+    def _add_step(self, args, num_returnvals):
         num_args = len(args)
         if self.num_args is None:
             self.num_args = num_args
         elif num_args != self.num_args:
             raise ValueError('Inconsistent number of arguments for %s' % self)
 
-        num_returnvals = _expecting_args()
         if self.num_returnvals is None:
             self.num_returnvals = num_returnvals
         elif num_returnvals != self.num_returnvals:
@@ -70,12 +178,50 @@ class Function(object):
         else:
             return tuple(step.get_result(i) for i in range(num_returnvals))
 
+    def map(self, sequence, *args, **kwargs):
+        """ Call this function on each item in a list returned by another step.
+
+        Each call gets one item of ``sequence``, followed by ``args``. The calls run as
+        separate jobs (or one job per ``chunksize`` items), and their return values are
+        gathered into a list.
+
+        Args:
+            sequence (StepResult): a list-valued result of another step
+            *args: additional arguments passed to every call
+            chunksize (int): number of items to process in each job (default: 1)
+
+        Returns:
+            StepResult: the list of return values
+        """
+        chunksize = kwargs.pop('chunksize', 1)
+        if kwargs:
+            raise TypeError('Unexpected keyword arguments: %s' % ', '.join(kwargs))
+
+        num_args = len(args) + 1
+        if self.num_args is None:
+            self.num_args = num_args
+        elif num_args != self.num_args:
+            raise ValueError('Inconsistent number of arguments for %s' % self)
+
+        if self.num_returnvals is None:
+            self.num_returnvals = 1
+        elif self.num_returnvals != 1:
+            raise ValueError("Can't map %s - it returns %d values" % (self, self.num_returnvals))
+
+        self.execount += 1
+        self.mapped = True
+        step = MapStep(self, (sequence,) + args, {}, execount=self.execount, chunksize=chunksize)
+        return step.get_result(0)
+
     def get_docker_image(self, rootdir):
         if self._docker_image:
             return self._docker_image
 
         elif self.sourcefile:
-            return _get_docker_image(Path(rootdir) / self.sourcefile)
+            sourcepath = str(Path(rootdir) / self.sourcefile)
+            if sourcepath not in self._source_images:
+                self._source_images[sourcepath] = _get_docker_image(sourcepath)
+            return self._source_images[sourcepath]
 
         else:
             raise ValueError('No docker image specified for this function')
@@ -88,7 +234,7 @@ class Function(object):
         else:
             funcname = self.funcname
 
-        arguments = ['--numreturn', str(self.num_returnvals), funcname]
+        arguments = ['--numreturn', str(self.num_returnvals)] + self.format_options() + [funcname]
         if self.python_module:
             arguments.extend(['--pymodule', self.python_module])
         inputs = self._get_input_cwl()
@@ -98,6 +244,7 @@ class Function(object):
         outputs = {'return.%d.pkl' % i:
                        {'type': "File", 'outputBinding': {'glob': 'return.%d.*' % i}}
                    for i in range(self.num_returnvals)}
+        outputs.update(_cwl_item_outputs(self.num_returnvals))
 
         cwldoc = {'class': 'CommandLineTool',
                   'cwlVersion': 'v1.0',
@@ -122,12 +269,36 @@ class Function(object):
         for i in range(self.num_args):
             inputs['arg_%d' % i] = {'type': 'File',
                                     'inputBinding': {'position': i+4}}
+        inputs['unroll'] = CWL_UNROLL
 
         return inputs
 
+    def to_cwl_gather_tool(self, workflowdir):
+        """ CWL tool that collects the results of this function's scattered map steps into a list
+        """
+        inputs = {'runstep.py': {'type': 'File',
+                                 'inputBinding': {'position': -2},
+                                 'default': {'class': 'File', 'location': './runstep.py'}},
+                  'chunks': {'type': FILEARRAY, 'inputBinding': {'position': 4}},
+                  'unroll': CWL_UNROLL}
+        outputs = {'return.0.pkl': {'type': "File", 'outputBinding': {'glob': 'return.0.*'}}}
+        outputs.update(_cwl_item_outputs(1))
+
+        return {'class': 'CommandLineTool',
+                'cwlVersion': 'v1.0',
+                'baseCommand': ['python'],
+                'inputs': inputs,
+                'arguments': ['--numreturn', '1', '--gather', self.funcname],
+                'requirements': [{'class': 'DockerRequirement',
+                                  'dockerPull': self.get_docker_image(workflowdir)}],
+                'outputs': outputs}
+
     def write_cwl(self, sourcedir, dest):
         with (dest / self.name).with_suffix('.cwl').open('w') as cwlfile:
             yaml.safe_dump(self.to_cwl_tool(sourcedir), cwlfile, allow_unicode=True)
+        if self.mapped:
+            with (dest / (self.name + '.gather.cwl')).open('w') as cwlfile:
+                yaml.safe_dump(self.to_cwl_gather_tool(sourcedir), cwlfile, allow_unicode=True)
 
 
 class ExternalWorkflow(Function):
@@ -137,6 +308,12 @@ class ExternalWorkflow(Function):
         self.execount = 0
 
 
+def _cwl_item_outputs(num_returnvals):
+    return {'return.%d.items' % i: {'type': FILEARRAY,
+                                     'outputBinding': {'glob': 'return.%d/item*.pkl' % i}}
+            for i in range(num_returnvals)}
+
+
 def _get_docker_image(sourcefile):
     """ Not great! But I like the alternatives even less
     """
@@ -156,12 +333,12 @@ def _expecting_args():
     """
     import sys, dis
 
-    if sys.version_info.major == 2:
-        get_ord = ord
-    else:
-        get_ord = lambda x: x
-
     f = sys._getframe().f_back.f_back
+    if hasattr(dis, 'get_instructions'):  # python 3.4+
+        return _expecting_args_py3(f.f_code, f.f_lasti)
+
+    get_ord = ord
+
     i = f.f_lasti + 3
     bytecode = f.f_code.co_code
     instruction = get_ord(bytecode[i])
@@ -177,3 +354,43 @@ def _expecting_args():
         if instruction == dis.opmap['UNPACK_SEQUENCE']:
             return get_ord(bytecode[i + 1])
         return 1  #amvmod - always return at least 1
+
+
+_CALL_SITES = weakref.WeakKeyDictionary()  # code object -> {offset of a call: values expected}
+_INSTRUCTIONS = []  # [code object, its instructions, their offsets] for the last code object
+
+
+def _expecting_args_py3(code, lasti):
+    """ Python 3 version of :func:`_expecting_args`, using :func:`dis.get_instructions`, so it
+    doesn't depend on the bytecode's layout, which changes with every python version.
+
+    Workflows often call functions in loops, so the result for each call site is memoized
+    (for as long as its code object exists). Consecutive calls usually come from the same code
+    object (e.g., a whole workflow.py with thousands of calls), so its disassembly is kept
+    until a call comes from another one.
+    """
+    import bisect, dis, itertools
+
+    sites = _CALL_SITES.setdefault(code, {})
+    if lasti not in sites:
+        if not _INSTRUCTIONS or _INSTRUCTIONS[0] is not code:
+            instructions = [instruction for instruction in dis.get_instructions(code)
+                            if instruction.opname != 'CACHE']
+            _INSTRUCTIONS[:] = [code, instructions, [i.offset for i in instructions]]
+        _, instructions, offsets = _INSTRUCTIONS
+        following = itertools.islice(instructions, bisect.bisect_right(offsets, lasti), None)
+        nout = 1
+        duplicated = False
+        for instruction in following:
+            # in chained assignments (``x = y, z = fn()``), the value is duplicated and stored
+            if instruction.opname in ('DUP_TOP', 'COPY'):
+                duplicated = True
+                continue
+            if duplicated and instruction.opname.startswith('STORE_'):
+                duplicated = False
+                continue
+            if instruction.opname == 'UNPACK_SEQUENCE':
+                nout = instruction.argval
+            break
+        sites[lasti] = nout
+    return sites[lasti]
@@ -0,0 +1,131 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from array import array
+
+from .datasources import ExternalInput
+from .steps import StepResult
+
+
+class StepGraph(object):
+    """ Indexed dependency graph of the steps that a workflow's outputs depend on.
+
+    Steps are numbered in topological order (every step comes after the steps whose results
+    it uses), and each step's upstream and downstream steps are stored as arrays of those
+    numbers. The graph is built without recursion, so it handles arbitrarily deep chains.
+
+    :class:`molflow.definitions.WorkflowDefinition` builds its graph when it's first needed,
+    and rebuilds it only after its outputs change.
+
+    Args:
+        sources (Iterable[StepResult]): the workflow's outputs
+    """
+    __slots__ = ('steps', 'ids', '_inputs', '_up_offsets', '_up', '_down_offsets', '_down')
+
+    def __init__(self, sources):
+        self.steps = []  # in topological order
+        self.ids = {}  # step -> its position in self.steps
+        self._inputs = {}  # step -> workflow inputs it uses (only for steps that use any)
+
+        upstream = []
+        for source in sources:
+            self._visit(source.step, upstream)
+        self._up_offsets, self._up = _compress(upstream)
+
+        downstream = [[] for step in self.steps]
+        for stepid, deps in enumerate(upstream):
+            for dep in deps:
+                downstream[dep].append(stepid)
+        self._down_offsets, self._down = _compress(downstream)
+
+    def _visit(self, root, upstream):
+        """ Number ``root`` and the steps upstream of it, in depth-first post-order """
+        if root in self.ids:
+            return
+        onstack = set([root])
+        stack = [(root, iter(root.args))]
+        while stack:
+            step, args = stack[-1]
+            for arg in args:
+                if isinstance(arg, StepResult) and arg.step not in self.ids:
+                    if arg.step in onstack:
+                        raise ValueError('%s depends on its own results' % arg.step)
+                    onstack.add(arg.step)
+                    stack.append((arg.step, iter(arg.step.args)))
+                    break
+            else:
+                stack.pop()
+                onstack.discard(step)
+                deps = []
+                inputs = []
+                for arg in step.args:
+                    if isinstance(arg, StepResult):
+                        depid = self.ids[arg.step]
+                        if depid not in deps:
+                            deps.append(depid)
+                    elif isinstance(arg, ExternalInput) and arg not in inputs:
+                        inputs.append(arg)
+                self.ids[step] = len(self.steps)
+                self.steps.append(step)
+                upstream.append(deps)
+                if inputs:
+                    self._inputs[step] = inputs
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __iter__(self):
+        return iter(self.steps)
+
+    def __contains__(self, step):
+        return step in self.ids
+
+    def upstream_ids(self, stepid):
+        return self._up[self._up_offsets[stepid]:self._up_offsets[stepid + 1]]
+
+    def downstream_ids(self, stepid):
+        return self._down[self._down_offsets[stepid]:self._down_offsets[stepid + 1]]
+
+    def upstream(self, step):
+        """ The steps whose results ``step`` uses """
+        return [self.steps[i] for i in self.upstream_ids(self.ids[step])]
+
+    def downstream(self, step):
+        """ The steps that use the results of ``step`` """
+        return [self.steps[i] for i in self.downstream_ids(self.ids[step])]
+
+    def num_upstream(self, step):
+        stepid = self.ids[step]
+        return self._up_offsets[stepid + 1] - self._up_offsets[stepid]
+
+    def inputs(self, step):
+        """ The workflow inputs that ``step`` uses """
+        return list(self._inputs.get(step, ()))
+
+    def dependencies(self):
+        """ The graph as a dict of the form ``{step: {upstream steps and workflow inputs}}``,
+        in topological order
+        """
+        return {step: set(self.upstream(step) + self.inputs(step)) for step in self.steps}
+
+
+def _compress(lists):
+    """ Store a list of lists of integers as two arrays: where each list starts, and all of the
+    lists' items back to back """
+    offsets = array('l', [0])
+    items = array('l')
+    for entries in lists:
+        items.extend(entries)
+        offsets.append(len(items))
+    return offsets, items
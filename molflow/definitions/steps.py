@@ -15,11 +15,16 @@
 class Step(object):
     """ An execution of a function
     """
+    __slots__ = ('fn', 'args', 'fnexecount', 'unroll', 'tag', 'profile')
+
     def __init__(self, fn, args, kwargs, execount):
         self.fn = fn
         self.args = args
         #self.kwargs = kwargs
         self.fnexecount = execount
+        self.unroll = set()  # positions of return values that map steps scatter over
+        self.tag = None  # distinguishes copies of this step, e.g., in parameter sweeps
+        self.profile = None  # "cpu" or "memory" to profile this step when it runs
 
     def __str__(self):
         return "'%s' execution %d" % (self.fn.name, self.fnexecount)
@@ -28,7 +33,10 @@ class Step(object):
         return "<%s>" % self
 
     def _label(self):
-        return '%s.%d' % (self.fn.name, self.fnexecount)
+        if self.tag is None:
+            return '%s.%d' % (self.fn.name, self.fnexecount)
+        else:
+            return '%s.%d@%s' % (self.fn.name, self.fnexecount, self.tag)
 
     def get_result(self, position):
         return StepResult(self, position=position)
@@ -36,18 +44,75 @@ class Step(object):
     def to_cwl(self):
         inputs = {'arg_%d' % i: arg.to_cwl() for i, arg in enumerate(self.args)}
         outputs = ['return.%d.pkl' % i for i in range(self.fn.num_returnvals)]
+        if self.unroll:
+            inputs['unroll'] = {'default': sorted(self.unroll)}
+            outputs.extend('return.%d.items' % i for i in sorted(self.unroll))
+
+        return {'run': self.fn.name+'.cwl',
+                'in': inputs,
+                'out': outputs}
+
+    def _cwl_output(self, position, items=False):
+        """ CWL source for one of this step's return values (or, with ``items``, for the list
+        of files holding its unrolled items)
+        """
+        return '%s/return.%d.%s' % (self._label(), position, 'items' if items else 'pkl')
+
+
+class MapStep(Step):
+    """ An execution of a function for each item of a list returned by another step.
+
+    The number of items isn't known until the upstream step has run, so the runner expands this
+    step at run time into one job per ``chunksize`` items, and then gathers their return
+    values into a single list, in order.
+    """
+    __slots__ = ('chunksize',)
+
+    def __init__(self, fn, args, kwargs, execount, chunksize=1):
+        if not isinstance(args[0], StepResult):
+            raise ValueError('%s can only map over the results of another step' % fn)
+        super(MapStep, self).__init__(fn, args, kwargs, execount)
+        self.chunksize = chunksize
+        args[0].step.unroll.add(args[0].position)
+
+    def __str__(self):
+        return "'%s' mapping %d" % (self.fn.name, self.fnexecount)
+
+    def to_cwl(self):
+        """ CWL for the scatter half of this step. Each item runs as its own job; the
+        ``chunksize`` only applies when running locally.
+        """
+        sequence = self.args[0]
+        inputs = {'arg_0': sequence.step._cwl_output(sequence.position, items=True)}
+        inputs.update(('arg_%d' % i, arg.to_cwl()) for i, arg in enumerate(self.args)
+                      if i > 0)
 
         return {'run': self.fn.name+'.cwl',
+                'in': inputs,
+                'scatter': 'arg_0',
+                'out': ['return.0.pkl']}
+
+    def gather_to_cwl(self):
+        inputs = {'chunks': '%s/return.0.pkl' % self._label()}
+        outputs = ['return.0.pkl']
+        if self.unroll:
+            inputs['unroll'] = {'default': sorted(self.unroll)}
+            outputs.append('return.0.items')
+
+        return {'run': self.fn.name+'.gather.cwl',
                 'in': inputs,
                 'out': outputs}
 
+    def _cwl_output(self, position, items=False):
+        return '%s.gather/return.%d.%s' % (self._label(), position, 'items' if items else 'pkl')
 
 
 class StepResult(object):
+    __slots__ = ('step', 'position')
+
     def __init__(self, step, position):
         self.step = step
         self.position = position
 
     def to_cwl(self):
-        return '%s/return.%d.pkl' % (self.step._label(), self.position)
-
+        return self.step._cwl_output(self.position)
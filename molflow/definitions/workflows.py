@@ -16,6 +16,8 @@ from __future__ import print_function
 from collections import OrderedDict
 
 from . import datasources as data
+from .graph import StepGraph
+from .steps import MapStep
 
 
 class WorkflowDefinition(object):
@@ -39,6 +41,7 @@ class WorkflowDefinition(object):
         self.outputs = OrderedDict()
         self.metadata = metadata
         self.definition_path = None
+        self._graph = None
 
     def __repr__(self):
         try:
@@ -47,12 +50,23 @@ class WorkflowDefinition(object):
         except:
             return "<WorkflowDefinition object at %s>" % id(self)
 
+    @property
+    def graph(self):
+        """ StepGraph: the steps that the outputs depend on, and how they're connected
+
+        This is built when first needed, and again after the outputs change.
+        """
+        if self._graph is None:
+            self._graph = StepGraph(outputdata.source for outputdata in self.outputs.values())
+        return self._graph
+
     @property
     def num_steps(self):
-        return len(self._get_dag(False))
+        return len(self.graph)
 
     def steps(self):
-        return self._get_dag(False).keys()
+        """ The steps, in topological order """
+        return list(self.graph)
 
     def functions(self):
         return set(step.fn for step in self.steps())
@@ -91,18 +105,24 @@ class WorkflowDefinition(object):
                              'an output with this name already exists.')
 
         self.outputs[name] = data.WorkflowOutput(name, self, source, description, type)
+        self._graph = None
 
     def to_cwl(self):
         inputs = {key: 'File' for key in self.inputs}
         outputs = {key: {'outputSource': outputdata.source.to_cwl(), 'type': 'File'}
                    for key, outputdata in self.outputs.items()}
-        steps = {step._label(): step.to_cwl() for step in self.steps()}
+        steps = {step._label(): step.to_cwl() for step in self.graph}
+        mapsteps = [step for step in self.graph if isinstance(step, MapStep)]
+        for step in mapsteps:
+            steps[step._label() + '.gather'] = step.gather_to_cwl()
 
         cwldoc = {'class': 'Workflow',
                   'cwlVersion': 'v1.0',
                   'inputs': inputs,
                   'outputs': outputs,
                   'steps': steps}
+        if mapsteps:
+            cwldoc['requirements'] = [{'class': 'ScatterFeatureRequirement'}]
 
         return cwldoc
 
@@ -130,53 +150,28 @@ class WorkflowDefinition(object):
         steps[step] = {dep1, dep2, ...}
         """
         # TODO: deal with function name collisions
-
-        dependencies = {}
-        def dive(step):
-            if step in dependencies:
-                return
-            else:
-                dependencies[step] = set()
-
-            for arg in step.args:  # kwargs?
-                if isinstance(arg, data.ExternalInput):
-                    upstream = arg
-                    candive = False
-                elif hasattr(arg, 'step'):
-                    candive = True
-                    upstream = arg.step
-                else:
-                    continue  # not a step or input data so assume it's static data
-
-                if upstream in dependencies[step]:
-                    continue
-                else:
-                    dependencies[step].add(upstream)
-                    if candive:
-                        dive(arg.step)
-
-        for outputdata in self.outputs.values():
-            dive(outputdata.source.step)
-            if with_data:
+        dependencies = self.graph.dependencies()
+        if with_data:
+            for outputdata in self.outputs.values():
                 dependencies[outputdata] = set([outputdata.source.step])
-
         return dependencies
 
     def _to_graphviz(self):
         from graphviz import Digraph
         graph = Digraph(repr(self), graph_attr={'fontsize': '10', 'size':'7'})
-        steps = self._get_dag(with_data=True)
 
-        for step in steps:
+        for step in self.graph:
             graph.node(step._label(), shape='rectangle')
         for inputdata in self.inputs.values():
             graph.node(inputdata._label(), shape='oval', color='orange')
         for outputdata in self.outputs.values():
             graph.node(outputdata._label(), shape='oval', color='blue')
 
-        for step, dependencies in steps.items():
-            for dep in dependencies:
+        for step in self.graph:
+            for dep in self.graph.upstream(step) + self.graph.inputs(step):
                 graph.edge(dep._label(), step._label())
+        for outputdata in self.outputs.values():
+            graph.edge(outputdata.source.step._label(), outputdata._label())
         return graph
 
     def draw(self):
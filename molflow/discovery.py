@@ -0,0 +1,183 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Discovering workflows, and an on-disk index of what's been discovered.
+
+Without the index, every command lists every workflow search path, checks each subdirectory
+for ``workflow.py`` and ``metadata.yml``, and parses the YAML metadata of each workflow it
+touches. The index (``~/.molflow/workflow_index.pkl``) remembers all of that, along with the
+inputs and outputs declared by each ``workflow.py`` (which would otherwise have to be
+executed), and the tags and branches of each workflow's git repository. Entries are
+invalidated by the modification times of the search paths, their subdirectories, and the
+files they were read from (for git, the repository's ``HEAD``, ``refs`` and ``packed-refs``).
+"""
+import os
+import pickle
+from pathlib import Path
+
+from .utils import atomic_write
+
+INDEX_FORMAT = 1  # increment to discard existing indexes
+INDEX_FILENAME = 'workflow_index.pkl'
+
+
+def find_workflows(searchpath):
+    """ The workflow directories (containing ``workflow.py`` and ``metadata.yml``) in a path
+    """
+    return [item for item in sorted(Path(searchpath).iterdir())
+            if item.is_dir() and is_workflow_dir(item)]
+
+
+def is_workflow_dir(path):
+    return (path / 'workflow.py').exists() and (path / 'metadata.yml').exists()
+
+
+def read_metadata(path):
+    """ Parse a workflow's ``metadata.yml``, with libyaml's fast parser if it's available
+    """
+    import yaml
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with Path(path).open('r') as ymlfile:
+        metadata = yaml.load(ymlfile, Loader=loader)
+    return metadata if metadata is not None else {}
+
+
+class WorkflowIndex(object):
+    """ Cache of discovered workflows, their metadata, and their declared inputs and outputs
+
+    Args:
+        path (str): index file location
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        self._changed = False
+        self._data = self._load()
+
+    def _load(self):
+        try:
+            with self.path.open('rb') as indexfile:
+                data = pickle.load(indexfile)
+        except Exception:  # missing, unreadable, or written by an incompatible version
+            data = None
+        if not isinstance(data, dict) or data.get('format') != INDEX_FORMAT:
+            data = {'format': INDEX_FORMAT, 'searchpaths': {}, 'workflows': {}}
+        return data
+
+    def find_workflows(self, searchpath):
+        """ Like :func:`find_workflows`, but only re-examines subdirectories that changed
+
+        If the search path itself hasn't changed (no subdirectories added, removed or
+        renamed), it isn't listed again, and only its subdirectories are checked.
+        """
+        searchpath = Path(searchpath)
+        key = _key(searchpath)
+        mtime = file_mtime(searchpath)
+        entry = self._data['searchpaths'].get(key)
+        if entry is None or entry['mtime'] != mtime:
+            names = sorted(item.name for item in searchpath.iterdir())
+            cached = entry['subdirs'] if entry is not None else {}
+        else:
+            names = list(entry['subdirs'])
+            cached = entry['subdirs']
+
+        subdirs = {}
+        for name in names:
+            subdir = searchpath / name
+            subdir_mtime = file_mtime(subdir)
+            if subdir_mtime is None:
+                continue
+            elif name in cached and cached[name][0] == subdir_mtime:
+                subdirs[name] = cached[name]
+            elif subdir.is_dir():
+                subdirs[name] = (subdir_mtime, is_workflow_dir(subdir))
+
+        if entry is None or entry['mtime'] != mtime or entry['subdirs'] != subdirs:
+            self._data['searchpaths'][key] = {'mtime': mtime, 'subdirs': subdirs}
+            self._changed = True
+        return [searchpath / name for name, (_, isworkflow) in subdirs.items() if isworkflow]
+
+    def metadata(self, workflowdir):
+        """ A workflow's parsed ``metadata.yml``, only re-read if the file has changed
+        """
+        path = Path(workflowdir) / 'metadata.yml'
+        entry = self._entry(workflowdir)
+        mtime = file_mtime(path)
+        if 'metadata' not in entry or entry['metadata_mtime'] != mtime:
+            entry['metadata'] = read_metadata(path) if mtime is not None else {}
+            entry['metadata_mtime'] = mtime
+            self._changed = True
+        return entry['metadata']
+
+    def interface(self, workflowdir):
+        """ The inputs and outputs declared by a workflow, as recorded by
+        :meth:`record_interface`
+
+        Returns:
+            Tuple[list, list]: descriptions of the inputs and outputs (see
+               :class:`molflow.config.WorkflowMetadata`), or None if they weren't recorded or
+               ``workflow.py`` changed since
+        """
+        entry = self._entry(workflowdir)
+        if 'inputs' in entry and entry['workflow_mtime'] == file_mtime(Path(workflowdir) /
+                                                                     'workflow.py'):
+            return entry['inputs'], entry['outputs']
+        return None
+
+    def record_interface(self, workflowdir, inputs, outputs):
+        entry = self._entry(workflowdir)
+        entry['workflow_mtime'] = file_mtime(Path(workflowdir) / 'workflow.py')
+        entry['inputs'] = inputs
+        entry['outputs'] = outputs
+        self._changed = True
+
+    def versions(self, workflowdir, key):
+        """ A workflow's git tags and branches, as recorded by :meth:`record_versions`, or None
+        if they weren't recorded or the repository's refs changed since (i.e., ``key`` is
+        different; see :func:`molflow.versioning.refs_key`)
+        """
+        entry = self._entry(workflowdir)
+        if 'refs' in entry and entry['refs_key'] == key:
+            return entry['refs']
+        return None
+
+    def record_versions(self, workflowdir, key, refs):
+        entry = self._entry(workflowdir)
+        entry['refs_key'] = key
+        entry['refs'] = refs
+        self._changed = True
+
+    def save(self):
+        """ Write the index, if anything changed, replacing the file atomically
+        """
+        if not self._changed:
+            return
+        if atomic_write(self.path, pickle.dumps(self._data, protocol=2)):
+            self._changed = False
+
+    def _entry(self, workflowdir):
+        return self._data['workflows'].setdefault(_key(workflowdir), {})
+
+
+def _key(path):
+    """ Relative search paths (like "./") depend on the working directory """
+    return os.path.abspath(str(path))
+
+
+def file_mtime(path):
+    """ A file's modification time (in ns where available), or None if it doesn't exist """
+    try:
+        stat = os.stat(str(path))
+    except OSError:
+        return None
+    return getattr(stat, 'st_mtime_ns', stat.st_mtime)
@@ -26,14 +26,19 @@ def list_workflows(args):
 
     cfg = config.configuration
 
+    listed = collections.OrderedDict()
+    for config_path in cfg.config_paths:
+        listed[config_path] = [workflow for workflow
+                               in cfg.get_local_workflows_by_config_path( config_path )
+                               if workflow.metadata.matches(args.keywords)]
+    config.load_versions( [workflow for workflows in listed.values() for workflow in workflows] )
+
     for config_path in cfg.config_paths:
         workflows = cfg.get_local_workflows_by_config_path( config_path )
         if len(workflows) > 0:
             print('Workflow location: {}'.format(formatting.pretty_path(config_path)))
-            for workflow in workflows:
+            for workflow in listed[config_path]:
                 meta = workflow.metadata
-                if not meta.matches(args.keywords):
-                    continue
                 cprint(' - {name} ({version}): {description}'.format(
                     name=colored(meta.metadata.get('name',workflow.name+' [Unnamed]'), 'green'),
                     description=meta.metadata.get('description','No Description'),
@@ -47,8 +52,7 @@ def print_metadata(args):
     cfg = config.configuration
     workflow_config = config.configuration.get_workflow_by_name( args.workflow_name )
 
-    workflow = workflow_config.workflow  # This is important though unused, as having the actual workflow loads extra data about inputs and outputs into the metadata.    
-    wflowdata = workflow_config.metadata
+    wflowdata = workflow_config.load_interface()  # includes the workflow's inputs and outputs
 
     writedata = collections.OrderedDict()
     written = set()
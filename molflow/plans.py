@@ -0,0 +1,152 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Cache of workflow plans: the workflow definitions built by running ``workflow.py``.
+
+Loading a workflow normally means executing its ``workflow.py``, which imports the workflow's
+dependencies, inspects the caller's bytecode at every function call to count return values,
+and reads each function's source file to find its docker image. A plan is the resulting
+:class:`molflow.definitions.WorkflowDefinition` (its steps, how they're wired together,
+their return counts and docker images, and the workflow's inputs and outputs), pickled into
+``~/.molflow/plans``.
+
+Plans are stored under a hash of ``workflow.py``. Each one also records the hashes of the
+workflow's other python files and its functions' source files, and is only used if none of
+them have changed.
+"""
+import hashlib
+import os
+import pickle
+import sys
+from pathlib import Path
+
+from .utils import atomic_write
+
+PLAN_FORMAT = 1  # increment to discard existing plans
+PLAN_PROTOCOL = 2
+
+
+class PlanCache(object):
+    """ Stores and loads workflow plans
+
+    Args:
+        path (str): cache directory
+    """
+    def __init__(self, path):
+        self.path = Path(os.path.expanduser(str(path)))
+
+    def load(self, workflowdir):
+        """ Get the plan for the workflow defined in a directory
+
+        Returns:
+            molflow.definitions.WorkflowDefinition: the workflow, or None if there's no plan for
+               the current version of its files
+        """
+        workflowdir = Path(workflowdir)
+        planfile = self._plan_path(workflowdir)
+        if planfile is None or not planfile.is_file():
+            return None
+        try:
+            with planfile.open('rb') as infile:
+                plan = pickle.load(infile)
+        except Exception:  # unreadable, or refers to something that can't be imported anymore
+            return None
+        if not isinstance(plan, dict) or plan.get('format') != PLAN_FORMAT:
+            return None
+        if _file_digests(workflowdir, plan['files']) != plan['files']:
+            return None
+        if any(str(path.relative_to(workflowdir)) not in plan['files']
+               for path in _python_files(workflowdir)):
+            return None  # a new module, which workflow.py may import instead of another
+        return plan['workflow']
+
+    def save(self, workflowdir, workflow):
+        """ Store a workflow's plan
+
+        This resolves its functions' docker images first, so they're stored in the plan.
+        Workflows that can't be pickled (e.g., with a lambda as an input's default value)
+        aren't stored.
+
+        Returns:
+            bool: whether the plan was stored
+        """
+        workflowdir = Path(workflowdir)
+        planfile = self._plan_path(workflowdir)
+        if planfile is None:
+            return False
+
+        files = [str(path.relative_to(workflowdir)) for path in _python_files(workflowdir)]
+        for fn in workflow.functions():
+            if getattr(fn, 'sourcefile', None) is not None:
+                fn.get_docker_image(workflowdir)
+                files.append(str(fn.sourcefile))
+        plan = {'format': PLAN_FORMAT,
+                'workflow': workflow,
+                'files': _file_digests(workflowdir, files)}
+
+        try:
+            data = pickle.dumps(plan, protocol=PLAN_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError, RuntimeError):
+            return False  # RuntimeError: exceeded the recursion limit on a very deep graph
+
+        return atomic_write(planfile, data)
+
+    def _plan_path(self, workflowdir):
+        hasher = hashlib.sha256()
+        hasher.update(('plan:%d:python%d.%d:' % ((PLAN_FORMAT,) + sys.version_info[:2])
+                       ).encode('utf-8'))
+        hasher.update(_definitions_digest().encode('utf-8'))
+        try:
+            with (workflowdir / 'workflow.py').open('rb') as wflowfile:
+                hasher.update(wflowfile.read())
+        except (IOError, OSError):
+            return None
+        return self.path / (hasher.hexdigest() + '.pkl')
+
+
+def _python_files(workflowdir):
+    """ Python files that workflow.py may import, including those in subdirectories (but not
+    hidden ones, such as .git)
+    """
+    return sorted(path for path in workflowdir.rglob('*.py')
+                  if not any(part.startswith('.')
+                             for part in path.relative_to(workflowdir).parts))
+
+
+def _file_digests(workflowdir, paths):
+    digests = {}
+    for path in paths:
+        try:
+            with (workflowdir / path).open('rb') as infile:
+                digests[path] = hashlib.sha256(infile.read()).hexdigest()
+        except (IOError, OSError):
+            digests[path] = None
+    return digests
+
+
+_DEFINITIONS_DIGEST = None
+
+
+def _definitions_digest():
+    """ Identifies the version of the classes that plans are made of, whose pickles may not be
+    compatible with other versions """
+    global _DEFINITIONS_DIGEST
+    if _DEFINITIONS_DIGEST is None:
+        from . import definitions
+        hasher = hashlib.sha256()
+        for path in sorted(Path(definitions.__file__).parent.glob('*.py')):
+            with path.open('rb') as infile:
+                hasher.update(infile.read())
+        _DEFINITIONS_DIGEST = hasher.hexdigest()
+    return _DEFINITIONS_DIGEST
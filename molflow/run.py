@@ -25,32 +25,100 @@ from . import convert, formatting
 from .config import configuration
 from .serializers import SERIALIZERS, EXTENSIONS
 from .convert import translate_cli_input, get_converter
+from .static.runstep import loads_value, to_pickle
 
 EXECUTOR = str(Path(__file__).parents[0]/'static'/'runstep.py')
 
 
 def run_workflow(args):
     from .runners.localrunner import LocalRunner
+    from .runners.localstep import ENGINES
+    from .runners.cache import StepCache
+    from .runners.journal import RunJournal
+    from .runners.sweep import read_sweep_file, sweep_workflow
+    from .runners.tracing import RunTrace
+    from .runners.resources import DurationHistory, format_resource_table
+    from .runners.profiling import StepProfiler
 
     # Set up inputs and output destination
     workflow_config = configuration.get_workflow_by_name(args.workflow_name)
+    workflow_config = workflow_config.at_version(args.version)
     workflow = workflow_config.workflow
-    if args.version is not None:
-        workflow_config.versions.select_version( args.version )
+    if args.sweep:
+        if args.inputs:
+            formatting.fail('Pass inputs either on the command line or with "--sweep", '
+                            'not both.')
+        rows = get_sweep_inputs(workflow, read_sweep_file(args.sweep, workflow))
+        runworkflow, inputs, row_outputs = sweep_workflow(workflow, rows)
+        print('Sweeping %d input sets: %d steps to run (%d without sharing)'
+              % (len(rows), runworkflow.num_steps, len(rows) * workflow.num_steps))
     else:
-        workflow_config.versions.select_default_version()
-    inputs = get_inputs(workflow, args)
-    outputpath = setup_output_dir(args.outputdir, workflow, args.overwrite)
+        runworkflow, inputs, row_outputs = workflow, get_inputs(workflow, args), None
+    outputpath = setup_output_dir(args.outputdir, workflow, args.overwrite, args.resume)
 
     # Run it
-    workflow.check_inputs(inputs)
-    runner = LocalRunner(workflow, inputs, args.maxcpus, 2,
-                         datadir=outputpath if args.saveall else None)
-    runner.run()
+    runworkflow.check_inputs(inputs)
+    if args.resume and not ENGINES[args.engine].supports_caching:
+        formatting.fail('Runs with "--engine %s" can\'t be resumed; it doesn\'t store step '
+                        'results.' % args.engine)
+    cache = None if args.no_cache else StepCache(refresh=args.refresh)
+    history = DurationHistory()
+    engine = make_engine(args)
+    journal = RunJournal(outputpath, resume=args.resume) if engine.supports_caching else None
+    trace = RunTrace() if args.trace else None
+    profiler = None
+    if args.profile_step or args.profile_function:
+        if args.engine == 'pool':
+            formatting.fail('Steps can\'t be profiled with "--engine pool".')
+        profiler = StepProfiler(args.profile_step, args.profile_function,
+                                memory=args.profile_memory, outputdir=outputpath)
+    try:
+        runner = LocalRunner(runworkflow, inputs, args.maxcpus, 2,
+                             datadir=outputpath if args.saveall else None,
+                             schedule=args.schedule, durations=history.durations,
+                             cache=cache,
+                             journal=journal,
+                             engine=engine, fuse=args.fuse, trace=trace, profiler=profiler)
+        runner.run()
+        history.update(runner.function_times)
+        history.save()
+        if runner.step_stats:
+            print('Steps that used the most resources:')
+            print(format_resource_table(runner.step_stats) + '\n')
 
-    # Write outputs
-    outputs = {key: f.open('rb').read() for key, f in runner.output_files.items()}
-    write_outputs(outputpath, workflow, outputs)
+        # Write outputs
+        outputs = {key: to_pickle(f.open('rb').read(), runner.output_formats[key],
+                                  pickle.HIGHEST_PROTOCOL)
+                   for key, f in runner.output_files.items()}
+    finally:
+        engine.shutdown()
+        if trace is not None:
+            trace.write(args.trace)
+            print('Wrote timing trace to %s' % args.trace)
+
+    if row_outputs is None:
+        write_outputs(outputpath, workflow, outputs)
+    else:
+        for rowid, names in row_outputs.items():
+            rowpath = outputpath / rowid
+            if not rowpath.exists():
+                rowpath.mkdir()
+            write_outputs(rowpath, workflow,
+                          {name: outputs[mergedname] for name, mergedname in names.items()})
+
+
+def make_engine(args):
+    from .runners.localstep import get_engine
+
+    if args.engine == 'pool':
+        if args.python:
+            formatting.fail('The pool engine always runs steps with the python interpreter '
+                            'running molflow; "--python" is not supported.')
+        return get_engine('pool', maxworkers=args.maxcpus)
+    elif args.engine == 'docker-pool':
+        return get_engine('docker-pool', maxworkers=args.maxcpus, python=args.python)
+    else:
+        return get_engine(args.engine, python=args.python)
 
 
 def get_inputs(workflow, args):
@@ -65,7 +133,43 @@ def get_inputs(workflow, args):
     return inputs
 
 
-def setup_output_dir(dirpath, workflow, overwrite=False):
+def get_sweep_inputs(workflow, rows):
+    """ Translate the inputs for each row of a parameter sweep.
+
+    Inputs that a row doesn't list take their default values. Each distinct value is only
+    translated once, however many rows use it.
+
+    Args:
+        workflow (molflow.definitions.WorkflowDefinition): the workflow
+        rows (List[Tuple[str, Mapping[str, str]]]): each row's ID and command line inputs
+
+    Returns:
+        List[Tuple[str, Dict[str, bytes]]]: each row's ID and translated inputs
+    """
+    translated = {}
+    sweep = []
+    for rowid, fields in rows:
+        unknown = set(fields) - set(workflow.inputs)
+        if unknown:
+            raise ValueError('Sweep row "%s" has inputs that workflow %s doesn\'t recognize: %s'
+                             % (rowid, workflow.name, ', '.join(sorted(unknown))))
+
+        inputs = {}
+        for name, spec in workflow.inputs.items():
+            if name in fields:
+                clidata = fields[name]
+            elif spec.default is not None:
+                clidata = str(spec.default)
+            else:
+                raise ValueError('Sweep row "%s" is missing input "%s"' % (rowid, name))
+            if (name, clidata) not in translated:
+                translated[name, clidata] = translate_cli_input(clidata, spec.type)
+            inputs[name] = translated[name, clidata]
+        sweep.append((rowid, inputs))
+    return sweep
+
+
+def setup_output_dir(dirpath, workflow, overwrite=False, resume=False):
     cwd = Path('./').absolute()
 
     if dirpath is None:
@@ -78,7 +182,9 @@ def setup_output_dir(dirpath, workflow, overwrite=False):
     if abspath in cwd.parents:
         raise IOError("Molflow cannot write output to a parent of the current working directory")
 
-    if cwd != abspath and dirpath.exists() and os.listdir(str(dirpath)):
+    if resume:  # keep the previous run's results in place
+        pass
+    elif cwd != abspath and dirpath.exists() and os.listdir(str(dirpath)):
         if not overwrite:
             formatting.fail(("Workflow output directory '%s' already exists. Specify a "
                             "different directory with '-o' or overwrite it with "
@@ -148,7 +254,7 @@ def write_outputs(outputpath, workflow, outputs):
                                                  'output_format': dtype})
             runner.run()
             data = runner.output_files['result']
-            as_str = pickle.loads(data.read())
+            as_str = loads_value(data.read())
             with fpath.open('wb') as outfile:
                 outfile.write(as_str)
             files.append(fpath)
@@ -0,0 +1,286 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Persistent, content-addressed cache of workflow step results.
+
+A step's results are stored under a hash of everything that determines them: the function's
+source code (or module name), its docker image, the number of values it returns, and the
+contents of each of its input files. Entries are evicted least-recently-used first once the
+cache grows past its size limit.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from ..definitions.steps import MapStep
+from ..run import EXECUTOR
+
+CACHE_FORMAT = 1  # increment to invalidate all existing cache entries
+DEFAULT_CACHE_DIR = '~/.molflow/cache'
+DEFAULT_MAX_BYTES = 10 * 1024**3
+
+
+class ContentDigests(object):
+    """ Memoized sha256 digests of step input files.
+
+    Results are often passed to several downstream steps, so each file is only read once.
+    """
+    def __init__(self):
+        self._digests = {}
+        self._paths = {}
+
+    def __call__(self, fileobj):
+        """
+        Args:
+            fileobj (bytes or pyccc.files.FileReferenceBase): file contents or reference
+        """
+        if isinstance(fileobj, bytes):
+            return hashlib.sha256(fileobj).hexdigest()
+        if id(fileobj) not in self._digests:
+            hasher = hashlib.sha256()
+            with fileobj.open('rb') as infile:
+                for chunk in iter(lambda: infile.read(1024**2), b''):
+                    hasher.update(chunk)
+            # keep a reference to the object so that its id isn't reused
+            self._digests[id(fileobj)] = (fileobj, hasher.hexdigest())
+        return self._digests[id(fileobj)][1]
+
+    def path(self, path):
+        path = str(path)
+        if path not in self._paths:
+            hasher = hashlib.sha256()
+            with open(path, 'rb') as infile:
+                hasher.update(infile.read())
+            self._paths[path] = hasher.hexdigest()
+        return self._paths[path]
+
+
+def step_key(step, defdir, input_digests, digests, engine_tag='docker', images=True):
+    """ Calculate a key that identifies the results of running ``step`` on the given inputs
+
+    Args:
+        step (molflow.definitions.Step): the step to run
+        defdir (pathlib.Path): the workflow's definition directory
+        input_digests (List[str]): digests of the step's input files
+        digests (ContentDigests): digest memo used for the function's source file
+        engine_tag (str): identifies the environment the step runs in (see
+           :attr:`molflow.runners.localstep.DockerEngine.cache_tag`)
+        images (bool): whether the step runs in its function's docker image (otherwise,
+           ``engine_tag`` identifies the interpreter that runs it)
+
+    Returns:
+        str: hex digest identifying this step's results
+    """
+    fn = step.fn
+    hasher = hashlib.sha256()
+    fields = ['format:%d' % CACHE_FORMAT,
+              'executor:%s' % digests.path(EXECUTOR),
+              'function:%s' % fn.funcname]
+    if images:
+        fields.append('image:%s' % fn.get_docker_image(defdir))
+    fields.extend(['engine:%s' % engine_tag,
+                   'numreturn:%s' % fn.num_returnvals])
+    if step.unroll:
+        fields.append('unroll:%s' % ','.join(str(pos) for pos in sorted(step.unroll)))
+    if isinstance(step, MapStep):  # gathers the results of its chunks
+        fields.append('gather')
+    elif getattr(step, 'mapitems', None) is not None:
+        fields.append('mapitems:%d' % step.mapitems)
+    elif fn.format_options():
+        fields.append('formats:%s' % ','.join(fn.format_options()[1::2]))
+    if fn.python_module:
+        fields.append('module:%s' % fn.python_module)
+    else:
+        fields.append('source:%s' % digests.path(Path(defdir) / fn.sourcefile))
+    fields.extend('arg:%s' % digest for digest in input_digests)
+
+    for field in fields:
+        hasher.update(field.encode('utf-8'))
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def chain_key(chain, defdir, input_digests, digests, engine_tag='docker', images=True):
+    """ Calculate a key that identifies the results of running a fused chain of steps
+    (see :class:`molflow.runners.fusion.FusedStep`) on the given inputs
+
+    Each step in the chain is keyed with :func:`step_key`; values passed within the chain are
+    identified by the key of the step that produced them, rather than by their contents.
+    """
+    keys = []
+    for step, argrefs in chain.links:
+        link_digests = []
+        for ref in argrefs:
+            if ref[0] == 'arg':
+                link_digests.append(input_digests[ref[1]])
+            else:
+                link_digests.append('link:%s:%d' % (keys[ref[1]], ref[2]))
+        keys.append(step_key(step, defdir, link_digests, digests, engine_tag, images))
+    return keys[-1]
+
+
+def copy_return_files(job, destination, link=False):
+    """ Copy a finished job's return values into a new directory
+
+    Args:
+        job (pyccc.Job or CachedJob): the finished job
+        destination (pathlib.Path): directory to write the files to
+        link (bool): hard link files that are already on the local filesystem (falling back
+           to a copy if they're on a different device, for instance)
+    """
+    for fname, oput in job.get_output().items():
+        if not fname.startswith('return.'):
+            continue
+        target = destination / fname
+        if not target.parent.is_dir():
+            target.parent.mkdir(parents=True)
+        localpath = getattr(oput, 'localpath', None) if link else None
+        if localpath is not None:
+            try:
+                os.link(str(localpath), str(target))
+                continue
+            except OSError:
+                pass
+        oput.put(str(target))
+
+
+class StepCache(object):
+    """ Stores and retrieves the output files of workflow steps.
+
+    Args:
+        path (str): cache directory (default: ~/.molflow/cache)
+        maxbytes (int): evict old entries when the cache grows past this size (default: 10 GB)
+        refresh (bool): ignore existing entries (but still store new results)
+    """
+    def __init__(self, path=DEFAULT_CACHE_DIR, maxbytes=DEFAULT_MAX_BYTES, refresh=False):
+        self.path = Path(os.path.expanduser(str(path)))
+        self.maxbytes = maxbytes
+        self.refresh = refresh
+        self._total = None  # bytes stored in the cache, once evict() has measured it
+
+    def lookup(self, key, step):
+        """ Get the cached results for a step, if present
+
+        Returns:
+            CachedJob: job-like object exposing the step's cached output files (or None if
+               there's no cache entry)
+        """
+        if self.refresh:
+            return None
+        entry = self._entry_path(key)
+        if not entry.is_dir():
+            return None
+        os.utime(str(entry), None)  # mark as recently used
+        return CachedJob(step, entry, 'cached:%s' % key[:12])
+
+    def store(self, key, job):
+        """ Copy a finished job's return values into the cache
+
+        With ``refresh`` set, an existing entry for this key is replaced.
+
+        Returns:
+            pathlib.Path: the cache entry holding the results (or None if it couldn't be
+               stored)
+        """
+        entry = self._entry_path(key)
+        if entry.is_dir() and not self.refresh:
+            return entry
+        if not entry.parent.is_dir():
+            entry.parent.mkdir(parents=True)
+
+        tmpdir = Path(tempfile.mkdtemp(prefix='tmp-', dir=str(entry.parent)))
+        try:
+            copy_return_files(job, tmpdir)
+            size = _entry_size(tmpdir)
+            if entry.is_dir():  # swap the stale entry out, then the new one in
+                stale = Path(tempfile.mkdtemp(prefix='tmp-', dir=str(entry.parent)))
+                os.rename(str(entry), str(stale / entry.name))
+                os.rename(str(tmpdir), str(entry))
+                size -= _entry_size(stale)
+                shutil.rmtree(str(stale), ignore_errors=True)
+            else:
+                os.rename(str(tmpdir), str(entry))
+        except OSError:  # another run stored this entry first
+            shutil.rmtree(str(tmpdir), ignore_errors=True)
+            return entry if entry.is_dir() else None
+
+        if self._total is not None:
+            self._total += size
+        if self._total is None or self._total > self.maxbytes:
+            self.evict()
+        return entry if entry.is_dir() else None
+
+    def evict(self):
+        """ Delete least recently used entries until the cache is under its size limit
+
+        This walks the whole cache, so :meth:`store` only calls it the first time, and then
+        whenever the running total of stored bytes passes the size limit.
+        """
+        entries = []
+        total = 0
+        for entry in self.path.glob('*/*'):
+            if not entry.is_dir() or entry.name.startswith('tmp-'):
+                continue
+            size = _entry_size(entry)
+            entries.append((entry.stat().st_mtime, size, entry))
+            total += size
+
+        for _, size, entry in sorted(entries, key=lambda e: e[0]):
+            if total <= self.maxbytes:
+                break
+            shutil.rmtree(str(entry), ignore_errors=True)
+            total -= size
+        self._total = total
+
+    def _entry_path(self, key):
+        return self.path / key[:2] / key
+
+
+def _entry_size(entry):
+    return sum(f.stat().st_size for f in entry.glob('**/*') if f.is_file())
+
+
+class CachedJob(object):
+    """ Stands in for a finished pyccc job whose outputs were stored by an earlier run
+    (in the step cache or a run journal)
+    """
+    status = 'finished'
+    stdout = ''
+    stderr = ''
+    engine = 'stored results'
+    command = None
+
+    def __init__(self, step, path, jobid):
+        self.name = step._label()
+        self.jobid = jobid
+        self.image = None
+        self.inputs = {}
+        self.path = path
+        self._outputs = None
+
+    def get_output(self, filename=None):
+        from pyccc.files import LocalFile
+        if self._outputs is None:
+            self._outputs = {f.relative_to(self.path).as_posix(): LocalFile(str(f))
+                             for f in self.path.glob('**/*') if f.is_file()}
+        if filename:
+            return self._outputs[filename]
+        else:
+            return self._outputs
+
+    def kill(self):
+        pass
+
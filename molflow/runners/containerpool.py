@@ -0,0 +1,266 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Engine that keeps long-lived docker containers running for each image, and runs steps in them.
+
+Each container runs ``runstep.py --serve`` on a directory that's shared with the host. Steps
+are handed to a container by writing their input files and command line arguments into a task
+directory there (see :func:`molflow.static.runstep.serve`), so container startup and the
+functions' imports are paid once per container instead of once per step.
+"""
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from ..run import EXECUTOR
+
+POOLDIR = '/molflow_pool'  # where the shared directory is mounted inside the containers
+POLLTIME = 0.02
+LIVENESS_INTERVAL = 1.0  # how often to check that a worker's container is still running
+
+
+class ContainerPoolEngine(object):
+    """ Runs steps in a pool of warm docker containers, up to ``maxworkers`` per image
+
+    Args:
+        maxworkers (int): maximum number of containers to start for each image (default: 4)
+        python (str): python command inside the containers (default: "python")
+    """
+    name = 'docker-pool'
+    cache_tag = 'docker'  # same image and executor as the docker engine, so same results
+    supports_caching = True
+    supports_fusion = True
+    uses_images = True
+
+    def __init__(self, maxworkers=None, python=None):
+        import pyccc
+        self.client = pyccc.engines.Docker().client
+        self.maxworkers = maxworkers or 4
+        self.python = python or 'python'
+        self.workdir = tempfile.mkdtemp(prefix='molflow-pool-')
+        self.workers = {}
+        self._workerids = itertools.count()
+        self._taskids = itertools.count()
+
+    def __str__(self):
+        return self.name
+
+    def make_job(self, step, defdir, inputs, protocol=None, formats=None):
+        return ContainerPoolJob(self, step, defdir, inputs, 'task%06d' % next(self._taskids),
+                                protocol, formats)
+
+    def pickle_protocol(self, image):
+        """ The highest pickle protocol supported by the python in ``image``, found by running
+        it in a short-lived container
+        """
+        from .localstep import PROTOCOL_PROBE, probe_docker_protocol
+
+        def run_probe():
+            container = self.client.create_container(
+                    image, command=[self.python, '-c', PROTOCOL_PROBE])
+            try:
+                self.client.start(container['Id'])
+                self.client.wait(container['Id'])
+                return self.client.logs(container['Id'], stderr=False).decode('utf-8')
+            finally:
+                self.client.remove_container(container['Id'], force=True)
+
+        return probe_docker_protocol(self.client, image, self.python, run_probe)
+
+    def assign(self, job):
+        """ Choose a container for ``job``, starting a new one if all of them are busy
+        """
+        workers = self.workers.setdefault(job.image, [])
+        for worker in list(workers):
+            if not worker.is_running():
+                self.retire(worker, 'Container %s for image %s exited unexpectedly'
+                            % (worker.containerid[:12], worker.image))
+        for worker in workers:
+            worker.discard_finished()
+        idle = sorted(workers, key=lambda w: len(w.pending))
+        if idle and (not idle[0].pending or len(workers) >= self.maxworkers):
+            worker = idle[0]
+        else:
+            worker = PoolWorker(self, job.image, 'worker%d' % next(self._workerids))
+            workers.append(worker)
+        worker.pending.add(job)
+        return worker
+
+    def retire(self, worker, message):
+        """ Stop a container and remove it from the pool, failing the jobs still pending in it
+        with ``message``
+        """
+        workers = self.workers.get(worker.image, [])
+        if worker in workers:
+            workers.remove(worker)
+        worker.stop()
+        worker.discard_finished()
+        for job in worker.pending:
+            job.abort(message)
+        worker.pending = set()
+
+    def wait(self, job):
+        lastcheck = time.time()
+        while not job.done:
+            time.sleep(POLLTIME)
+            if time.time() - lastcheck > LIVENESS_INTERVAL:
+                lastcheck = time.time()
+                if not job.worker.is_running():
+                    self.retire(job.worker, 'Container %s for image %s exited unexpectedly'
+                                % (job.worker.containerid[:12], job.image))
+
+    def shutdown(self):
+        for workers in self.workers.values():
+            for worker in workers:
+                worker.stop()
+        self.workers = {}
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class PoolWorker(object):
+    """ A container running ``runstep.py --serve`` on its own subdirectory of the engine's
+    working directory
+    """
+    def __init__(self, engine, image, name):
+        self.client = engine.client
+        self.image = image
+        self.hostdir = os.path.join(engine.workdir, name)
+        self.pending = set()
+        self.stopped = False
+        os.mkdir(self.hostdir)
+        shutil.copy(EXECUTOR, os.path.join(self.hostdir, 'runstep.py'))
+
+        kwargs = {}
+        if hasattr(os, 'getuid'):  # so that the host can clean up the files it writes
+            kwargs['user'] = '%d:%d' % (os.getuid(), os.getgid())
+        config = self.client.create_host_config(binds={self.hostdir: {'bind': POOLDIR,
+                                                                      'mode': 'rw'}})
+        container = self.client.create_container(
+                image, command=[engine.python, 'runstep.py', '--serve', POOLDIR],
+                working_dir=POOLDIR, host_config=config, **kwargs)
+        self.containerid = container['Id']
+        self.client.start(self.containerid)
+
+    def discard_finished(self):
+        self.pending = set(job for job in self.pending if not job.done)
+
+    def is_running(self):
+        if self.stopped:
+            return False
+        return self.client.inspect_container(self.containerid)['State']['Running']
+
+    def stop(self):
+        if self.stopped:
+            return
+        self.stopped = True
+        open(os.path.join(self.hostdir, '__shutdown__'), 'w').close()
+        try:
+            self.client.stop(self.containerid, timeout=5)
+            self.client.remove_container(self.containerid, force=True)
+        except Exception as e:
+            print('Cleanup error: %s' % e)
+
+
+class ContainerPoolJob(object):
+    """ A step submitted to a :class:`ContainerPoolEngine`, with the interface of a pyccc job
+    """
+    def __init__(self, engine, step, defdir, inputs, jobid, protocol=None, formats=None):
+        from .localstep import step_invocation, step_image
+
+        self.engine = engine
+        self.name = step._label()
+        self.jobid = jobid
+        self.image = step_image(step, defdir)
+        self.rundata = {}
+        self.arguments, self.inputs = step_invocation(step, inputs, defdir, protocol, formats)
+        self.command = ' '.join([engine.python, 'runstep.py'] + self.arguments)
+        self.worker = None
+        self.taskdir = None
+        self._outputs = None
+
+    def submit(self):
+        self.worker = self.engine.assign(self)
+        self.taskdir = os.path.join(self.worker.hostdir, self.jobid)
+        os.mkdir(self.taskdir)
+        for filename, indata in self.inputs.items():
+            path = os.path.join(self.taskdir, filename)
+            if isinstance(indata, bytes):
+                with open(path, 'wb') as infile:
+                    infile.write(indata)
+            else:
+                indata.put(path)
+        with open(os.path.join(self.taskdir, 'invocation.json'), 'w') as invocation:
+            json.dump(self.arguments, invocation)
+        open(self.taskdir + '.ready', 'w').close()  # hands the task to the container
+
+    @property
+    def done(self):
+        return os.path.exists(self.taskdir + '.done')
+
+    @property
+    def status(self):
+        return 'finished' if self.done else 'running'
+
+    @property
+    def stdout(self):
+        return self._read_log('__stdout__')
+
+    @property
+    def stderr(self):
+        return self._read_log('__stderr__')
+
+    def _read_log(self, filename):
+        path = os.path.join(self.taskdir, filename)
+        if not os.path.exists(path):
+            return ''
+        with open(path, 'r') as logfile:
+            return logfile.read()
+
+    def abort(self, message):
+        """ Mark this task as failed, e.g. because its container died
+        """
+        with open(os.path.join(self.taskdir, '__fail__.txt'), 'w') as failfile:
+            failfile.write(message)
+        with open(os.path.join(self.taskdir, '__stderr__'), 'a') as logfile:
+            logfile.write(message + '\n')
+        open(self.taskdir + '.done', 'w').close()
+
+    def kill(self):
+        if not self.done:  # steps can't be interrupted, so stop the whole container
+            self.worker.pending.discard(self)
+            self.abort('Killed')
+            self.engine.retire(self.worker, 'Container %s was stopped to kill step "%s"'
+                               % (self.worker.containerid[:12], self.name))
+
+    def get_output(self, filename=None):
+        from pyccc.files import LocalFile
+        outputs = self._outputs
+        if outputs is None:
+            skip = set(self.inputs) | {'invocation.json', '__stdout__', '__stderr__'}
+            outputs = {}
+            for root, dirs, files in os.walk(self.taskdir):
+                for fname in files:
+                    path = os.path.join(root, fname)
+                    relpath = os.path.relpath(path, self.taskdir).replace(os.sep, '/')
+                    if relpath not in skip:
+                        outputs[relpath] = LocalFile(path)
+            if self.done:
+                self._outputs = outputs
+        if filename:
+            return outputs[filename]
+        else:
+            return outputs
@@ -0,0 +1,97 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Merge duplicate steps in a workflow's DAG.
+
+Every call to a :class:`molflow.definitions.Function` creates a new step, so a workflow that
+calls ``to_float(add(b, b))`` in two places would run ``add(b, b)`` twice. Two steps are
+duplicates if they call the same function on the same arguments: the same workflow inputs,
+the same return values of (deduplicated) upstream steps, or equal literal values.
+"""
+import copy
+
+from ..definitions import datasources
+from ..definitions.steps import StepResult, MapStep
+from ..definitions.workflows import WorkflowDefinition
+
+
+def deduplicate_steps(workflow):
+    """ Create a copy of a workflow in which duplicate steps are merged
+
+    Args:
+        workflow (molflow.definitions.WorkflowDefinition): the workflow
+
+    Returns:
+        Tuple[WorkflowDefinition, int]: the deduplicated workflow (or ``workflow`` itself, if
+           there are no duplicates), and the number of steps that were merged into others
+    """
+    canonical = {}
+    copies = {}
+
+    def copy_arg(arg):
+        if isinstance(arg, StepResult):
+            return StepResult(copies[arg.step], arg.position)
+        else:
+            return arg
+
+    for step in workflow.graph:  # upstream steps are always copied first
+        args = tuple(copy_arg(arg) for arg in step.args)
+        key = _signature(step, args)
+        if key in canonical:
+            stepcopy = canonical[key]
+            stepcopy.unroll.update(step.unroll)
+        else:
+            stepcopy = copy.copy(step)
+            stepcopy.args = args
+            stepcopy.unroll = set(step.unroll)
+            canonical[key] = stepcopy
+        copies[step] = stepcopy
+
+    deduped = WorkflowDefinition(workflow.name, workflow.metadata)
+    deduped.definition_path = workflow.definition_path
+    deduped.inputs = workflow.inputs
+    for name, outputdata in workflow.outputs.items():
+        source = outputdata.source
+        deduped.set_output(copy_arg(source), name, outputdata.description, outputdata.type)
+
+    num_merged = len(copies) - len(canonical)
+    if num_merged:
+        return deduped, num_merged
+    else:
+        return workflow, 0
+
+
+def _signature(step, args):
+    """ Key identifying what a step computes, given its (already deduplicated) arguments
+    """
+    fn = step.fn
+    argkeys = []
+    for arg in args:
+        if isinstance(arg, datasources.ExternalInput):
+            argkeys.append(('input', arg.name))
+        elif isinstance(arg, StepResult):
+            argkeys.append(('result', id(arg.step), arg.position))
+        else:
+            try:
+                hash(arg)
+            except TypeError:  # can't compare by value
+                argkeys.append(('object', id(arg)))
+            else:
+                argkeys.append(('literal', type(arg), arg))
+
+    key = (type(step), fn.funcname, str(fn.sourcefile), fn.python_module,
+           fn._docker_image, fn.num_returnvals, tuple(fn.format_options()), tuple(argkeys))
+    if isinstance(step, MapStep):
+        key += (step.chunksize,)
+    return key
@@ -0,0 +1,195 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Step fusion: run linear chains of steps that share a docker image as a single job.
+
+A step can be fused with the step that consumes its results if it's that step's only consumer,
+its results aren't a workflow output, and both steps use the same image. The fused chain runs
+as one ``runstep.py --chain`` invocation, which calls the functions back to back and passes
+the intermediate values in memory. Map steps are never fused, because they're expanded into
+many jobs at run time.
+"""
+import json
+
+from ..definitions.steps import MapStep, StepResult
+
+
+class FusedStep(object):
+    """ A chain of steps, each consuming the previous one's results, that run in one job
+
+    Args:
+        steps (List[Step]): the steps in the order they run
+        save_intermediates (bool): also write out the return values of every step in the chain
+           (otherwise, only the last step's are written)
+    """
+    def __init__(self, steps, save_intermediates=False):
+        self.steps = steps
+        self.save_intermediates = save_intermediates
+
+        # ``args`` are the chain's inputs from outside the chain. ``links`` pairs each step
+        # with references to its arguments: ('arg', index into ``args``) or
+        # ('link', index of an earlier step in the chain, return value position)
+        self.args = []
+        self.links = []
+        positions = {step: i for i, step in enumerate(steps)}
+        external = {}
+        for step in steps:
+            argrefs = []
+            for arg in step.args:
+                if isinstance(arg, StepResult) and arg.step in positions:
+                    argrefs.append(('link', positions[arg.step], arg.position))
+                    continue
+                argid = (arg.step, arg.position) if isinstance(arg, StepResult) else id(arg)
+                if argid not in external:
+                    external[argid] = len(self.args)
+                    self.args.append(arg)
+                argrefs.append(('arg', external[argid]))
+            self.links.append((step, argrefs))
+
+    def __str__(self):
+        return 'Fused steps %s' % ', '.join(step._label() for step in self.steps)
+
+    def __repr__(self):
+        return "<%s>" % self
+
+    def _label(self):
+        return '+'.join(step._label() for step in self.steps)
+
+    @property
+    def last(self):
+        return self.steps[-1]
+
+    @property
+    def profile(self):
+        """ Whether any of the steps are profiled (each link is profiled separately) """
+        for step in self.steps:
+            if step.profile:
+                return step.profile
+        return None
+
+    def get_docker_image(self, rootdir):
+        return self.steps[0].fn.get_docker_image(rootdir)
+
+
+def fuse_steps(graph, workflow, save_intermediates=False, images=True):
+    """ Replace linear chains of steps in a workflow's dependency graph with :class:`FusedStep`s
+
+    Args:
+        graph (molflow.definitions.graph.StepGraph): the workflow's step graph
+        workflow (molflow.definitions.WorkflowDefinition): the workflow
+        save_intermediates (bool): have fused steps write out their intermediate results
+        images (bool): whether steps run in their functions' docker images (otherwise, they
+           all run in the same environment, so a chain doesn't need to share an image)
+
+    Returns:
+        Dict[object, Set]: dependency graph of the form ``{step: {upstream steps and workflow
+           inputs}}``, where each chain of two or more steps is replaced by a single
+           :class:`FusedStep`
+    """
+    outputs = set(outputdata.source.step for outputdata in workflow.outputs.values())
+
+    stepimages = {}
+    def image(step):
+        if not images:
+            return 'host'
+        if step not in stepimages:
+            try:
+                stepimages[step] = step.fn.get_docker_image(workflow.definition_path)
+            except ValueError:  # no image, so it can't share one
+                stepimages[step] = None
+        return stepimages[step]
+
+    following = {}
+    preceding = {}
+    for step in graph:
+        consumers = graph.downstream(step)
+        if step in outputs or len(consumers) != 1:
+            continue
+        consumer = consumers[0]
+        if isinstance(step, MapStep) or isinstance(consumer, MapStep) or consumer in preceding:
+            continue
+        if image(step) is None or image(step) != image(consumer):
+            continue
+        following[step] = consumer
+        preceding[consumer] = step
+
+    units = {}
+    for step in graph:
+        if step in preceding:
+            continue
+        chain = [step]
+        while chain[-1] in following:
+            chain.append(following[chain[-1]])
+        unit = FusedStep(chain, save_intermediates) if len(chain) > 1 else step
+        for member in chain:
+            units[member] = unit
+
+    fused = {}
+    for step in graph:
+        unit = units[step]
+        deps = fused.setdefault(unit, set())
+        for dep in graph.upstream(step) + graph.inputs(step):
+            dep = units.get(dep, dep)
+            if dep is not unit:
+                deps.add(dep)
+    return fused
+
+
+def chain_invocation(chain, args, defdir, protocol=None, formats=None):
+    """ Command line arguments and input files for running a fused chain with ``runstep.py``
+
+    Returns:
+        Tuple[List[str], Dict[str, pyccc.files.FileReferenceBase]]: runstep.py's command line
+           arguments, and the files it expects to find in its working directory
+    """
+    import pyccc
+    inputs = {}
+    links = []
+    sources = {}  # staged file name for each source file, by its path
+    argfiles = ['arg%d.%s' % (i, formats[i] if formats else 'pkl') for i in range(len(args))]
+    for step, argrefs in chain.links:
+        fn = step.fn
+        link = {'label': step._label(),
+                'function': fn.funcname,
+                'numreturn': fn.num_returnvals,
+                'sourcefile': None,
+                'pymodule': fn.python_module,
+                'unroll': sorted(step.unroll),
+                'profile': step.profile,
+                'formats': {str(position): fn.output_format(position)
+                            for position in range(fn.num_returnvals)
+                            if fn.output_format(position) is not None},
+                'arguments': []}
+        if fn.sourcefile:  # source files from different directories may share a name
+            path = str(defdir/fn.sourcefile)
+            if path not in sources:
+                sources[path] = 'source%d.%s' % (len(sources), fn.sourcefile.name)
+                inputs[sources[path]] = pyccc.files.LocalFile(path)
+            link['sourcefile'] = sources[path]
+        for ref in argrefs:
+            if ref[0] == 'arg':
+                link['arguments'].append(argfiles[ref[1]])
+            else:
+                link['arguments'].append({'link': ref[1], 'position': ref[2]})
+        links.append(link)
+
+    for argfile, indata in zip(argfiles, args):
+        inputs[argfile] = indata
+
+    spec = {'links': links, 'save_intermediates': chain.save_intermediates}
+    if protocol is not None:
+        spec['protocol'] = protocol
+    inputs['chain.json'] = pyccc.files.StringContainer(json.dumps(spec, indent=1),
+                                                       name='chain.json')
+    return ['--chain', 'chain.json'], inputs
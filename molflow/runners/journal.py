@@ -0,0 +1,99 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Record of the steps completed during a run, used to resume interrupted runs.
+
+The journal lives in the run's output directory. Each completed step appends one JSON line
+with the step's label, the digests of its inputs, its key (see
+:func:`molflow.runners.cache.step_key`) and the names of its return files. Results that are
+in the step cache are referred to by their cache entry; others are hard linked (or, failing
+that, copied) next to the journal.
+"""
+import json
+import shutil
+from pathlib import Path
+
+from .cache import CachedJob, copy_return_files
+
+JOURNAL_DIR = '.molflow_journal'
+
+
+class RunJournal(object):
+    """
+    Args:
+        outputdir (str): the run's output directory
+        resume (bool): load the steps recorded by an earlier run in this directory
+    """
+    def __init__(self, outputdir, resume=False):
+        self.path = Path(str(outputdir)) / JOURNAL_DIR
+        self.logpath = self.path / 'journal.jsonl'
+        self.entries = {}
+
+        if resume and self.logpath.exists():
+            with self.logpath.open('r') as logfile:
+                for line in logfile:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # partial line written when the last run died
+                        continue
+                    self.entries[entry['step']] = entry
+        elif self.path.exists():
+            shutil.rmtree(str(self.path))
+
+    def lookup(self, step, key):
+        """ Get the results that an earlier run recorded for this step, if they're still valid
+
+        Returns:
+            CachedJob: job-like object exposing the step's recorded output files (or None if
+               the step needs to run)
+        """
+        entry = self.entries.get(step._label())
+        if entry is None or entry['key'] != key:
+            return None
+        stepdir = Path(entry['stored']) if entry.get('stored') else self._stepdir(step)
+        if not all((stepdir / fname).is_file() for fname in entry['outputs']):
+            return None  # e.g., evicted from the step cache
+        return CachedJob(step, stepdir, 'resumed')
+
+    def record(self, step, key, input_digests, job, stored=None):
+        """ Append a completed step to the journal, saving its return files unless they're
+        in the step cache
+
+        Args:
+            job (pyccc.Job or CachedJob): the finished job
+            stored (pathlib.Path): the step's entry in the step cache, if it has one
+        """
+        stepdir = self._stepdir(step)
+        if stepdir.exists():
+            shutil.rmtree(str(stepdir))
+        if stored is not None:
+            stepdir = stored
+        else:
+            stepdir.mkdir(parents=True)
+            copy_return_files(job, stepdir, link=True)
+
+        entry = {'step': step._label(),
+                 'key': key,
+                 'inputs': input_digests,
+                 'stored': str(stored) if stored is not None else None,
+                 'outputs': sorted(f.relative_to(stepdir).as_posix()
+                                   for f in stepdir.glob('**/*') if f.is_file())}
+        if not self.path.is_dir():
+            self.path.mkdir(parents=True)
+        with self.logpath.open('a') as logfile:
+            logfile.write(json.dumps(entry) + '\n')
+        self.entries[entry['step']] = entry
+
+    def _stepdir(self, step):
+        return self.path / 'steps' / step._label()
@@ -12,11 +12,32 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import pickle
+import threading
 import time
 from pathlib import Path
 import yaml
+try:
+    import queue
+except ImportError:  # python 2
+    import Queue as queue
+
 from ..definitions import datasources
-from .localstep import make_job
+from ..definitions.steps import Step, MapStep
+from ..static.runstep import FORMATS, PICKLE_PROTOCOL
+from .localstep import make_job, step_image, DockerEngine
+from .scheduling import SCHEDULES
+from .cache import CachedJob, ContentDigests, step_key, chain_key
+from .dedupe import deduplicate_steps
+from .fusion import FusedStep, fuse_steps
+from .resources import read_step_stats
+from .scatter import MapChunk, make_chunks, scatter_items
+
+
+# shortest interval between status checks when the scheduler is idle; doubled on each idle
+# iteration up to the runner's ``polltime``
+MIN_POLLTIME = 0.05
 
 
 class StepFailure(Exception):
@@ -27,38 +48,75 @@ class StepFailure(Exception):
         super(StepFailure, self).__init__(message)
 
     def _show_debugging_options(self):
-        msg = [self.msg,
-               "To launch a shell to examine the docker container, run:",
-               "   docker commit %s mflw_debug_ \n" % self.job.jobid,
-               "   docker run -it --entrypoint=bash mflw_debug_"]
+        rundata = self.job.rundata
+        if rundata.get('localdir'):  # subprocess engine
+            msg = [self.msg,
+                   "The step's input and output files are in:",
+                   "   %s" % rundata['localdir']]
+            where = 'In that directory'
+        elif rundata.get('containerid'):  # docker engine
+            msg = [self.msg,
+                   "To launch a shell to examine the docker container, run:",
+                   "   docker commit %s mflw_debug_ \n" % self.job.jobid,
+                   "   docker run -it --entrypoint=bash mflw_debug_"]
+            where = 'Inside the docker container'
+        else:
+            return self.msg
 
         cmdfields = self.job.command.split()
-        if cmdfields[0] == 'python':
+        if len(cmdfields) > 1 and cmdfields[1] == 'runstep.py':
             msg.extend([
-               "Inside the docker container, you can run the PDB debugger with:",
-               "   python -m pdb %s" % ' '.join(cmdfields[1:])
+               "%s, you can run the PDB debugger with:" % where,
+               "   %s -m pdb %s" % (cmdfields[0], ' '.join(cmdfields[1:]))
             ])
 
         return '\n'.join(msg)
 
 
 class LocalRunner(object):
-    def __init__(self, workflow, inputs, maxproc=4, polltime=4, datadir=None):
+    def __init__(self, workflow, inputs, maxproc=4, polltime=4, datadir=None,
+                 schedule='critical-path', durations=None, cache=None, journal=None,
+                 engine=None, fuse=False, deduplicate=True, trace=None, profiler=None):
+        self.num_deduplicated = 0
+        if deduplicate:
+            workflow, self.num_deduplicated = deduplicate_steps(workflow)
         self.workflow = workflow
         self.inputs = inputs
         self.maxproc = maxproc
         self.polltime = polltime
+        self.schedule = schedule
+        self.durations = durations
+        self.cache = cache
+        self.journal = journal
+        self.engine = engine
+        self.trace = trace
+        self.profiler = profiler
+        self._store_results = (engine or DockerEngine).supports_caching
+        self.fuse = fuse and (engine or DockerEngine).supports_fusion
         if datadir is not None:
             datadir = Path(datadir)
         self.datadir = datadir
 
-        self.queued = set(workflow.steps())
+        self.queued = set()
         self.running = {}
         self.finished = {}
         self.output_files = {}
+        self.output_formats = {}
+        self.step_stats = {}
+        self.function_times = collections.defaultdict(list)  # wall times, by function name
+        self._digests = ContentDigests()
+        self._step_keys = {}
+        self._chunks = {}
+        self._build_graph()
+
+        self._completions = queue.Queue()
+        self._stopping = threading.Event()
+        self._pollinterval = MIN_POLLTIME
 
     def run(self):
         print("\nStarting workflow '%s'" % self.workflow.name)
+        if self.num_deduplicated:
+            print('Merged %d duplicate steps' % self.num_deduplicated)
         self.workflow.check_inputs(self.inputs)
 
         if self.datadir and not self.datadir.exists():
@@ -67,12 +125,15 @@ class LocalRunner(object):
         changed = True
         try:
             while self.queued or self.running:
-                if not changed:
-                    time.sleep(self.polltime)
+                if changed:
+                    self._pollinterval = MIN_POLLTIME
+                else:
+                    self._wait_for_completion()
                 changed = self.launch_jobs()
                 changed = self.finish_jobs() or changed
 
         finally:  # clean up any running jobs
+            self._stopping.set()
             for job in self.running.values():
                 try:
                     if job.status.lower() not in ('finished', 'error'):
@@ -83,60 +144,281 @@ class LocalRunner(object):
 
         for key, outputdata in self.workflow.outputs.items():
             self.output_files[key] = _getdata(outputdata.source, self.finished)
+            self.output_formats[key] = _getformat(outputdata.source, self.finished)
 
         return self.output_files
 
+    def _build_graph(self):
+        """ Index the workflow's DAG for scheduling.
+
+        Each step keeps a count of the upstream steps it's still waiting on; a step moves to
+        ``self.ready`` once that count drops to zero, so the scheduler never has to rescan the
+        whole queue. The order in which ready steps launch is set by ``self.schedule``.
+
+        With ``self.fuse``, linear chains of steps are replaced by a single
+        :class:`molflow.runners.fusion.FusedStep` that runs them all in one job.
+        """
+        graph = self.workflow.graph
+        if self.profiler is not None:
+            self.profiler.select(graph)
+        if self.fuse:
+            dag = fuse_steps(graph, self.workflow, save_intermediates=self.datadir is not None,
+                             images=(self.engine or DockerEngine).uses_images)
+            self._dependents = {step: [] for step in dag}
+            self._num_waiting = {}
+            for step, dependencies in dag.items():
+                upstream = [dep for dep in dependencies if isinstance(dep, (Step, FusedStep))]
+                for dep in upstream:
+                    self._dependents[dep].append(step)
+                self._num_waiting[step] = len(upstream)
+        else:
+            self._dependents = {step: graph.downstream(step) for step in graph}
+            self._num_waiting = {step: graph.num_upstream(step) for step in graph}
+        self.queued.update(self._num_waiting)
+
+        self.ready = SCHEDULES[self.schedule](self._dependents, self.durations)
+        for step, num_waiting in self._num_waiting.items():
+            if not num_waiting:
+                self._make_ready(step)
+
+    def _make_ready(self, step):
+        if self.trace is not None:
+            self.trace.mark(step, 'ready')
+        self.ready.push(step)
+
+    def _release_dependents(self, step):
+        for dependent in self._dependents[step]:
+            self._num_waiting[dependent] -= 1
+            if self._num_waiting[dependent] == 0:
+                self._make_ready(dependent)
+
     def launch_jobs(self):
         changed = False
-        for step in list(self.queued):
-            if len(self.running) >= self.maxproc:
-                break
-            readyinputs = []
-            for arg in step.args:
-                if isinstance(arg, datasources.ExternalInput):
-                    readyinputs.append(self.inputs[arg.name])
-                elif arg.step in self.finished:
-                    readyinputs.append(_getdata(arg, self.finished))
-                else:
-                    readyinputs = None
-                    break
+        while self.ready and len(self.running) < self.maxproc:
+            step = self.ready.pop()
+            changed = True
+            if isinstance(step, MapStep) and step not in self._chunks:
+                self._scatter(step)
+                continue
+            self.queued.remove(step)
+            if self.trace is not None:
+                self.trace.span(step, 'queued', 'ready')
+                self.trace.mark(step, 'launch')
 
-            if readyinputs:
-                self.queued.remove(step)
-                changed = True
-                job = make_job(step, self.workflow.definition_path, readyinputs, submit=True)
-                print(yaml.safe_dump({job.name: {'engine': str(job.engine),
-                                                 'image': job.image,
-                                                 'job_id': job.jobid}},
-                                     default_flow_style=False).rstrip(' \n'))
+            readyinputs, formats = self._get_inputs(step)
+            protocol = self._output_protocol(step)
 
-                self.running[step] = job
+            # profiled steps always run, instead of reusing stored results
+            if (self._store_results and not step.profile and
+                    (self.cache is not None or self.journal is not None)):
+                stored = self._find_stored_results(step, readyinputs, protocol, formats)
+                if stored is not None:
+                    if self.trace is not None:
+                        self.trace.span(step, 'find stored results', 'launch')
+                    self._complete(step, stored)
+                    continue
+
+            job = make_job(step, self.workflow.definition_path, readyinputs, submit=True,
+                           engine=self.engine, protocol=protocol, formats=formats)
+            if self.trace is not None:
+                self.trace.span(step, 'submit', 'launch', engine=str(job.engine),
+                                job_id=str(job.jobid))
+                self.trace.mark(step, 'submitted')
+            print(yaml.safe_dump({job.name: {'engine': str(job.engine),
+                                             'image': job.image,
+                                             'job_id': job.jobid}},
+                                 default_flow_style=False).rstrip(' \n'))
+
+            self.running[step] = job
+            self._watch(step, job)
         return changed
 
+    def _get_inputs(self, step):
+        """ The step's input files, and the format (extension) of each one
+        """
+        if isinstance(step, MapStep):  # its chunks are done, so gather their results
+            chunks = self._chunks[step]
+            return ([self.finished[chunk].get_output('return.0.pkl') for chunk in chunks],
+                    ['pkl'] * len(chunks))
+
+        readyinputs = []
+        formats = []
+        if isinstance(step, MapChunk):  # this chunk's items, then the map step's other args
+            readyinputs.extend(step.items)
+            formats.extend('pkl' for item in step.items)
+            args = step.mapstep.args[1:]
+        else:
+            args = step.args
+        for arg in args:
+            if isinstance(arg, datasources.ExternalInput):
+                readyinputs.append(self.inputs[arg.name])
+                formats.append('pkl')
+            else:
+                readyinputs.append(_getdata(arg, self.finished))
+                formats.append(_getformat(arg, self.finished))
+        return readyinputs, formats
+
+    def _scatter(self, step):
+        """ Expand a map step, now that its list of items is known, into a job for each chunk
+        of items. The map step stays queued until they finish, and then gathers their results.
+        """
+        sequence = step.args[0]
+        items = scatter_items(sequence, self.finished[sequence.step])
+        chunks = make_chunks(step, items)
+        print('Step "%s": mapping over %d items in %d jobs' % (step._label(), len(items),
+                                                               len(chunks)))
+
+        self._chunks[step] = chunks
+        self._num_waiting[step] = len(chunks)
+        self.ready.inherit(chunks, step)
+        for chunk in chunks:
+            self._dependents[chunk] = [step]
+            self.queued.add(chunk)
+            self._make_ready(chunk)
+        if not chunks:
+            self._make_ready(step)
+
+    def _output_protocol(self, step):
+        """ The pickle protocol for a step's return values: the highest one supported by the
+        pythons that run it and the steps that use its results, and by this one (which reads
+        the workflow's outputs).
+
+        Without an engine to ask, this is ``PICKLE_PROTOCOL``, which every python can read.
+        Engines that run every step with the same python (see ``uses_images``) are only asked
+        once, so steps don't need docker images for them.
+        """
+        if self.engine is None:
+            return PICKLE_PROTOCOL
+        if not self.engine.uses_images:
+            return min(pickle.HIGHEST_PROTOCOL, self.engine.pickle_protocol(None))
+        defdir = self.workflow.definition_path
+        images = set(step_image(reader, defdir) for reader in [step] + self._dependents[step])
+        return min([pickle.HIGHEST_PROTOCOL] +
+                   [self.engine.pickle_protocol(image) for image in images])
+
+    def _find_stored_results(self, step, readyinputs, protocol=PICKLE_PROTOCOL, formats=None):
+        """ Look for this step's results in the run journal (when resuming) or step cache
+        """
+        input_digests = [self._digests(item) for item in readyinputs]
+        for i, fmt in enumerate(formats or ()):
+            if fmt != 'pkl':  # the same bytes mean something else in another format
+                input_digests[i] = '%s:%s' % (fmt, input_digests[i])
+        engine_tag = (self.engine or DockerEngine).cache_tag
+        if protocol != PICKLE_PROTOCOL:  # so results aren't reused by steps that can't read them
+            engine_tag = '%s:pickle%d' % (engine_tag, protocol)
+        keyfn = chain_key if isinstance(step, FusedStep) else step_key
+        key = keyfn(step, self.workflow.definition_path, input_digests, self._digests,
+                    engine_tag, (self.engine or DockerEngine).uses_images)
+        self._step_keys[step] = key, input_digests
+
+        if self.journal is not None:
+            stored = self.journal.lookup(step, key)
+            if stored is not None:
+                print('Step "%s": using results from previous run' % step._label())
+                return stored
+        if self.cache is not None:
+            stored = self.cache.lookup(key, step)
+            if stored is not None:
+                print('Step "%s": using cached results' % step._label())
+                return stored
+        return None
+
+    def _watch(self, step, job):
+        """ Start a thread that wakes the scheduler as soon as ``job`` completes
+        """
+        watcher = threading.Thread(target=self._notify_when_done, args=(step, job),
+                                   name='watch-%s' % job.name)
+        watcher.daemon = True
+        watcher.start()
+
+    def _notify_when_done(self, step, job):
+        while not self._stopping.is_set():
+            try:
+                job.engine.wait(job)
+            except NotImplementedError:
+                return  # engine can't block on jobs, so the scheduler falls back to polling
+            except Exception:  # e.g., docker API read timeouts during long-running steps
+                self._stopping.wait(self.polltime)
+            else:
+                if self.trace is not None:
+                    self.trace.mark(step, 'done')
+                self._completions.put(step)
+                return
+
+    def _wait_for_completion(self):
+        """ Block until a job signals that it finished or the current poll interval expires.
+
+        Engines that can block on a job wake the scheduler immediately; for those that can't,
+        the poll interval doubles on each idle iteration, up to ``self.polltime``.
+        """
+        start = time.time()
+        try:
+            self._completions.get(timeout=self._pollinterval)
+        except queue.Empty:
+            self._pollinterval = min(2 * self._pollinterval, self.polltime)
+        else:
+            self._pollinterval = MIN_POLLTIME
+        if self.trace is not None:
+            self.trace.idle(start, time.time())
+
     def finish_jobs(self):
         # TODO: check exit codes
         changed = False
         for step, job in list(self.running.items()):
             if job.status.lower() in ('finished', 'error'):
-                failed = '__fail__.txt' in job.get_output()
-
-                self.finished[step] = self.running.pop(step)
+                if self.trace is not None:
+                    self.trace.job_finished(step)
+                self._complete(step, self.running.pop(step))
                 changed = True
 
-                if self.datadir:
-                    stepdir = dump_job(self.datadir, job, step)
-                    if not failed:
-                        print('Step "%s" complete, outputs: %s\n' % (step._label(), stepdir))
-                else:
-                    if not failed:
-                        print('Step "%s" complete.\n' % job.name)
+        return changed
 
-                if failed:
-                    print('\n     ------- STEP "%s" FAILED --------' % job.name)
-                    print('STDERR from docker environment:')
-                    raise StepFailure(job.stderr.strip())
+    def _complete(self, step, job):
+        start = time.time()
+        try:
+            self._collect(step, job)
+        finally:
+            if self.trace is not None:
+                self.trace.add_collect(step, job, start)
+        self._release_dependents(step)
 
-        return changed
+    def _collect(self, step, job):
+        """ Record a finished job's results, and raise :class:`StepFailure` if it failed
+        """
+        failed = '__fail__.txt' in job.get_output()
+        self.finished[step] = job
+        stats = read_step_stats(job)
+        if stats is not None:
+            self.step_stats[step._label()] = stats
+            if type(step) is Step:  # not a fused chain, or part of a map step
+                self.function_times[step.fn.name].append(stats['wall_time'])
+        if isinstance(step, FusedStep):  # consumers refer to the chain's last step
+            self.finished[step.last] = job
+
+        if self.datadir:
+            stepdir = dump_job(self.datadir, job, step)
+            if not failed:
+                print('Step "%s" complete, outputs: %s\n' % (step._label(), stepdir))
+        else:
+            if not failed:
+                print('Step "%s" complete.\n' % job.name)
+            if step.profile and self.profiler is not None:
+                stepdir = self.profiler.collect(job, step)
+                if stepdir is not None:
+                    print('Step "%s" profile: %s\n' % (step._label(), stepdir))
+
+        if failed:
+            print('\n     ------- STEP "%s" FAILED --------' % job.name)
+            print('STDERR from %s environment:' % (self.engine or DockerEngine.name))
+            raise StepFailure(job.stderr.strip(), job)
+
+        if step in self._step_keys:
+            key, input_digests = self._step_keys.pop(step)
+            entry = None  # where the step cache keeps the results
+            if self.cache is not None:
+                entry = job.path if isinstance(job, CachedJob) else self.cache.store(key, job)
+            if self.journal is not None and job.jobid != 'resumed':
+                self.journal.record(step, key, input_digests, job, entry)
 
 
 def dump_job(datadir, job, step):
@@ -147,7 +429,9 @@ def dump_job(datadir, job, step):
         if '__pycache__' in fname or fname.endswith('.pyc'):
             continue
         else:
-            path = (stepdir/Path(fname).name)
+            path = stepdir/fname  # fused steps' intermediate results are in subdirectories
+            if not path.parent.exists():
+                path.parent.mkdir(parents=True)
             oput.put(str(path))
 
     with (stepdir/'stdout').open('w') as stdoutfile:
@@ -158,16 +442,26 @@ def dump_job(datadir, job, step):
     return stepdir
 
 
+def _result_filename(arg, outputs):
+    """ The name of the file holding a step's return value, in whichever format it was written
+    """
+    for codec in FORMATS:
+        filename = 'return.%d.%s' % (arg.position, codec.extension)
+        if filename in outputs:
+            return filename
+    return 'return.%d.pkl' % arg.position
+
+
+def _getformat(arg, finished):
+    return _result_filename(arg, finished[arg.step].get_output()).rsplit('.', 1)[1]
+
+
 def _getdata(arg, finished):
-    objname = 'return.%d.pkl' % arg.position
-    txtname = 'return.%d.txt' % arg.position
     job = finished[arg.step]
     outputs = job.get_output()
+    objname = _result_filename(arg, outputs)
     try:
-        if txtname in outputs:
-            outputfile = job.get_output(txtname)
-        else:
-            outputfile = job.get_output(objname)
+        outputfile = job.get_output(objname)
     except KeyError:
         print('\n---- ERROR in workflow step %s ----\n'%arg.step._label()+
               'Expected output file "%s" not found.\n'%objname)
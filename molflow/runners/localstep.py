@@ -12,41 +12,303 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import json
+import os
+import subprocess
+import sys
+
+try:
+    from shlex import quote
+except ImportError:  # python 2
+    from pipes import quote
+
+from ..definitions.steps import MapStep
 from ..run import EXECUTOR
+from ..static.runstep import PICKLE_PROTOCOL
+from ..utils import atomic_write
+from .pool import PoolEngine
+from .containerpool import ContainerPoolEngine
+from .fusion import FusedStep, chain_invocation
+from .scatter import MapChunk
+
+PROTOCOL_PROBE = 'import pickle; print(pickle.HIGHEST_PROTOCOL)'
+DEFAULT_PROTOCOLS_FILE = '~/.molflow/protocols.json'
+
+
+class ProtocolCache(object):
+    """ The highest pickle protocol supported by each environment that steps run in.
+
+    Probing an environment means starting a container or an interpreter, so results are kept
+    in memory, and, for environments with a stable identity (a docker image ID, or an
+    interpreter's path and modification time), saved for later runs.
+
+    Args:
+        path (str): JSON file of the form ``{environment: protocol}``
+    """
+    def __init__(self, path=DEFAULT_PROTOCOLS_FILE):
+        self.path = os.path.expanduser(path)
+        self.protocols = {}
+
+    def probe(self, key, run_probe, persist=True):
+        """
+        Args:
+            key (str): identifies the environment
+            run_probe (callable): runs ``PROTOCOL_PROBE`` in the environment, returning its
+               output as a string
+            persist (bool): whether ``key`` identifies the environment across runs
+
+        Returns:
+            int: the highest protocol supported in the environment (or ``PICKLE_PROTOCOL`` if
+               it can't be probed)
+        """
+        if key not in self.protocols:
+            saved = self._load() if persist else {}
+            if key in saved:
+                self.protocols[key] = saved[key]
+                return saved[key]
+            try:
+                self.protocols[key] = int(run_probe().split()[-1])
+            except Exception:  # the step will report the problem with its environment
+                self.protocols[key] = PICKLE_PROTOCOL
+                return PICKLE_PROTOCOL
+            if persist:
+                saved[key] = self.protocols[key]
+                self._save(saved)
+        return self.protocols[key]
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as infile:
+                return json.load(infile)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save(self, protocols):
+        atomic_write(self.path, json.dumps(protocols, indent=1, sort_keys=True))
+
+
+PROTOCOL_CACHE = ProtocolCache()
+
+
+def probe_docker_protocol(client, image, python, run_probe):
+    """ Probe the protocol supported by ``python`` in a docker image, saving the result under
+    the image's ID (so it's probed again if the image is rebuilt)
+    """
+    try:
+        imageid = client.inspect_image(image)['Id']
+    except Exception:  # not pulled yet
+        return PROTOCOL_CACHE.probe('docker:%s:%s' % (image, python), run_probe, persist=False)
+    return PROTOCOL_CACHE.probe('docker:%s:%s' % (imageid, python), run_probe)
+
+
+class DockerEngine(object):
+    """ Runs each step in a fresh container of its function's docker image
+
+    Args:
+        python (str): python command inside the containers (default: "python")
+    """
+    name = 'docker'
+    cache_tag = name  # identifies where steps run, so results from elsewhere aren't reused
+    supports_caching = True
+    supports_fusion = True
+    uses_images = True  # whether steps run in their functions' docker images
+
+    def __init__(self, python=None):
+        import pyccc
+        self.engine = pyccc.engines.Docker()
+        self.python = python or 'python'
+
+    def __str__(self):
+        return self.name
+
+    def make_job(self, step, defdir, inputs, protocol=None, formats=None):
+        image = step_image(step, defdir) if self.uses_images else None
+        return _make_pyccc_job(step, inputs, defdir, image, self.engine, self.python, protocol,
+                               formats)
+
+    def pickle_protocol(self, image):
+        """ The highest pickle protocol supported by the python that runs steps in ``image``
+        """
+        def run_probe():
+            import pyccc
+            job = pyccc.Job(engine=self.engine, image=image,
+                            command='%s -c %s' % (quote(self.python), quote(PROTOCOL_PROBE)),
+                            submit=True)
+            job.wait()
+            return job.stdout
+
+        return probe_docker_protocol(self.engine.client, image, self.python, run_probe)
+
+    def shutdown(self):
+        pass
+
+
+class SubprocessEngine(DockerEngine):
+    """ Runs each step as a local subprocess in its own temporary directory, without docker.
+
+    Steps run with the host's python interpreter, or with ``python`` if specified, which can
+    be the path to an interpreter, the path to a virtualenv, or the name of a conda environment.
+    The functions' dependencies must already be installed in that environment.
+    """
+    name = 'subprocess'
+    uses_images = False
+
+    def __init__(self, python=None):
+        import pyccc
+        self.engine = pyccc.engines.Subprocess()
+        self.python = resolve_interpreter(python)
+        self.cache_tag = '%s:%s' % (self.name, self.python)
+
+    def pickle_protocol(self, image):
+        # steps run with self.python, whatever their image
+        def run_probe():
+            return subprocess.check_output([self.python, '-c', PROTOCOL_PROBE]).decode('utf-8')
+
+        try:
+            key = 'python:%s:%s' % (self.python, os.stat(self.python).st_mtime)
+        except OSError:
+            return PROTOCOL_CACHE.probe('python:%s' % self.python, run_probe, persist=False)
+        return PROTOCOL_CACHE.probe(key, run_probe)
+
+
+ENGINES = {'docker': DockerEngine,
+           'subprocess': SubprocessEngine,
+           'pool': PoolEngine,
+           'docker-pool': ContainerPoolEngine}
+
+
+def get_engine(name='docker', **kwargs):
+    return ENGINES[name](**kwargs)
+
 
+def resolve_interpreter(python=None):
+    """ Find the python executable to run steps with
 
-def make_job(step, defdir, inputs, submit=False):
-    job = _make_pyccc_job(step.fn, inputs, defdir)
+    Args:
+        python (str): path to an interpreter or virtualenv, or a conda environment name
+           (default: the interpreter running molflow)
+
+    Returns:
+        str: path to a python executable
+    """
+    if python is None:
+        return sys.executable
+
+    if os.path.isdir(python):  # virtualenv or conda prefix
+        for candidate in (os.path.join(python, 'bin', 'python'),
+                          os.path.join(python, 'python.exe'),
+                          os.path.join(python, 'Scripts', 'python.exe')):
+            if os.path.isfile(candidate):
+                return os.path.abspath(candidate)
+        raise ValueError('No python interpreter found in environment "%s"' % python)
+
+    if os.path.isfile(python):
+        return os.path.abspath(python)
+
+    try:
+        envlist = json.loads(subprocess.check_output(['conda', 'env', 'list', '--json']
+                                                     ).decode('utf-8'))
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        envlist = {'envs': []}
+    for envpath in envlist['envs']:
+        if os.path.basename(envpath) == python:
+            return resolve_interpreter(envpath)
+
+    raise ValueError('"%s" is not a python interpreter, virtualenv, or conda environment'
+                     % python)
+
+
+def make_job(step, defdir, inputs, submit=False, engine=None, protocol=None, formats=None):
+    """ Create a job that runs ``step`` on ``inputs``. Its return values are pickled with
+    ``protocol`` (default: ``molflow.static.runstep.PICKLE_PROTOCOL``), or the highest protocol
+    that its python supports if that's lower. ``formats`` lists the file format (extension) of
+    each input (default: all pickles).
+    """
+    if engine is None:
+        engine = DockerEngine()
+    job = engine.make_job(step, defdir, inputs, protocol, formats)
     job.name = step._label()
     if submit:
         job.submit()
     return job
 
 
-def _make_pyccc_job(fn, args, defdir, engine=None):
+def _make_pyccc_job(step, args, defdir, image, engine=None, python='python', protocol=None,
+                    formats=None):
     import pyccc
-    inputs = {'runstep.py': pyccc.files.LocalFile(str(EXECUTOR))}
+    runstep_args, inputs = step_invocation(step, args, defdir, protocol, formats)
+    inputs['runstep.py'] = pyccc.files.LocalFile(str(EXECUTOR))
+    command = [quote(python), 'runstep.py'] + runstep_args
+
+    if engine is None:
+        engine = pyccc.engines.Docker()
+
+    job = pyccc.Job(engine=engine,
+                    image=image,
+                    command=' '.join(command),
+                    inputs=inputs,
+                    submit=False)
+    return job
+
 
-    command = ['python runstep.py --numreturn %d' % fn.num_returnvals]
-    if fn.sourcefile:
-        command.append('--sourcefile %s' % fn.sourcefile.name)
+def step_invocation(step, args, defdir, protocol=None, formats=None):
+    """ Command line arguments and input files for running a step, or a fused chain of steps
+    (see :mod:`molflow.runners.fusion`), with ``runstep.py``
+    """
+    if isinstance(step, FusedStep):
+        return chain_invocation(step, args, defdir, protocol, formats)
+    else:
+        return runstep_invocation(step, args, defdir, protocol, formats)
+
+
+def step_image(step, defdir):
+    if isinstance(step, FusedStep):
+        return step.get_docker_image(defdir)
+    else:
+        return step.fn.get_docker_image(defdir)
+
+
+def runstep_invocation(step, args, defdir, protocol=None, formats=None):
+    """ Command line arguments and input files for running a step with ``runstep.py``
+
+    This also handles the jobs that map steps are expanded into: their chunks
+    (:class:`molflow.runners.scatter.MapChunk`), and the map step itself, which gathers the
+    chunks' results.
+
+    Returns:
+        Tuple[List[str], Dict[str, pyccc.files.FileReferenceBase]]: runstep.py's command line
+           arguments, and the files it expects to find in its working directory
+    """
+    import pyccc
+    fn = step.fn
+    inputs = {}
+
+    if isinstance(step, MapStep):  # all of its chunks are done; gather their results
+        command = ['--numreturn', '1', '--gather']
+    elif isinstance(step, MapChunk):
+        command = ['--numreturn', '1', '--mapitems', str(step.mapitems)]
+    else:
+        command = ['--numreturn', str(fn.num_returnvals)] + fn.format_options()
+    for position in sorted(step.unroll):
+        command.extend(['--unroll', str(position)])
+    if step.profile and not isinstance(step, MapStep):
+        command.extend(['--profile', step.profile])
+    if protocol is not None:
+        command.extend(['--protocol', str(protocol)])
+
+    if isinstance(step, MapStep):
+        pass
+    elif fn.sourcefile:
+        command.extend(['--sourcefile', fn.sourcefile.name])
         source_location = defdir/fn.sourcefile
         inputs[fn.sourcefile.name] = pyccc.files.LocalFile(str(source_location))
     elif fn.python_module:
-        command.append('--pymodule %s' % fn.python_module)
+        command.extend(['--pymodule', fn.python_module])
 
     command.append(fn.funcname)
     for i, indata in enumerate(args):
-        argfile = 'arg%d.pkl' % i
+        argfile = 'arg%d.%s' % (i, formats[i] if formats else 'pkl')
         inputs[argfile] = indata
         command.append(argfile)
 
-    if engine is None:
-        engine = pyccc.engines.Docker()
-
-    job = pyccc.Job(engine=engine,
-                    image=fn.get_docker_image(defdir),
-                    command=' '.join(command),
-                    inputs=inputs,
-                    submit=False)
-    return job
+    return command, inputs
@@ -0,0 +1,178 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Engine that runs lightweight, pure-python workflow functions in a local process pool.
+
+Each worker process loads a function's source file or module the first time it runs one of
+its steps. Arguments and return values are passed through the pool's IPC, and return values
+are only pickled to files if something asks for them (e.g., ``--saveall`` or a workflow
+output).
+"""
+import argparse
+import itertools
+import pickle
+import sys
+import traceback
+
+from concurrent import futures
+from pyccc.files import BytesContainer, StringContainer
+
+from ..definitions.steps import MapStep
+from ..static import runstep
+
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL  # only read by this python
+_FUNCTIONS = {}  # functions loaded by this worker process
+
+
+class PoolEngine(object):
+    """ Runs steps in a pool of worker processes on this machine
+
+    Args:
+        maxworkers (int): number of worker processes (default: number of CPUs)
+    """
+    name = 'pool'
+    supports_caching = False  # results stay in memory, so there's nothing to store
+    supports_fusion = False  # values are already passed between steps in memory
+    uses_images = False
+
+    def __init__(self, maxworkers=None):
+        self.executor = futures.ProcessPoolExecutor(maxworkers)
+        self.cache_tag = '%s:%s' % (self.name, sys.executable)
+        self._jobids = itertools.count()
+
+    def __str__(self):
+        return self.name
+
+    def make_job(self, step, defdir, inputs, protocol=None, formats=None):
+        return PoolJob(self, step, defdir, inputs, 'pool:%d' % next(self._jobids))
+
+    def pickle_protocol(self, image):
+        return pickle.HIGHEST_PROTOCOL  # steps run with this python
+
+    def wait(self, job):
+        futures.wait([job.future])
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+class PoolJob(object):
+    """ A step submitted to a :class:`PoolEngine`, with the interface of a pyccc job
+    """
+    image = None
+    stdout = ''
+
+    def __init__(self, engine, step, defdir, inputs, jobid):
+        fn = step.fn
+        self.engine = engine
+        self.name = step._label()
+        self.jobid = jobid
+        self.rundata = {}
+        self.inputs = {'arg%d.pkl' % i: indata for i, indata in enumerate(inputs)}
+        self.command = '%s(%s)' % (fn.funcname, ', '.join(sorted(self.inputs)))
+        self.future = None
+        args = [_pack_argument(indata) for indata in inputs]
+        if isinstance(step, MapStep):  # gather the results of its chunks
+            self._call = (None, None, None, 1, args, 'gather')
+        else:
+            self._call = (str(defdir / fn.sourcefile) if fn.sourcefile else None,
+                          fn.python_module, fn.funcname, fn.num_returnvals, args,
+                          getattr(step, 'mapitems', None))
+        self._outputs = None
+        self._stderr = ''
+
+    def submit(self):
+        self.future = self.engine.executor.submit(_call_function, *self._call)
+
+    @property
+    def status(self):
+        return 'finished' if self.future.done() else 'running'
+
+    @property
+    def stderr(self):
+        self.get_output()
+        return self._stderr
+
+    def kill(self):
+        self.future.cancel()
+
+    def get_output(self, filename=None):
+        if self._outputs is None:
+            succeeded, result = self.future.result()
+            if succeeded:
+                self._outputs = {'return.%d.pkl' % i: ValueContainer(value, 'return.%d.pkl' % i)
+                                 for i, value in enumerate(result)}
+            else:
+                message, self._stderr = result
+                self._outputs = {'__fail__.txt': StringContainer(message, name='__fail__.txt')}
+        if filename:
+            return self._outputs[filename]
+        else:
+            return self._outputs
+
+
+class ValueContainer(BytesContainer):
+    """ A step's return value, held in memory and only pickled if its file is read
+    """
+    def __init__(self, value, name=None):
+        self.value = value
+        self.source = name
+        self.encoded_with = None
+        self.localpath = None
+        self.sourcetype = 'runtime'
+        self._pickled = None
+
+    @property
+    def _contents(self):
+        if self._pickled is None:
+            self._pickled = pickle.dumps(self.value, protocol=PICKLE_PROTOCOL)
+        return self._pickled
+
+
+def _pack_argument(indata):
+    if isinstance(indata, ValueContainer):
+        return 'value', indata.value
+    elif isinstance(indata, bytes):
+        return 'pickle', indata
+    else:
+        return 'pickle', indata.read('rb')
+
+
+def _call_function(sourcefile, python_module, funcname, numreturn, args, mapitems=None):
+    """ Runs in the worker processes. Returns ``(True, [return values])`` on success, or
+    ``(False, (error message, traceback))`` on failure.
+
+    ``mapitems`` works like runstep.py's ``--mapitems``; if it's ``'gather'``, the arguments
+    are concatenated instead of calling a function (like ``--gather``).
+    """
+    try:
+        values = [value if kind == 'value' else runstep.loads_value(value)
+                  for kind, value in args]
+        if mapitems == 'gather':
+            return True, [[item for chunk in values for item in chunk]]
+
+        key = (sourcefile, python_module, funcname)
+        if key not in _FUNCTIONS:
+            _FUNCTIONS[key] = runstep.get_function(argparse.Namespace(
+                    sourcefile=sourcefile, pymodule=python_module, function=funcname))
+
+        func = _FUNCTIONS[key]
+        if mapitems is not None:
+            return True, [[func(item, *values[mapitems:]) for item in values[:mapitems]]]
+        result = func(*values)
+        if numreturn == 1:
+            result = [result]
+        return True, list(result)
+    except Exception as e:
+        return False, (str(e), traceback.format_exc())
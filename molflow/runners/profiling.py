@@ -0,0 +1,73 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Profiling individual workflow steps.
+
+Selected steps run with ``runstep.py --profile``, which wraps the function call in cProfile
+(and, for "memory" profiles, tracemalloc). The profiles are collected into each step's
+directory in the run's output directory.
+"""
+from pathlib import Path
+
+from ..static.runstep import PROFILEFILE, PROFILEREPORT, ALLOCATIONREPORT
+
+
+class StepProfiler(object):
+    """ Chooses which steps to profile, and collects their profiles
+
+    Args:
+        labels (List[str]): profile the steps with these labels (e.g., "minimize.2"). In
+           parameter sweeps, a label without a row ID (e.g. "minimize.2" for
+           "minimize.2@row3") selects the step in every row.
+        functions (List[str]): profile every step that calls one of these functions
+        memory (bool): also trace memory allocations
+        outputdir (str): copy each profiled step's profile to ``[outputdir]/[step label]``
+    """
+    def __init__(self, labels=(), functions=(), memory=False, outputdir=None):
+        self.labels = set(labels)
+        self.functions = set(functions)
+        self.kind = 'memory' if memory else 'cpu'
+        self.outputdir = Path(outputdir) if outputdir is not None else None
+
+    def matches(self, step):
+        label = step._label()
+        return (step.fn.funcname in self.functions or
+                label in self.labels or
+                label.split('@')[0] in self.labels)
+
+    def select(self, steps):
+        """ Mark which of the workflow's steps to profile (sets their ``profile`` attribute)
+        """
+        matched = set()
+        for step in steps:
+            if self.matches(step):
+                step.profile = self.kind
+                matched.update([step.fn.funcname, step._label(), step._label().split('@')[0]])
+
+        for name in sorted((self.labels | self.functions) - matched):
+            print('WARNING: no steps match "%s"; it will not be profiled' % name)
+
+    def collect(self, job, step):
+        """ Copy a profiled step's profile files out of its finished job
+        """
+        if self.outputdir is None:
+            return None
+        stepdir = self.outputdir / step._label()
+        for fname, oput in job.get_output().items():
+            if Path(fname).name in (PROFILEFILE, PROFILEREPORT, ALLOCATIONREPORT):
+                path = stepdir / fname
+                if not path.parent.exists():
+                    path.parent.mkdir(parents=True)
+                oput.put(str(path))
+        return stepdir
@@ -0,0 +1,125 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Resources used by each workflow step, as measured by ``runstep.py`` (see
+:class:`molflow.static.runstep.StepMonitor`).
+"""
+import json
+import os
+
+from ..static.runstep import STATSFILE
+from ..utils import atomic_write
+
+DEFAULT_DURATIONS_FILE = '~/.molflow/durations.json'
+
+COLUMNS = [('Step', None),
+           ('Wall', 'wall_time'),
+           ('CPU user', 'cpu_user'),
+           ('CPU sys', 'cpu_system'),
+           ('Peak RSS', 'peak_rss'),
+           ('Read', 'bytes_read'),
+           ('Written', 'bytes_written')]
+
+
+def read_step_stats(job):
+    """ Get the resources a finished job used
+
+    Returns:
+        dict: the job's statistics (see ``runstep.py``), or None if it didn't record them (e.g.,
+           its results came from the cache, or it ran in the "pool" engine)
+    """
+    try:
+        return json.loads(job.get_output(STATSFILE).read())
+    except (KeyError, ValueError):
+        return None
+
+
+class DurationHistory(object):
+    """ How long each function's steps took to run, as measured in earlier runs. These are
+    the durations that the critical-path schedule (see
+    :class:`molflow.runners.scheduling.CriticalPathQueue`) weighs steps by.
+
+    Args:
+        path (str): JSON file of the form ``{function name: wall time in seconds}``
+    """
+    def __init__(self, path=DEFAULT_DURATIONS_FILE):
+        self.path = os.path.expanduser(path)
+        try:
+            with open(self.path, 'r') as infile:
+                self.durations = json.load(infile)
+        except (IOError, OSError, ValueError):
+            self.durations = {}
+
+    def update(self, function_times):
+        """ Record a run's measurements, replacing earlier ones for the same functions
+
+        Args:
+            function_times (Mapping[str, List[float]]): wall times of each function's steps
+        """
+        for name, times in function_times.items():
+            if times:
+                self.durations[name] = sum(times) / len(times)
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.durations, indent=1, sort_keys=True))
+
+
+def cpu_time(stats):
+    return stats.get('cpu_user', 0.0) + stats.get('cpu_system', 0.0)
+
+
+def format_resource_table(step_stats, top=10):
+    """ Table of the steps that used the most CPU time (or wall time, where CPU time wasn't
+    measured)
+
+    Args:
+        step_stats (Mapping[str, dict]): statistics for each step, keyed by step label
+        top (int): number of steps to list
+
+    Returns:
+        str: the table
+    """
+    ranked = sorted(step_stats.items(),
+                    key=lambda item: (cpu_time(item[1]), item[1]['wall_time']), reverse=True)
+    rows = [[label] + [_format_field(key, stats.get(key)) for _, key in COLUMNS[1:]]
+            for label, stats in ranked[:top]]
+
+    header = [name for name, _ in COLUMNS]
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+    lines = ['  '.join(field.ljust(width) if i == 0 else field.rjust(width)
+                       for i, (field, width) in enumerate(zip(fields, widths))).rstrip()
+             for fields in [header] + rows]
+    lines.insert(1, '-' * len(lines[0]))
+    if len(ranked) > top:
+        lines.append('(%d more not shown)' % (len(ranked) - top))
+    return '\n'.join(lines)
+
+
+def _format_field(key, value):
+    if value is None:
+        return '-'
+    elif key.startswith('bytes') or key == 'peak_rss':
+        return format_bytes(value)
+    else:
+        return '%.2fs' % value
+
+
+def format_bytes(numbytes):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if numbytes < 1024 or unit == 'GiB':
+            break
+        numbytes /= 1024.0
+    if unit == 'B':
+        return '%d B' % numbytes
+    return '%.1f %s' % (numbytes, unit)
@@ -0,0 +1,96 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Run-time expansion of map steps (see :meth:`molflow.definitions.Function.map`).
+
+When a map step's upstream step finishes, the runner splits the list it returned into chunks,
+each of which runs as its own job (``runstep.py --mapitems``). Once all of them are done, the
+map step itself runs as a "gather" job (``runstep.py --gather``) that concatenates their
+results.
+
+The list's items come from the files that ``runstep.py --unroll`` writes for each item, so
+the items don't need to be unpickled outside of the step's environment.
+"""
+import re
+
+from ..static.runstep import loads_value
+from .pool import ValueContainer
+
+ITEMFILE = re.compile(r'^return\.(\d+)/item(\d+)\.pkl$')
+
+
+class MapChunk(object):
+    """ The job that runs a map step's function on one chunk of its items
+
+    Args:
+        mapstep (molflow.definitions.MapStep): the map step
+        index (int): this chunk's position in the list of chunks
+        items (List[pyccc.files.FileReferenceBase]): files holding this chunk's items
+    """
+    unroll = frozenset()
+
+    def __init__(self, mapstep, index, items):
+        self.mapstep = mapstep
+        self.fn = mapstep.fn
+        self.index = index
+        self.items = items
+
+    def __str__(self):
+        return '%s, chunk %d' % (self.mapstep, self.index)
+
+    def __repr__(self):
+        return "<%s>" % self
+
+    def _label(self):
+        return '%s.chunk%d' % (self.mapstep._label(), self.index)
+
+    @property
+    def mapitems(self):
+        return len(self.items)
+
+    @property
+    def profile(self):
+        return self.mapstep.profile
+
+
+def make_chunks(mapstep, items):
+    size = max(mapstep.chunksize, 1)
+    return [MapChunk(mapstep, i, items[start:start+size])
+            for i, start in enumerate(range(0, len(items), size))]
+
+
+def scatter_items(result, job):
+    """ Get the files holding each item of a list-valued step result
+
+    Args:
+        result (molflow.definitions.StepResult): the list to scatter over
+        job: the finished job that produced it
+
+    Returns:
+        List[pyccc.files.FileReferenceBase]: one file per item, in order
+    """
+    items = []
+    outputs = job.get_output()
+    for filename, fileobj in outputs.items():
+        match = ITEMFILE.match(filename)
+        if match and int(match.group(1)) == result.position:
+            items.append((int(match.group(2)), fileobj))
+    if items:
+        return [fileobj for _, fileobj in sorted(items, key=lambda item: item[0])]
+
+    # No item files: either the list is empty, or the engine keeps values in memory
+    whole = outputs['return.%d.pkl' % result.position]
+    if isinstance(whole, ValueContainer):
+        return [ValueContainer(item) for item in whole.value]
+    return [ValueContainer(item) for item in loads_value(whole.read('rb'))]
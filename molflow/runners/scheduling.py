@@ -0,0 +1,117 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Policies for choosing which ready step the LocalRunner launches next.
+
+Each policy is a queue of steps whose dependencies have all finished; the runner pushes steps
+as they become ready and pops them whenever a CPU is free.
+"""
+import collections
+import heapq
+import itertools
+
+DEFAULT_DURATION = 1.0
+
+
+class FifoQueue(object):
+    """ Launch steps in the order that they became ready
+    """
+    def __init__(self, dependents, durations=None):
+        self._queue = collections.deque()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def push(self, step):
+        self._queue.append(step)
+
+    def pop(self):
+        return self._queue.popleft()
+
+    def inherit(self, steps, parent):
+        pass
+
+
+class CriticalPathQueue(object):
+    """ Launch the ready step with the longest chain of work downstream of it first.
+
+    Args:
+        dependents (Mapping[Step, List[Step]]): steps that consume each step's results
+        durations (Mapping[str, float]): known or estimated run time (in seconds) for each
+           function name; functions that aren't listed count as ``DEFAULT_DURATION``
+    """
+    def __init__(self, dependents, durations=None):
+        self.priorities = critical_path_lengths(dependents, durations)
+        self._heap = []
+        self._counter = itertools.count()  # ties go to whichever step became ready first
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, step):
+        heapq.heappush(self._heap, (-self.priorities[step], next(self._counter), step))
+
+    def pop(self):
+        return heapq.heappop(self._heap)[-1]
+
+    def inherit(self, steps, parent):
+        """ Give steps created at run time (e.g., the chunks of a map step) their parent's
+        priority
+        """
+        for step in steps:
+            self.priorities[step] = self.priorities[parent]
+
+
+def critical_path_lengths(dependents, durations=None):
+    """ Calculate the duration of the longest path from each step to the end of the workflow
+    (including the step itself).
+
+    Args:
+        dependents (Mapping[Step, List[Step]]): steps that consume each step's results
+        durations (Mapping[str, float]): estimated run time for each function name
+
+    Returns:
+        Dict[Step, float]: the critical path length starting at each step
+    """
+    if durations is None:
+        durations = {}
+
+    # Visit steps in reverse topological order, so every step's dependents come first
+    num_upstream = collections.Counter()
+    for step, consumers in dependents.items():
+        for consumer in consumers:
+            num_upstream[consumer] += 1
+    order = [step for step in dependents if not num_upstream[step]]
+    for step in order:
+        for consumer in dependents[step]:
+            num_upstream[consumer] -= 1
+            if not num_upstream[consumer]:
+                order.append(consumer)
+
+    lengths = {}
+    for step in reversed(order):
+        downstream = max([lengths[consumer] for consumer in dependents[step]] or [0.0])
+        lengths[step] = step_duration(step, durations) + downstream
+    return lengths
+
+
+def step_duration(step, durations):
+    """ Estimated run time for a step, or for all the steps in a fused chain
+    """
+    members = getattr(step, 'steps', [step])
+    return sum(durations.get(member.fn.name, DEFAULT_DURATION) for member in members)
+
+
+SCHEDULES = collections.OrderedDict([('critical-path', CriticalPathQueue),
+                                     ('fifo', FifoQueue)])
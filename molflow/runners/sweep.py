@@ -0,0 +1,140 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Parameter sweeps: run one workflow over many sets of inputs with a single scheduler.
+
+The workflow's steps are copied for each row of inputs, and the copies are merged into one
+workflow that a single :class:`molflow.runners.localrunner.LocalRunner` runs. A step is only
+copied once for all the rows that give the same values to the inputs it depends on, so
+steps whose inputs are identical across rows run once and are shared.
+"""
+import copy
+import csv
+import hashlib
+import json
+import re
+
+from past.builtins import basestring
+
+from ..definitions import datasources
+from ..definitions.steps import StepResult
+from ..definitions.workflows import WorkflowDefinition
+
+ROW_ID = re.compile(r'^[\w.-]+$')
+
+
+def read_sweep_file(path, workflow):
+    """ Read the input sets for a sweep from a JSON-lines or CSV file
+
+    Each row gives the inputs' values as they'd be passed on the command line. In a ``.jsonl``
+    file, each line is a JSON object mapping input names to values; a ``.csv`` file has a
+    header row with the input names. An ``id`` field (unless the workflow has an input with
+    that name) names the row's output directory; rows are otherwise numbered from 0.
+
+    Returns:
+        List[Tuple[str, Dict[str, str]]]: each row's ID and input values
+    """
+    if str(path).endswith('.csv'):
+        with open(str(path), 'r') as sweepfile:
+            records = list(csv.DictReader(sweepfile))
+    else:
+        with open(str(path), 'r') as sweepfile:
+            records = [json.loads(line) for line in sweepfile if line.strip()]
+
+    rows = []
+    for i, record in enumerate(records):
+        if 'id' in record and 'id' not in workflow.inputs:
+            rowid = str(record.pop('id'))
+        else:
+            rowid = str(i)
+        if not ROW_ID.match(rowid):
+            raise ValueError('Invalid sweep row ID "%s" - IDs are used as directory names, '
+                             'and may only contain letters, numbers, ".", "_" and "-"' % rowid)
+        fields = {}
+        for name, value in record.items():
+            fields[name] = value if isinstance(value, basestring) else json.dumps(value)
+        rows.append((rowid, fields))
+
+    ids = [rowid for rowid, _ in rows]
+    if len(set(ids)) != len(ids):
+        raise ValueError('Row IDs in sweep file %s are not unique' % path)
+    return rows
+
+
+def sweep_workflow(workflow, rows):
+    """ Merge copies of a workflow for each set of inputs into a single workflow
+
+    Args:
+        workflow (molflow.definitions.WorkflowDefinition): the workflow to sweep
+        rows (List[Tuple[str, Mapping[str, bytes]]]): each row's ID and (translated) inputs
+
+    Returns:
+        Tuple[WorkflowDefinition, Dict[str, bytes], Dict[str, Dict[str, str]]]: the merged
+           workflow, its inputs, and the names of each row's outputs in the merged workflow
+           (keyed by row ID, then by the name of the output in the original workflow)
+    """
+    merged = WorkflowDefinition(workflow.name, workflow.metadata)
+    merged.definition_path = workflow.definition_path
+    inputs = {}
+    row_outputs = {}
+    upstream_inputs = {}
+    copies = {}
+    input_copies = {}
+
+    # names of the workflow inputs that each step's results depend on
+    for step in workflow.graph:  # upstream steps come first
+        names = set()
+        for arg in step.args:
+            if isinstance(arg, datasources.ExternalInput):
+                names.add(arg.name)
+            elif isinstance(arg, StepResult):
+                names.update(upstream_inputs[arg.step])
+        upstream_inputs[step] = frozenset(names)
+
+    for rowid, values in rows:
+        digests = {name: hashlib.sha256(value).hexdigest() for name, value in values.items()}
+        row_copies = {}
+
+        def copy_arg(arg):
+            if isinstance(arg, datasources.ExternalInput):
+                key = (arg.name, digests[arg.name])
+                if key not in input_copies:
+                    name = '%s@%s' % (arg.name, rowid)
+                    input_copies[key] = merged.add_input(name, arg.description, arg.type,
+                                                         arg.default)
+                    inputs[name] = values[arg.name]
+                return input_copies[key]
+            elif isinstance(arg, StepResult):
+                return StepResult(row_copies[arg.step], arg.position)
+            else:
+                return arg
+
+        for step in workflow.graph:
+            key = (step, tuple((name, digests[name]) for name in sorted(upstream_inputs[step])))
+            if key not in copies:
+                stepcopy = copy.copy(step)
+                stepcopy.args = tuple(copy_arg(arg) for arg in step.args)
+                stepcopy.unroll = set(step.unroll)
+                stepcopy.tag = rowid
+                copies[key] = stepcopy
+            row_copies[step] = copies[key]
+
+        row_outputs[rowid] = {}
+        for name, outputdata in workflow.outputs.items():
+            mergedname = '%s/%s' % (rowid, name)
+            merged.set_output(copy_arg(outputdata.source), mergedname,
+                              outputdata.description, outputdata.type)
+            row_outputs[rowid][name] = mergedname
+
+    return merged, inputs, row_outputs
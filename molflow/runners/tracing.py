@@ -0,0 +1,137 @@
+# Copyright 2017 Autodesk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Timing traces of workflow runs, in Chrome's trace-event format.
+
+The trace has a track for each step, showing the phases it went through on the host:
+
+ - ``queued``: ready to run, but waiting for a free CPU (``--maxcpus``)
+ - ``submit``: starting the job and uploading its input files
+ - ``running``: from submission until the job finished
+ - ``detect``: from the job finishing until the scheduler noticed (e.g., while polling)
+ - ``collect``: downloading the job's output files and storing its results
+
+and, nested inside ``running``, the phases that ``runstep.py`` timed inside the job (loading
+the function and its arguments, calling it, and serializing its return values). A separate
+"scheduler" track shows when the scheduler was idle, waiting for jobs to finish.
+
+Load the trace file in https://ui.perfetto.dev or chrome://tracing.
+"""
+import json
+import threading
+import time
+
+from ..static.runstep import TIMINGFILE
+
+SCHEDULER_TRACK = 0
+
+
+class RunTrace(object):
+    """ Records the timeline of a :class:`molflow.runners.localrunner.LocalRunner` run.
+
+    The runner's watcher threads report when jobs finish, so all methods are thread-safe.
+    """
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+        self._origin = time.time()
+        self._tracks = {}
+        self._marks = {}
+        self._name_track(SCHEDULER_TRACK, 'scheduler')
+
+    def mark(self, step, event, when=None):
+        """ Record when ``event`` (e.g., "ready" or "done") happened to ``step``
+        """
+        with self._lock:
+            self._marks[step, event] = time.time() if when is None else when
+
+    def span(self, step, name, start_event, end=None, **args):
+        """ Add a phase of ``step`` that ran from a marked event until ``end`` (default: now)
+
+        Nothing is recorded if ``start_event`` was never marked.
+        """
+        end = time.time() if end is None else end
+        with self._lock:
+            start = self._marks.pop((step, start_event), None)
+        if start is not None:
+            self.add(self._track(step), name, start, end, **args)
+
+    def idle(self, start, end):
+        self.add(SCHEDULER_TRACK, 'idle', start, end)
+
+    def job_finished(self, step):
+        """ Called when the scheduler notices that a step's job finished
+        """
+        now = time.time()
+        with self._lock:
+            done = self._marks.pop((step, 'done'), now)
+        self.span(step, 'running', 'submitted', end=done)
+        if done < now:
+            self.add(self._track(step), 'detect', done, now)
+
+    def add_collect(self, step, job, start):
+        """ Add the time spent collecting a step's results, and the phases timed in its job
+        """
+        self.add(self._track(step), 'collect', start, time.time())
+        self.add_job_phases(step, job)
+
+    def add_job_phases(self, step, job):
+        """ Add the phases that ``runstep.py`` timed inside the job, if it recorded them
+        """
+        try:
+            timing = json.loads(job.get_output(TIMINGFILE).read())
+        except (KeyError, ValueError):
+            return
+        track = self._track(step)
+        for name, start, end in timing['phases']:
+            self.add(track, name, start, end, category='job')
+
+    def add(self, track, name, start, end, category='runner', **args):
+        event = {'name': name,
+                 'cat': category,
+                 'ph': 'X',
+                 'pid': 1,
+                 'tid': track,
+                 'ts': self._microseconds(start),
+                 'dur': max(int(round((end - start) * 1e6)), 0)}
+        if args:
+            event['args'] = args
+        with self._lock:
+            self.events.append(event)
+
+    def write(self, path):
+        """ Write the trace as a Chrome trace-event JSON file
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(str(path), 'w') as tracefile:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, tracefile)
+
+    def _track(self, step):
+        with self._lock:
+            if step in self._tracks:
+                return self._tracks[step]
+            track = self._tracks[step] = len(self._tracks) + 1
+        self._name_track(track, step._label())
+        return track
+
+    def _name_track(self, track, name):
+        with self._lock:
+            self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': track,
+                                'args': {'name': name}})
+            self.events.append({'name': 'thread_sort_index', 'ph': 'M', 'pid': 1,
+                                'tid': track, 'args': {'sort_index': track}})
+
+    def _microseconds(self, when):
+        return int(round((when - self._origin) * 1e6))
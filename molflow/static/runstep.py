@@ -19,32 +19,85 @@
 See documentation in `molflow/runners/README.md for explanation of CLI arguments.
 """
 import argparse
+import contextlib
+import cProfile
 import importlib
+import json
+import mmap
 import os
 import pickle
+import pstats
+import struct
 import sys
+import time
+import traceback
 
-PICKLE_PROTOCOL = 2
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:  # python 2
+    tracemalloc = None
+
+PICKLE_PROTOCOL = 2  # default: readable by every supported python
+OOB_MIN_BYTES = 1 << 20  # smaller buffers stay in the pickle stream
+OOB_ALIGNMENT = 64
+OOB_MAGIC = b'MFOOBUF1'
+OOB_FOOTER = struct.Struct('<QQ8s')  # index offset, number of buffers, OOB_MAGIC
+SERVE_POLLTIME = 0.02
+TIMINGFILE = '__timing__.json'
+STATSFILE = '__stats__.json'
+PROFILEFILE = '__profile__.prof'
+PROFILEREPORT = '__profile__.txt'
+ALLOCATIONREPORT = '__allocations__.txt'
+NUM_REPORTED = 40  # functions or source lines listed in profiling reports
 PYTHONV = sys.version_info.major
 assert PYTHONV in (2, 3)
 
+# ru_maxrss is in kilobytes, except on macOS
+RSS_UNITS = 1 if sys.platform == 'darwin' else 1024
+
 if PYTHONV == 2:
     builtin = __builtins__
 
 
-def parse_cli():
+def parse_cli(argv=None):
     parser = argparse.ArgumentParser()
     parser.add_argument('function')
     #parser.add_argument('--kwargs', nargs='*', default={})
-    parser.add_argument('--unroll', nargs='+', default=[])
+    parser.add_argument('--unroll', action='append', type=int, default=None)
     parser.add_argument('--numreturn', type=int)
+    parser.add_argument('--mapitems', type=int)
+    parser.add_argument('--gather', action='store_true')
+    parser.add_argument('--profile', choices=['cpu', 'memory'])
     parser.add_argument('--sourcefile', type=str)
     parser.add_argument('--pymodule', type=str)
+    parser.add_argument('--protocol', type=int, default=PICKLE_PROTOCOL)
+    parser.add_argument('--format', action='append', dest='formats', default=None,
+                        metavar='POSITION:FORMAT')
     parser.add_argument('arguments', nargs=argparse.REMAINDER, default=[])
     #parser.add_argument('--literal', nargs='+', default=[])
     #parser.add_argument('--jsonfile', nargs='+', default=[])
 
-    return parser.parse_args()
+    cliargs = parser.parse_args(argv)
+    if cliargs.unroll is None:
+        cliargs.unroll = []
+    cliargs.formats = parse_formats(cliargs.formats or [])
+    return cliargs
+
+
+def parse_formats(specs):
+    """ Read ``--format`` options (``POSITION:FORMAT``) into a dict of the form
+    ``{position: format}``
+    """
+    formats = {}
+    for spec in specs:
+        position, fmt = spec.split(':')
+        formats[int(position)] = fmt
+    return formats
 
 
 def get_arguments(cliargs):
@@ -84,47 +137,560 @@ def get_function(cliargs):
 
 
 def load_argument(path):
-    if path.split('.')[-1].lower() in ('p', 'pkl', 'pickle'):
-        with open(path, 'rb') as picklefile:
-            data = pickle.load(picklefile)
-        return data
+    extension = path.split('.')[-1].lower()
+    if extension in CODECS:
+        return CODECS[extension].load(path)
     else:  # assume string TODO: py2 / py3 unicode issues
         with open(path, 'r') as infile:
             data = infile.read()
         return data
 
 
-def serialize_output(returnval, cliargs):
+def dump_value(value, outfile, protocol=PICKLE_PROTOCOL):
+    """ Pickles ``value`` to ``outfile`` with ``protocol``, or the highest protocol that this
+    python supports if that's lower.
+
+    From protocol 5 on, buffers of at least ``OOB_MIN_BYTES`` (such as the data of large numpy
+    arrays) are written out of band: after the pickle stream, each aligned to
+    ``OOB_ALIGNMENT`` bytes, followed by an index of their offsets and sizes and then by
+    ``OOB_FOOTER``. :func:`load_value` maps them into memory instead of copying them.
+    """
+    protocol = min(protocol, pickle.HIGHEST_PROTOCOL)
+    if protocol < 5:
+        pickle.dump(value, outfile, protocol=protocol)
+        return
+
+    buffers = []
+    pickle.dump(value, outfile, protocol=protocol,
+                buffer_callback=lambda buf: _keep_in_band(buf, buffers))
+    if not buffers:
+        return
+    index = []
+    position = outfile.tell()
+    for buf in buffers:
+        padding = -position % OOB_ALIGNMENT
+        outfile.write(b'\0' * padding)
+        position += padding
+        index.extend((position, buf.nbytes))
+        outfile.write(buf)
+        position += buf.nbytes
+    outfile.write(struct.pack('<%dQ' % len(index), *index))
+    outfile.write(OOB_FOOTER.pack(position, len(buffers), OOB_MAGIC))
+
+
+def _keep_in_band(picklebuffer, buffers):
+    """ buffer_callback for :func:`dump_value`: returns True to pickle a buffer in band, or
+    stores it in ``buffers`` to write it out of band """
+    try:
+        buf = picklebuffer.raw()
+    except BufferError:  # not contiguous
+        return True
+    if buf.nbytes < OOB_MIN_BYTES:
+        return True
+    buffers.append(buf)
+    return False
+
+
+def load_value(path):
+    """ Unpickles a file written by :func:`dump_value`
+    """
+    with open(path, 'rb') as infile:
+        infile.seek(0, os.SEEK_END)
+        if infile.tell() < OOB_FOOTER.size:
+            has_buffers = False
+        else:
+            infile.seek(-OOB_FOOTER.size, os.SEEK_END)
+            has_buffers = infile.read().endswith(OOB_MAGIC)
+        infile.seek(0)
+        if not has_buffers:
+            return pickle.load(infile)
+
+        # copy-on-write, so that functions can modify their arguments without changing the file
+        mapped = memoryview(mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_COPY))
+        return pickle.load(infile, buffers=out_of_band_buffers(mapped))
+
+
+def loads_value(data):
+    """ Like :func:`load_value`, for a file's contents
+    """
+    buffers = out_of_band_buffers(memoryview(data))
+    if buffers is None:
+        return pickle.loads(data)
+    return pickle.loads(data, buffers=buffers)
+
+
+def has_out_of_band_buffers(data):
+    """ Whether a file's contents have out-of-band buffers """
+    return data[-len(OOB_MAGIC):] == OOB_MAGIC
+
+
+def to_pickle(data, fmt='pkl', protocol=PICKLE_PROTOCOL):
+    """ Convert the contents of a return value's file, in format ``fmt``, to a pickle that can
+    be loaded on its own (without out-of-band buffers)
+    """
+    if fmt == 'pkl' and not has_out_of_band_buffers(data):
+        return data
+    return pickle.dumps(CODECS[fmt].loads(data), protocol=protocol)
+
+
+def out_of_band_buffers(data):
+    """ The out-of-band buffers stored after the pickle stream in ``data`` (a memoryview of a
+    file written by :func:`dump_value`), as views of ``data``; or None if there aren't any
+    """
+    if len(data) < OOB_FOOTER.size:
+        return None
+    indexoffset, numbuffers, magic = OOB_FOOTER.unpack(data[-OOB_FOOTER.size:].tobytes())
+    if magic != OOB_MAGIC:
+        return None
+    indexsize = struct.calcsize('<%dQ' % (2 * numbuffers))
+    index = struct.unpack('<%dQ' % (2 * numbuffers),
+                          data[indexoffset:indexoffset + indexsize].tobytes())
+    return [data[offset:offset + size] for offset, size in zip(index[::2], index[1::2])]
+
+
+class PickleCodec(object):
+    """ Stores any picklable value, with :func:`dump_value` and :func:`load_value`
+    """
+    extension = 'pkl'
+
+    def accepts(self, value):
+        return True
+
+    def dump(self, value, outfile, protocol=PICKLE_PROTOCOL):
+        dump_value(value, outfile, protocol)
+
+    def load(self, path):
+        return load_value(path)
+
+    def loads(self, data):
+        return loads_value(data)
+
+
+class TextCodec(PickleCodec):
+    """ Stores strings as UTF-8 text, which steps read without unpickling them
+    """
+    extension = 'txt'
+
+    def accepts(self, value):
+        return type(value) is type(u'')
+
+    def dump(self, value, outfile, protocol=None):
+        outfile.write(value.encode('utf-8'))
+
+    def load(self, path):
+        with open(path, 'rb') as infile:
+            return self.loads(infile.read())
+
+    def loads(self, data):
+        return bytes(data).decode('utf-8')
+
+
+class BytesCodec(TextCodec):
+    """ Stores bytes as they are
+    """
+    extension = 'bin'
+
+    def accepts(self, value):
+        return type(value) is bytes
+
+    def dump(self, value, outfile, protocol=None):
+        outfile.write(value)
+
+    def loads(self, data):
+        return bytes(data)
+
+
+class NpyCodec(PickleCodec):
+    """ Stores numpy arrays (except arrays of python objects) in ``.npy`` files. Files of at
+    least ``mmap_min_bytes`` are mapped into memory (copy-on-write) when they're loaded.
+    """
+    extension = 'npy'
+
+    def __init__(self, mmap_min_bytes=OOB_MIN_BYTES):
+        self.mmap_min_bytes = mmap_min_bytes
+
+    def accepts(self, value):
+        numpy = sys.modules.get('numpy')  # if it isn't imported, value isn't an array
+        return (numpy is not None and type(value) in (numpy.ndarray, numpy.memmap) and
+                not value.dtype.hasobject)
+
+    def dump(self, value, outfile, protocol=None):
+        import numpy
+        numpy.save(outfile, value, allow_pickle=False)
+
+    def load(self, path):
+        import numpy
+        mmap_mode = 'c' if os.path.getsize(path) >= self.mmap_min_bytes else None
+        return numpy.load(path, mmap_mode=mmap_mode, allow_pickle=False)
+
+    def loads(self, data):
+        import io
+        import numpy
+        return numpy.load(io.BytesIO(data), allow_pickle=False)
+
+
+class MsgpackCodec(PickleCodec):
+    """ Stores plain data (dicts with string keys, lists, strings, bytes, numbers, booleans and
+    None, nested in any way) with msgpack, if it's installed. Steps that read it need msgpack too.
+    Tuples aren't accepted, because they'd be read back as lists.
+    """
+    extension = 'msgpack'
+    SCALARS = (type(u''), bytes, float, bool, type(None))
+
+    def accepts(self, value):
+        try:
+            import msgpack  # noqa: F401 -- the readers need it too, but this can only check here
+        except ImportError:
+            return False
+        integers = (int, long) if PYTHONV == 2 else (int,)
+        stack = [value]
+        while stack:
+            item = stack.pop()
+            if type(item) is list:
+                stack.extend(item)
+            elif type(item) is dict:
+                if any(type(key) is not type(u'') for key in item):
+                    return False
+                stack.extend(item.values())
+            elif type(item) in integers:
+                if not -2**63 <= item < 2**64:
+                    return False
+            elif type(item) not in self.SCALARS:
+                return False
+        return True
+
+    def dump(self, value, outfile, protocol=None):
+        import msgpack
+        outfile.write(msgpack.packb(value, use_bin_type=True))
+
+    def load(self, path):
+        with open(path, 'rb') as infile:
+            return self.loads(infile.read())
+
+    def loads(self, data):
+        import msgpack
+        return msgpack.unpackb(data, raw=False)
+
+
+# Each codec writes files with its extension, and reads files by their extension. A return
+# value's codec is chosen with ``--format POSITION:FORMAT``, where FORMAT is an extension;
+# values that the codec doesn't accept, or that no format was chosen for, are pickled.
+FORMATS = [PickleCodec(), TextCodec(), BytesCodec(), NpyCodec(), MsgpackCodec()]
+CODECS = {codec.extension: codec for codec in FORMATS}
+CODECS['p'] = CODECS['pickle'] = CODECS['pkl']
+
+
+def output_codec(value, fmt=None):
+    """ The codec to write a return value with: the one for ``fmt`` if it accepts the value,
+    otherwise pickle
+    """
+    codec = CODECS.get(fmt)
+    if codec is None or not codec.accepts(value):
+        codec = CODECS['pkl']
+    return codec
+
+
+def serialize_output(returnval, cliargs, outdir='.'):
+    """ Writes the return values to files, and returns the number of bytes written
+    """
+    written = []
     if cliargs.numreturn == 1:
         returnval = [returnval]
 
     for ival, outval in enumerate(returnval):
-        if ival in cliargs.unroll:
-            os.mkdir('return.%d' % ival)
+        if ival in cliargs.unroll:  # one file per item, for map steps to scatter over
+            outval = list(outval)
+            os.mkdir(os.path.join(outdir, 'return.%d' % ival))
             for iunroll, item in enumerate(outval):
-                with open('return.%d/item%d.pkl' % (ival, iunroll), 'w') as outfile:
-                    pickle.dump(item, outfile, protocol=PICKLE_PROTOCOL)
+                itempath = os.path.join(outdir, 'return.%d/item%06d.pkl' % (ival, iunroll))
+                with open(itempath, 'wb') as outfile:
+                    dump_value(item, outfile, cliargs.protocol)
+                written.append(itempath)
+            codec = CODECS['pkl']  # map steps read the list as a pickle
+        else:
+            codec = output_codec(outval, cliargs.formats.get(ival))
 
-        #elif is_string(outval):
-        #    with open('return.%d.txt' % ival, 'wb') as outfile:
-        #        outfile.write(outval)
+        # the whole value is written even if it's unrolled, for any other consumers
+        outpath = os.path.join(outdir, 'return.%d.%s' % (ival, codec.extension))
+        with open(outpath, 'wb') as outfile:
+            codec.dump(outval, outfile, cliargs.protocol)
+        written.append(outpath)
 
-        else:
-            with open('return.%d.pkl' % ival, 'wb') as outfile:
-                pickle.dump(outval, outfile, protocol=PICKLE_PROTOCOL)
+    return sum(os.path.getsize(path) for path in written)
 
 
-def main():
+class StepMonitor(object):
+    """ Records when each phase of a step (loading arguments, calling the function, ...)
+    starts and ends, so the runner can add them to its trace of the run, and the resources
+    that the step used.
+    """
+    def __init__(self):
+        self.phases = []
+        self.start = time.time()
+        self.usage = resource.getrusage(resource.RUSAGE_SELF) if resource else None
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.phases.append([name, start, time.time()])
+
+    def read_arguments(self, paths):
+        self.bytes_read += sum(os.path.getsize(path) for path in paths)
+
+    def write(self):
+        """ Writes the phase timings to ``__timing__.json``, and the step's wall time, CPU
+        time, peak memory use (of the whole process, which for ``--serve`` workers includes
+        earlier steps) and bytes read and written to ``__stats__.json``
+        """
+        with open(TIMINGFILE, 'w') as timingfile:
+            json.dump({'phases': self.phases}, timingfile)
+
+        stats = {'wall_time': time.time() - self.start,
+                 'bytes_read': self.bytes_read,
+                 'bytes_written': self.bytes_written}
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            stats['cpu_user'] = usage.ru_utime - self.usage.ru_utime
+            stats['cpu_system'] = usage.ru_stime - self.usage.ru_stime
+            stats['peak_rss'] = usage.ru_maxrss * RSS_UNITS
+        with open(STATSFILE, 'w') as statsfile:
+            json.dump(stats, statsfile)
+
+
+@contextlib.contextmanager
+def profiling(cliargs, outdir='.'):
+    """ Profiles the code run inside this context with cProfile if ``cliargs.profile`` is set,
+    and also traces its memory allocations with tracemalloc if it's "memory".
+
+    Writes the profile to ``__profile__.prof`` (for ``pstats`` or snakeviz), a report of the
+    functions with the most cumulative time to ``__profile__.txt``, and the source lines that
+    allocated the most memory to ``__allocations__.txt``.
+    """
+    if not cliargs.profile:
+        yield
+        return
+
+    tracing = cliargs.profile == 'memory' and tracemalloc is not None
+    if tracing:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(os.path.join(outdir, PROFILEFILE))
+        with open(os.path.join(outdir, PROFILEREPORT), 'w') as report:
+            stats = pstats.Stats(profiler, stream=report)
+            stats.sort_stats('cumulative').print_stats(NUM_REPORTED)
+
+        if cliargs.profile == 'memory':
+            with open(os.path.join(outdir, ALLOCATIONREPORT), 'w') as report:
+                if tracing:
+                    write_allocations(report)
+                else:
+                    report.write('tracemalloc is not available in python %d\n' % PYTHONV)
+
+
+def write_allocations(report):
+    snapshot = tracemalloc.take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    report.write('Traced memory: %d bytes at exit, %d bytes at peak\n\n' % (current, peak))
+    report.write('Memory still allocated at exit, by source line:\n')
+    for stat in snapshot.statistics('lineno')[:NUM_REPORTED]:
+        report.write('%s\n' % stat)
+
+
+def run_step(cliargs, func, monitor=None):
+    """ Calls ``func`` on the arguments and writes its return values.
+
+    With ``--mapitems N``, the first N arguments are items to map over: ``func`` is called
+    on each of them (followed by the remaining arguments), and returns a list of the results.
+    With ``--gather``, there's no function to call: the arguments are lists of results from
+    mapped chunks, and are concatenated.
+    """
+    if monitor is None:
+        monitor = StepMonitor()
     try:
-        cliargs = parse_cli()
-        func = get_function(cliargs)
-        args, kwargs = get_arguments(cliargs)
-        returnval = func(*args, **kwargs)
-        serialize_output(returnval, cliargs)
+        with monitor.phase('load arguments'):
+            args, kwargs = get_arguments(cliargs)
+            monitor.read_arguments(cliargs.arguments)
+        with monitor.phase('call'), profiling(cliargs):
+            if cliargs.gather:
+                returnval = [item for chunk in args for item in chunk]
+            elif cliargs.mapitems is not None:
+                items, args = args[:cliargs.mapitems], args[cliargs.mapitems:]
+                returnval = [func(item, *args, **kwargs) for item in items]
+            else:
+                returnval = func(*args, **kwargs)
+        with monitor.phase('serialize'):
+            monitor.bytes_written += serialize_output(returnval, cliargs)
     except Exception as e:
-        with open('__fail__.txt', 'w') as failfile:
-            failfile.write(str(e))
+        write_failure(e)
         raise
+    finally:
+        monitor.write()
+
+
+def write_failure(exc):
+    with open('__fail__.txt', 'w') as failfile:
+        failfile.write(str(exc))
+
+
+def get_cached_function(cliargs, functions):
+    """ Like :func:`get_function`, but reuses functions already loaded into ``functions``
+    """
+    if cliargs.sourcefile:
+        with open(cliargs.sourcefile, 'r') as sourcefile:
+            key = (sourcefile.read(), cliargs.function)
+    else:
+        key = (cliargs.pymodule, cliargs.function)
+    if key not in functions:
+        functions[key] = get_function(cliargs)
+    return functions[key]
+
+
+def load_function(cliargs, functions=None):
+    """ Load the function to run, recording the failure if it can't be loaded
+    """
+    if cliargs.gather:
+        return None
+    try:
+        if functions is None:
+            return get_function(cliargs)
+        else:
+            return get_cached_function(cliargs, functions)
+    except Exception as e:
+        write_failure(e)
+        raise
+
+
+def run_chain(chainfile, functions=None):
+    """ Runs a chain of fused steps back to back, passing intermediate results in memory.
+
+    ``chainfile`` is a JSON file with a list of ``links``, one per step. Each link names the
+    step's function like the command line arguments do (``function``, ``sourcefile``,
+    ``pymodule``, ``numreturn``, ``unroll``), and lists its ``arguments``: either the name of an input
+    file, or ``{"link": i, "position": j}`` for return value ``j`` of link ``i``. The last
+    step's return values are written to the working directory; the others' are only written
+    (to a subdirectory named after the step's ``label``) if ``save_intermediates`` is set.
+    A link's optional ``profile`` works like ``--profile``, and writes to that subdirectory,
+    and its optional ``formats`` (``{position: format}``) work like ``--format``.
+    The spec's optional ``protocol`` works like ``--protocol``, for all of the links.
+    """
+    if functions is None:
+        functions = {}
+    with open(chainfile, 'r') as specfile:
+        spec = json.load(specfile)
+
+    monitor = StepMonitor()
+    results = []
+    for ilink, link in enumerate(spec['links']):
+        cliargs = argparse.Namespace(function=link['function'],
+                                     sourcefile=link['sourcefile'],
+                                     pymodule=link['pymodule'],
+                                     numreturn=link['numreturn'],
+                                     unroll=link['unroll'],
+                                     profile=link.get('profile'),
+                                     protocol=spec.get('protocol', PICKLE_PROTOCOL),
+                                     formats={int(position): fmt for position, fmt
+                                              in link.get('formats', {}).items()})
+        label = link['label']
+        try:
+            with monitor.phase('%s: load function' % label):
+                func = get_cached_function(cliargs, functions)
+            with monitor.phase('%s: load arguments' % label):
+                args = [results[arg['link']][arg['position']] if isinstance(arg, dict)
+                        else load_argument(arg) for arg in link['arguments']]
+                monitor.read_arguments(arg for arg in link['arguments']
+                                       if not isinstance(arg, dict))
+            if cliargs.profile and not os.path.isdir(label):
+                os.mkdir(label)
+            with monitor.phase('%s: call' % label), profiling(cliargs, label):
+                returnval = func(*args)
+
+            if cliargs.numreturn == 1:
+                results.append([returnval])
+            else:
+                results.append(list(returnval))
+
+            if ilink == len(spec['links']) - 1:
+                with monitor.phase('%s: serialize' % label):
+                    monitor.bytes_written += serialize_output(returnval, cliargs)
+            elif spec['save_intermediates']:
+                with monitor.phase('%s: serialize' % label):
+                    if not os.path.isdir(label):
+                        os.mkdir(label)
+                    monitor.bytes_written += serialize_output(returnval, cliargs, label)
+        except Exception as e:
+            write_failure('Step %s: %s' % (label, e))
+            monitor.write()
+            raise
+    monitor.write()
+
+
+def serve(workdir):
+    """ Resident worker: runs step invocations as they're written to ``workdir``, so that
+    container startup and imports are paid once for many steps.
+
+    For each step, the host creates a task directory containing the step's input files and an
+    ``invocation.json`` file with its runstep command line arguments, then creates an empty
+    ``[task].ready`` file. The worker runs the step in the task directory and creates
+    ``[task].done`` when it's finished. It exits once ``__shutdown__`` appears.
+    """
+    functions = {}
+    while not os.path.exists(os.path.join(workdir, '__shutdown__')):
+        ready = sorted(f for f in os.listdir(workdir) if f.endswith('.ready'))
+        if not ready:
+            time.sleep(SERVE_POLLTIME)
+            continue
+
+        for marker in ready:
+            taskdir = os.path.join(workdir, marker[:-len('.ready')])
+            os.remove(os.path.join(workdir, marker))
+            os.chdir(taskdir)
+            stdout, stderr = sys.stdout, sys.stderr
+            sys.stdout, sys.stderr = open('__stdout__', 'w'), open('__stderr__', 'w')
+            try:
+                with open('invocation.json', 'r') as invocation:
+                    argv = json.load(invocation)
+                if argv[0] == '--chain':
+                    run_chain(argv[1], functions)
+                else:
+                    cliargs = parse_cli(argv)
+                    monitor = StepMonitor()
+                    with monitor.phase('load function'):
+                        func = load_function(cliargs, functions)
+                    run_step(cliargs, func, monitor)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                sys.stdout.close()
+                sys.stderr.close()
+                sys.stdout, sys.stderr = stdout, stderr
+                os.chdir(workdir)
+            open(taskdir + '.done', 'w').close()
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--serve':
+        serve(os.path.abspath(sys.argv[2]))
+        return
+    elif len(sys.argv) == 3 and sys.argv[1] == '--chain':
+        run_chain(sys.argv[2])
+        return
+
+    cliargs = parse_cli()
+    monitor = StepMonitor()
+    with monitor.phase('load function'):
+        func = load_function(cliargs)
+    run_step(cliargs, func, monitor)
 
 
 if __name__ == '__main__':
@@ -12,7 +12,9 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
 import sys
+import tempfile
 
 # deals with issues around pathlib.Path.open
 if sys.version_info.major == 3:
@@ -24,3 +26,32 @@ else:
     RMODE = 'rb'
     WMODE = 'wb'
     strtypes = (unicode, str, basestring)
+
+
+def atomic_write(path, data):
+    """ Write ``data`` to a file through a temporary file in the same directory, so readers
+    never see a partly written file. Only for caches, so failures are reported, not raised.
+
+    Args:
+        path (str or pathlib.Path): file to write (its directory is created if necessary)
+        data (bytes or str): contents to write (strings are encoded as UTF-8)
+
+    Returns:
+        bool: whether the file was written
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    dirname = os.path.dirname(os.path.abspath(str(path)))
+    tmppath = None
+    try:
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        fd, tmppath = tempfile.mkstemp(prefix='.tmp-', dir=dirname)
+        with os.fdopen(fd, 'wb') as outfile:
+            outfile.write(data)
+        os.rename(tmppath, str(path))
+    except (IOError, OSError):
+        if tmppath is not None and os.path.exists(tmppath):
+            os.remove(tmppath)
+        return False
+    return True
@@ -13,37 +13,216 @@
 # limitations under the License.
 
 
+""" Versions of workflows, from the tags and branches of their git repositories.
+
+Reading a repository's tags and branches (and, with a detached HEAD, finding the branches that
+contain it) is the slow part of listing workflows. That information is cached in the workflow
+index (:mod:`molflow.discovery`), keyed on the modification times of the repository's
+``HEAD``, ``refs`` and ``packed-refs``, and :func:`discover_versions` reads the repositories
+it's missing in parallel. Whether the working tree is dirty can't be cached this way, so it is
+always checked, also in parallel.
+
+Running a specific version of a workflow doesn't check it out in the workflow's repository.
+Instead, its commit is extracted into a :class:`VersionCache` of read-only copies.
+"""
 from __future__ import print_function
 from future.builtins import *
 
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+from functools import cmp_to_key
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+
 from git import Repo, InvalidGitRepositoryError
 
 import semver
 
 from . import formatting
+from .discovery import file_mtime
 
+DISCOVERY_THREADS = 8
+
+
+def discover_versions(paths, index=None, threads=DISCOVERY_THREADS):
+    """ Get the versions of several workflows at once
+
+    Args:
+        paths (List[pathlib.Path]): the workflows' directories
+        index (molflow.discovery.WorkflowIndex): use and update the tags and branches cached
+           in this index
+        threads (int): maximum number of repositories to read at once
+
+    Returns:
+        List[WorkflowVersions]: versions of each workflow
+    """
+    def discover(path):
+        key = refs_key(path)
+        if key is None:
+            return None, None, WorkflowVersions(path, refs={})
+        refs = index.versions(path, key) if index is not None else None
+        cached = refs is not None
+        if not cached:
+            refs = read_refs(path)
+        versions = WorkflowVersions(path, refs=refs, dirty=is_dirty(path))
+        return key, (None if cached else refs), versions
+
+    if len(paths) > 1 and threads > 1:
+        pool = ThreadPool(min(threads, len(paths)))
+        try:
+            results = pool.map(discover, paths)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [discover(path) for path in paths]
+
+    for path, (key, refs, versions) in zip(paths, results):
+        if refs is not None and index is not None:
+            index.record_versions(path, key, refs)
+    return [versions for key, refs, versions in results]
 
-class WorkflowVersions(object):
-    def __init__(self, path):
-        self.git_dirty = False
-        self.git_version_tags = []
-        self.git_other_tags = []
-        self.git_branches = []
-        self.git_current_branch = None
-        self.git_current_state = False
-        self.git_repo = None
 
+def git_dir(path):
+    """ The git directory of a repository whose working tree is ``path``, or None if ``path`` is
+    not the root of a repository
+    """
+    dotgit = os.path.join(str(path), '.git')
+    if os.path.isdir(dotgit):
+        return dotgit
+    elif os.path.isfile(dotgit):  # worktrees and submodules: "gitdir: [path]"
+        with open(dotgit, 'r') as gitfile:
+            line = gitfile.readline().strip()
+        if line.startswith('gitdir:'):
+            return os.path.join(str(path), line[len('gitdir:'):].strip())
+    return None
+
+
+def refs_key(path):
+    """ Identifies the state of a repository's HEAD, branches and tags: the modification times
+    of ``HEAD``, ``packed-refs``, and everything under ``refs``. Git replaces these files
+    (rather than editing them) whenever a ref changes, so the key changes too.
+
+    Returns:
+        tuple: the key, or None if ``path`` is not the root of a git repository
+    """
+    gitdir = git_dir(path)
+    if gitdir is None:
+        return None
+    commondir = gitdir  # where worktrees share their refs with the main repository
+    if os.path.isfile(os.path.join(gitdir, 'commondir')):
+        with open(os.path.join(gitdir, 'commondir'), 'r') as commonfile:
+            commondir = os.path.join(gitdir, commonfile.read().strip())
+
+    key = [file_mtime(os.path.join(gitdir, 'HEAD')),
+           file_mtime(os.path.join(commondir, 'packed-refs'))]
+    for root, dirs, files in os.walk(os.path.join(commondir, 'refs')):
+        dirs.sort()
+        key.append((os.path.relpath(root, commondir), file_mtime(root)))
+        key.extend((name, file_mtime(os.path.join(root, name))) for name in sorted(files))
+    return tuple(key)
+
+
+def read_refs(path):
+    """ Read a repository's tags and branches, and the state of its HEAD
+
+    Returns:
+        dict: keyword arguments for :class:`WorkflowVersions`. Empty if ``path`` is not a git
+           repository.
+    """
+    try:
+        repo = Repo(str(path))
+    except InvalidGitRepositoryError:
+        return {}
+
+    version_tags = []
+    other_tags = []
+    for t in (i.name for i in repo.tags):
         try:
-            self.git_repo = Repo(str(path))
-        except InvalidGitRepositoryError:
-            self.git_repo = None
-            # No point in trying to figure out more versions if we have no git repo.
-            return
+            if t.startswith('v'):
+                version_tag = semver.parse(t[1:])
+            else:
+                version_tag = semver.parse(t)
+        except ValueError:
+            version_tag = None
+
+        if version_tag is not None:
+            version_tags.append( (t,version_tag) )
+        else:
+            other_tags.append( t )
+
+    # sort by the semver tag info (parsed versions are dicts, so compare the version strings)
+    version_tags.sort(key = cmp_to_key(lambda x, y: semver.compare(x[0].lstrip('v'),
+                                                                   y[0].lstrip('v'))))
+    other_tags.sort()
+
+    branches = [i.name for i in repo.branches]
+    try:
+        current_branch = repo.active_branch.name
+        current_state = 'branch'
+    except TypeError:
+        # happens when HEAD is in a detached state
+        current_branch = [b.name for b in repo.branches if repo.is_ancestor( repo.commit(), b.commit)]
+        current_state = 'detached'
 
-        self._discover_tags()
-        self._discover_branches()
-        self._check_current_state()
+    try:
+        head_commit = str(repo.commit())
+    except ValueError:  # no commits yet
+        head_commit = None
 
+    return {'version_tags': version_tags,
+            'other_tags': other_tags,
+            'branches': branches,
+            'current_branch': current_branch,
+            'current_state': current_state,
+            'head_commit': head_commit}
+
+
+def is_dirty(path):
+    try:
+        return Repo(str(path)).is_dirty()
+    except InvalidGitRepositoryError:
+        return False
+
+
+class WorkflowVersions(object):
+    """ Versions of a workflow
+
+    Args:
+        path (pathlib.Path): the workflow's directory
+        refs (dict): its repository's tags and branches (from :func:`read_refs`; read from the
+           repository if not passed)
+        dirty (bool): whether the repository has uncommitted changes (checked if not passed)
+    """
+    def __init__(self, path, refs=None, dirty=None):
+        self.path = path
+        self._git_repo = None
+        if refs is None:
+            refs = read_refs(path)
+
+        self.is_git = bool(refs)
+        self.git_version_tags = list(refs.get('version_tags', []))
+        self.git_other_tags = list(refs.get('other_tags', []))
+        self.git_branches = list(refs.get('branches', []))
+        self.git_current_branch = refs.get('current_branch', None)
+        self.git_current_state = refs.get('current_state', False)
+        self.git_head_commit = refs.get('head_commit', None)
+        if not self.is_git:
+            self.git_dirty = False
+        elif dirty is None:
+            self.git_dirty = is_dirty(path)
+        else:
+            self.git_dirty = dirty
+
+    @property
+    def git_repo(self):
+        """ The workflow's git repository, or None if it is not versioned with git """
+        if self._git_repo is None and self.is_git:
+            self._git_repo = Repo(str(self.path))
+        return self._git_repo
 
     def default_version( self ):
         # returns the version string and version type for the default version
@@ -54,12 +233,12 @@ class WorkflowVersions(object):
         # git:current-branch-head
         # git:other-tags-single
         # git:current-state
-        if self.git_repo is None:
+        if not self.is_git:
             return ("Unversioned","non-git")
         if self.git_dirty and self.git_current_state == 'branch':
             return ("{}+dirty".format(self.git_current_branch),"git:dirty")
         elif self.git_dirty and self.git_current_state == 'detached':
-            return ("{}+dirty".format(str(self.git_repo.commit())),"git:dirty")
+            return ("{}+dirty".format(self.git_head_commit),"git:dirty")
         elif self.git_dirty:  # not sure how this would happen, but for
                               # completeness going to include it.
             return ("dirty","git:dirty")
@@ -73,53 +252,53 @@ class WorkflowVersions(object):
         if len(self.git_other_tags) == 1:
             return (self.git_other_tags[0], "git:other-tags-single")
         
-        return (str(self.git_repo.commit()), "git:current-state")
+        return (self.git_head_commit, "git:current-state")
+
+    def version_commit( self, version_name ):
+        """ The commit of a version (a tag or branch name) of the workflow
 
-    def select_version( self, version_name ):
-        if self.git_repo is None:
+        Returns:
+            str: the commit's hash, or None if the version is the repository's current state
+               (e.g. the checked out branch, or a dirty working tree), which can be used in place
+        """
+        if not self.is_git:
             formatting.fail("Can not select a version for a workflow that is not git versioned.")
         if self.git_dirty and version_name != self.default_version()[0]:
             formatting.fail("Can not select a version for a workflow that has a dirty git directory, unless it's the current state.")
         elif self.git_dirty:
-            return
+            return None
 
-            
-        # Would like to figure out a better way to do this; we've guaranteed
-        # that it's not a dirty git repo (in which this would be destructive),
-        # but it does leave the head in a weird state. We could use a specific
-        # branch name and remove it / recreate as needed, but that might have
-        # some issues. See
-        # e.g. http://gitpython.readthedocs.io/en/stable/tutorial.html#switching-branches
-        
-        all_tag_names = list(next(zip(*self.git_version_tags))) + self.git_other_tags
-                        # This zip is the first item of each tag entry in git_version_tags, as a list and the concatenated with the other tags list.
+        commit = None
+        all_tag_names = [name for name, version in self.git_version_tags] + self.git_other_tags
         if version_name in all_tag_names:
             for tag in self.git_repo.tags:
                 if tag.name == version_name:
-                    self.git_repo.head.reference = tag.commit
-                    self.git_repo.head.reset(index=True,working_tree=True)
-                    return
+                    commit = tag.commit.hexsha
 
-        if version_name in self.git_branches:
+        if commit is None and version_name in self.git_branches:
             for branch in self.git_repo.branches:
                 if version_name == branch.name:
-                    branch.checkout()
-                    return
-            
-        formatting.fail("Could not select version [{version}]: it did not match any tag or branch name in the git repository for this workflow.".format( version=version_name))
+                    commit = branch.commit.hexsha
 
-    def select_default_version( self ):
+        if commit is None:
+            formatting.fail("Could not select version [{version}]: it did not match any tag or branch name in the git repository for this workflow.".format( version=version_name))
+        if commit == self.git_head_commit:
+            return None
+        return commit
+
+    def default_version_commit( self ):
+        """ The commit of the workflow's default version (see :meth:`version_commit`) """
         dv = self.default_version()
         if dv[1] in ['git:current-state','git:dirty','non-git']:
             # we should not attempt to select any of these conditions, as they are 'fragile'
-            return 
+            return None
         if dv[1] == 'git:current-branch-head':
             # We don't need to switch anything around if the active branch is the correct default.
-            return 
+            return None
 
         # what we have as the default is either a version tag or a 'other' tag that is the only other tag.
-        self.select_version( dv[0] )
-        
+        return self.version_commit( dv[0] )
+
     def format_versions( self, offset = 0):
         from termcolor import colored
         from textwrap import wrap
@@ -166,35 +345,63 @@ class WorkflowVersions(object):
 
         return result
 
-    def _discover_tags( self ):
-        tags = [i.name for i in self.git_repo.tags]
-        for t in tags:
+
+class VersionCache(object):
+    """ Read-only copies of workflows at specific commits, extracted with ``git archive``
+
+    Each commit is extracted once, into ``[path]/[commit hash]``, and never modified afterwards,
+    so any number of runs can use the same or different versions of a workflow at once
+    without touching its repository's working tree.
+
+    Args:
+        path (str): cache directory
+    """
+    def __init__(self, path):
+        self.path = Path(os.path.expanduser(str(path)))
+
+    def get(self, repo, commit):
+        """ The directory containing a repository's files at a commit, extracting them first if
+        they aren't cached yet
+
+        Args:
+            repo (git.Repo): the repository
+            commit (str): the commit's full hash
+        """
+        target = self.path / commit
+        if target.exists():
+            return target
+        if not self.path.exists():
             try:
-                if t.startswith('v'):
-                    version_tag = semver.parse(t[1:])
-                else:
-                    version_tag = semver.parse(t)
-            except ValueError:
-                version_tag = None
-
-            if version_tag is not None:
-                self.git_version_tags.append( (t,version_tag) )
-            else:
-                self.git_other_tags.append( t )
-        
-        self.git_version_tags.sort(key = lambda x: x[1])  # sort by the semver tag info
-        self.git_other_tags.sort()
+                self.path.mkdir(parents=True)
+            except OSError:  # created by a concurrent run
+                pass
 
-    def _discover_branches( self ):
-        self.git_branches = [i.name for i in self.git_repo.branches]
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-%s-' % commit[:12], dir=str(self.path))
         try:
-            self.git_current_branch = self.git_repo.active_branch.name
-            self.git_current_state = 'branch'
-        except TypeError:
-            # happens when HEAD is in a detached state
-            self.git_current_branch = [b.name for b in self.git_repo.branches if self.git_repo.is_ancestor( self.git_repo.commit(), b.commit)]
-            self.git_current_state = 'detached'
+            with tempfile.TemporaryFile() as archive:
+                repo.archive(archive, treeish=commit, format='tar')
+                archive.seek(0)
+                with tarfile.open(fileobj=archive) as tar:
+                    tar.extractall(tmpdir)
+            _make_read_only(tmpdir)
+            try:
+                os.rename(tmpdir, str(target))
+            except OSError:
+                if not target.exists():
+                    raise
+                # otherwise, a concurrent run extracted the same commit first
+        finally:
+            if os.path.exists(tmpdir):
+                shutil.rmtree(tmpdir)
+        return target
 
-    def _check_current_state( self ):
-        self.git_dirty = self.git_repo.is_dirty()
 
+def _make_read_only(path):
+    """ Remove write permissions from the files (but not the directories, so the cache can
+    still be cleaned up) in a directory tree """
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            filepath = os.path.join(root, name)
+            if not os.path.islink(filepath):
+                mode = os.stat(filepath).st_mode
+                os.chmod(filepath, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
@@ -0,0 +1,51 @@
+import pytest
+
+from molflow import definitions as df
+
+from .helpers import new_workflow
+
+
+@pytest.fixture(autouse=True)
+def protocol_cache(tmpdir, monkeypatch):
+    """ Keep the pickle protocol probes of the tests' engines out of ~/.molflow """
+    from molflow.runners import localstep
+    cache = localstep.ProtocolCache(str(tmpdir / 'protocols.json'))
+    monkeypatch.setattr(localstep, 'PROTOCOL_CACHE', cache)
+    return cache
+
+
+@pytest.fixture
+def add():
+    """ ``add(a, b)`` from test/test_workflow/functions.py """
+    return df.Function('add', sourcefile='functions.py', num_args=2, num_returnvals=1)
+
+
+@pytest.fixture
+def chain_workflow(add):
+    """ ``out = add(add(add(add(add(a, a), a), a), a), a)`` """
+    wf, a = new_workflow('chain', 'a')
+    result = a
+    for i in range(5):
+        result = df.Step(add, (result, a), {}, execount=i+1).get_result(0)
+    wf.set_output(result, 'out')
+    return wf
+
+
+@pytest.fixture
+def float_workflow(add):
+    """ ``result = cast_to_float(add(a, a))`` """
+    wf, a = new_workflow('float', 'a')
+    to_float = df.Function('cast_to_float', sourcefile='functions.py',
+                           num_args=1, num_returnvals=1)
+    doubled = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(to_float, (doubled,), {}, execount=1).get_result(0), 'result')
+    return wf
+
+
+@pytest.fixture
+def twice_workflow(add):
+    """ ``result = add(add(a, a), a)`` """
+    wf, a = new_workflow('twice', 'a')
+    doubled = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(add, (doubled, a), {}, execount=2).get_result(0), 'result')
+    return wf
@@ -1,4 +1,5 @@
 import sys
+import threading
 from pathlib import Path
 import molflow
 
@@ -8,6 +9,73 @@ testpath = Path(__file__).parents[0]
 pdbfile_path = testpath / 'data' / '3AID.pdb'
 twofile_path = testpath / 'data' / 'two.txt'
 
+
+def new_workflow(name, *inputs):
+    """ An empty workflow, defined in test/test_workflow, with the named inputs
+
+    Returns:
+        tuple: the workflow, followed by its inputs
+    """
+    from molflow import definitions as df
+    wf = df.WorkflowDefinition(name)
+    wf.definition_path = testpath / 'test_workflow'
+    return (wf,) + tuple(wf.add_input(inputname) for inputname in inputs)
+
+
+class FakeEngine(object):
+    def __init__(self, blocking=True):
+        self.blocking = blocking
+
+    def wait(self, job):
+        if not self.blocking:
+            raise NotImplementedError()
+        job.done.wait()
+
+
+class FakeJob(object):
+    """ Stands in for a pyccc job; finishes ``duration`` seconds after it's created
+    """
+    def __init__(self, step, engine, duration):
+        self.name = step._label()
+        self.engine = engine
+        self.image = None
+        self.jobid = id(self)
+        self.stdout = self.stderr = ''
+        self.done = threading.Event()
+        self._timer = threading.Timer(duration, self.done.set)
+        self._timer.start()
+
+    @property
+    def status(self):
+        return 'finished' if self.done.is_set() else 'running'
+
+    def get_output(self, filename=None):
+        from pyccc.files import StringContainer
+        outputs = {'return.0.pkl': StringContainer(self.name.encode('utf-8'))}
+        if filename:
+            return outputs[filename]
+        return outputs
+
+    def kill(self):
+        self._timer.cancel()
+
+
+def patch_jobs(monkeypatch, engine, duration):
+    """ Have the runner launch :class:`FakeJob`s instead of running steps
+
+    Returns:
+        list: the steps launched (in order)
+    """
+    from molflow.runners import localrunner
+    launched = []
+
+    def make_job(step, defdir, inputs, submit=False, engine=None, protocol=None, formats=None):
+        launched.append(step)
+        return FakeJob(step, engine, duration)
+
+    monkeypatch.setattr(localrunner, 'make_job', make_job)
+    return launched
+
 if sys.version_info.major == 3:
     from contextlib import redirect_stdout
 
@@ -0,0 +1,98 @@
+import os
+from pathlib import Path
+
+from molflow import definitions as df
+from molflow.runners import localrunner
+from molflow.runners.cache import StepCache
+
+from .helpers import FakeEngine, patch_jobs
+
+
+def test_cached_steps_are_not_relaunched(chain_workflow, monkeypatch, tmpdir):
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    cachedir = str(tmpdir)
+
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     cache=StepCache(cachedir))
+    runner.run()
+    assert len(launched) == 5
+
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     cache=StepCache(cachedir))
+    runner.run()
+    assert len(launched) == 5
+    assert set(runner.output_files) == {'out'}
+
+    # different inputs or --refresh mean the steps need to run again
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'2'}, polltime=1.0,
+                                     cache=StepCache(cachedir))
+    runner.run()
+    assert len(launched) == 10
+
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     cache=StepCache(cachedir, refresh=True))
+    runner.run()
+    assert len(launched) == 15
+
+
+def test_cache_evicts_least_recently_used(tmpdir):
+    cache = StepCache(str(tmpdir), maxbytes=150)
+    for i, key in enumerate(['aa01', 'aa02', 'aa03']):
+        entry = cache._entry_path(key)
+        entry.mkdir(parents=True)
+        with (entry / 'return.0.pkl').open('wb') as outfile:
+            outfile.write(b'x' * 60)
+        os.utime(str(entry), (i, i))
+
+    cache.evict()
+    assert not cache._entry_path('aa01').exists()
+    assert cache._entry_path('aa02').exists()
+    assert cache._entry_path('aa03').exists()
+
+
+class _ReturnFiles(object):
+    """ Finished job stand-in whose outputs are the files in a directory """
+    def __init__(self, path):
+        self.path = path
+
+    def get_output(self):
+        from pyccc.files import LocalFile
+        return {f.name: LocalFile(str(f)) for f in self.path.iterdir()}
+
+
+def _write_returns(path, contents):
+    path.mkdir(parents=True)
+    with (path / 'return.0.pkl').open('wb') as outfile:
+        outfile.write(contents)
+    return _ReturnFiles(path)
+
+
+def test_cache_refresh_replaces_stale_entries(add, tmpdir):
+    tmpdir = Path(str(tmpdir))
+    step = df.Step(add, (), {}, 1)
+    StepCache(str(tmpdir / 'cache')).store('aa01', _write_returns(tmpdir / 'old', b'old'))
+    StepCache(str(tmpdir / 'cache')).store('aa01', _write_returns(tmpdir / 'kept', b'kept'))
+
+    cache = StepCache(str(tmpdir / 'cache'))
+    with cache.lookup('aa01', step).get_output('return.0.pkl').open('rb') as infile:
+        assert infile.read() == b'old'
+
+    StepCache(str(tmpdir / 'cache'), refresh=True).store(
+        'aa01', _write_returns(tmpdir / 'new', b'new'))
+    with cache.lookup('aa01', step).get_output('return.0.pkl').open('rb') as infile:
+        assert infile.read() == b'new'
+    assert [p.name for p in cache._entry_path('aa01').parent.iterdir()] == ['aa01']
+
+
+def test_cache_only_rescans_when_over_its_limit(tmpdir, monkeypatch):
+    tmpdir = Path(str(tmpdir))
+    cache = StepCache(str(tmpdir / 'cache'), maxbytes=150)
+    scans = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: scans.append(1) or evict())
+
+    for i in range(4):
+        cache.store('aa0%d' % i, _write_returns(tmpdir / str(i), b'x' * 60))
+    assert len(scans) == 3  # the first store, then each store past the limit
+    assert cache._total == 120
+    assert len(list(cache.path.glob('*/*'))) == 2
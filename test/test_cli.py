@@ -61,3 +61,18 @@ def _assert_result(path, val):
     with (path/'result.pkl').open('rb') as infile:
         assert pickle.load(infile) == val
 
+
+def test_parsing_the_command_line_defers_imports():
+    import sys
+    code = ('import sys, molflow.__main__ as cli; cli.parser(); '
+            'print(" ".join(m for m in ("git", "yaml", "pyccc", "molflow.config") '
+            'if m in sys.modules))')
+    imported = subprocess.check_output([sys.executable, '-c', code],
+                                       cwd=str(module_path.parent))
+    assert imported.strip() == b''
+
+
+def test_cli_engine_names_match_engines():
+    from molflow.__main__ import ENGINE_NAMES
+    from molflow.runners.localstep import ENGINES
+    assert ENGINE_NAMES == sorted(ENGINES)
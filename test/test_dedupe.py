@@ -0,0 +1,42 @@
+from molflow import definitions as df
+from molflow.runners import localrunner
+
+from .helpers import FakeEngine, new_workflow, patch_jobs
+
+
+def test_duplicate_steps_are_merged(add, monkeypatch):
+    wf, b, c = new_workflow('duplicates', 'b', 'c')
+    to_float = df.Function('cast_to_float', sourcefile='functions.py', num_args=1,
+                           num_returnvals=1)
+    for i in range(2):  # to_float(add(b, b)), twice
+        doubled = df.Step(add, (b, b), {}, execount=i+1).get_result(0)
+        wf.set_output(df.Step(to_float, (doubled,), {}, execount=i+1).get_result(0),
+                      'out%d' % i)
+    different = df.Step(add, (b, c), {}, execount=3).get_result(0)
+    wf.set_output(different, 'different')
+
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    runner = localrunner.LocalRunner(wf, {'b': b'', 'c': b''}, polltime=1.0)
+    assert runner.num_deduplicated == 2
+    runner.run()
+    assert sorted(step._label() for step in launched) == ['add.1', 'add.3', 'cast_to_float.1']
+    assert set(runner.output_files) == {'out0', 'out1', 'different'}
+
+    runner = localrunner.LocalRunner(wf, {'b': b'', 'c': b''}, polltime=1.0,
+                                     deduplicate=False)
+    assert runner.num_deduplicated == 0 and runner.workflow is wf
+
+
+def test_steps_with_different_output_formats_are_not_merged():
+    from molflow.runners.dedupe import deduplicate_steps
+
+    wf, b = new_workflow('formats', 'b')
+    for i, fmt in enumerate([None, 'txt', 'txt']):
+        fn = df.Function('add', sourcefile='functions.py', num_args=2, num_returnvals=1,
+                         output_formats=fmt)
+        wf.set_output(df.Step(fn, (b, b), {}, execount=i+1).get_result(0), 'out%d' % i)
+
+    deduped, num_merged = deduplicate_steps(wf)
+    assert num_merged == 1
+    assert deduped.outputs['out1'].source.step is deduped.outputs['out2'].source.step
+    assert deduped.outputs['out0'].source.step is not deduped.outputs['out1'].source.step
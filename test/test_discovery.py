@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+
+from molflow.discovery import WorkflowIndex, find_workflows
+
+
+def _make_workflow(path, metadata=u'description: a workflow\n'):
+    path.mkdir()
+    (path / 'workflow.py').write_text(u'# workflow\n')
+    (path / 'metadata.yml').write_text(metadata)
+    return path
+
+
+def _touch_later(path):
+    """ Make sure a change is visible to mtime checks, even on coarse filesystem clocks """
+    stat = os.stat(str(path))
+    os.utime(str(path), (stat.st_atime + 5, stat.st_mtime + 5))
+
+
+def _searchpath(tmpdir):
+    searchpath = Path(str(tmpdir)) / 'workflows'
+    searchpath.mkdir()
+    _make_workflow(searchpath / 'first')
+    _make_workflow(searchpath / 'second')
+    (searchpath / 'not_a_workflow').mkdir()
+    (searchpath / 'README').write_text(u'')
+    return searchpath
+
+
+def test_index_finds_the_same_workflows(tmpdir):
+    searchpath = _searchpath(tmpdir)
+    index = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    expected = find_workflows(searchpath)
+    assert [p.name for p in expected] == ['first', 'second']
+    assert index.find_workflows(searchpath) == expected
+
+
+def test_warm_index_is_reused(tmpdir):
+    searchpath = _searchpath(tmpdir)
+    index = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    index.find_workflows(searchpath)
+    assert index.metadata(searchpath / 'first') == {'description': 'a workflow'}
+    index.record_interface(searchpath / 'first', [{'a': '(int)'}], [{'b': ''}])
+    index.save()
+
+    warm = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    assert [p.name for p in warm.find_workflows(searchpath)] == ['first', 'second']
+    assert warm.metadata(searchpath / 'first') == {'description': 'a workflow'}
+    assert warm.interface(searchpath / 'first') == ([{'a': '(int)'}], [{'b': ''}])
+    assert not warm._changed  # nothing needed to be re-read
+
+
+def test_index_sees_new_workflows(tmpdir):
+    searchpath = _searchpath(tmpdir)
+    index = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    index.find_workflows(searchpath)
+
+    _make_workflow(searchpath / 'third')
+    _touch_later(searchpath)
+    assert [p.name for p in index.find_workflows(searchpath)] == ['first', 'second', 'third']
+
+    # a directory that becomes a workflow
+    (searchpath / 'not_a_workflow' / 'workflow.py').write_text(u'')
+    (searchpath / 'not_a_workflow' / 'metadata.yml').write_text(u'')
+    _touch_later(searchpath / 'not_a_workflow')
+    assert 'not_a_workflow' in [p.name for p in index.find_workflows(searchpath)]
+
+
+def test_index_rereads_changed_files(tmpdir):
+    searchpath = _searchpath(tmpdir)
+    index = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    workflowdir = searchpath / 'first'
+    index.metadata(workflowdir)
+    index.record_interface(workflowdir, [], [])
+
+    (workflowdir / 'metadata.yml').write_text(u'description: changed\n')
+    _touch_later(workflowdir / 'metadata.yml')
+    assert index.metadata(workflowdir) == {'description': 'changed'}
+
+    _touch_later(workflowdir / 'workflow.py')
+    assert index.interface(workflowdir) is None
+
+
+def test_unreadable_index_is_discarded(tmpdir):
+    searchpath = _searchpath(tmpdir)
+    (tmpdir / 'index.pkl').write('not a pickle')
+    index = WorkflowIndex(str(tmpdir / 'index.pkl'))
+    assert [p.name for p in index.find_workflows(searchpath)] == ['first', 'second']
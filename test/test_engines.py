@@ -0,0 +1,212 @@
+import os
+import pickle
+from pathlib import Path
+
+import pytest
+
+from molflow import definitions as df
+from molflow.runners import localrunner
+from molflow.runners.cache import StepCache
+
+from .helpers import new_workflow, testpath
+
+
+def test_protocol_probes_are_saved_for_later_runs(tmpdir, protocol_cache):
+    from molflow.runners import localstep
+
+    probes = []
+    def run_probe():
+        probes.append(1)
+        return '4\n'
+
+    def broken_probe():
+        raise OSError('no such image')
+
+    path = str(tmpdir / 'probes.json')
+    assert localstep.ProtocolCache(path).probe('docker:sha256:abc:python', run_probe) == 4
+    assert localstep.ProtocolCache(path).probe('docker:sha256:abc:python', run_probe) == 4
+    assert localstep.ProtocolCache(path).probe('docker:img:python', run_probe,
+                                               persist=False) == 4
+    assert len(probes) == 2
+    assert localstep.ProtocolCache(path).probe('docker:sha256:def:python', broken_probe) == \
+        localstep.PICKLE_PROTOCOL
+    assert list(localstep.ProtocolCache(path)._load()) == ['docker:sha256:abc:python']
+
+    engine = localstep.SubprocessEngine()
+    assert engine.pickle_protocol('python:3.6-slim') == pickle.HIGHEST_PROTOCOL
+    assert len(protocol_cache._load()) == 1
+
+    # a later run reads the saved result, without probing or rewriting the file
+    mtime = os.stat(path).st_mtime - 100
+    os.utime(path, (mtime, mtime))
+    assert localstep.ProtocolCache(path).probe('docker:sha256:abc:python', broken_probe) == 4
+    assert os.stat(path).st_mtime == mtime
+
+
+def test_subprocess_engine_runs_steps_without_docker(float_workflow):
+    from molflow.runners.localstep import SubprocessEngine
+
+    runner = localrunner.LocalRunner(float_workflow, {'a': pickle.dumps(21)}, polltime=1.0,
+                                     engine=SubprocessEngine())
+    runner.run()
+    result = pickle.loads(runner.output_files['result'].read('rb'))
+    assert result == 42.0 and type(result) is float
+
+
+def test_subprocess_engine_runs_functions_without_docker_images(tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+
+    (tmpdir / 'functions.py').write("def add(a, b):\n    return a+b\n")
+    wf = df.WorkflowDefinition('noimage')
+    wf.definition_path = Path(str(tmpdir))
+    a = wf.add_input('a')
+    add = df.Function('add', sourcefile='functions.py', num_args=2, num_returnvals=1)
+    negate = df.Function('neg', python_module='operator', num_args=1, num_returnvals=1)
+    doubled = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(negate, (doubled,), {}, execount=1).get_result(0), 'result')
+
+    cache = StepCache(str(tmpdir / 'cache'))
+    for fuse in (False, True):
+        runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(21)}, polltime=1.0,
+                                         engine=SubprocessEngine(), cache=cache, fuse=fuse)
+        runner.run()
+        assert pickle.loads(runner.output_files['result'].read('rb')) == -42
+    assert len(list(cache.path.glob('*/*'))) == 3  # two steps, then the fused chain
+
+
+def test_step_outputs_use_highest_common_protocol(twice_workflow):
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.static.runstep import PICKLE_PROTOCOL
+
+    wf = twice_workflow
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(2)}, polltime=1.0,
+                                     engine=SubprocessEngine())
+    runner.run()
+    assert pickle.loads(runner.output_files['result'].read('rb')) == 6
+    for job in runner.finished.values():
+        assert '--protocol %d' % pickle.HIGHEST_PROTOCOL in job.command
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(2)})
+    assert runner._output_protocol(wf.steps()[0]) == PICKLE_PROTOCOL
+
+
+def test_steps_pass_text_without_pickling(tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+
+    wf, a = new_workflow('formats', 'a')
+    concat = df.Function('add', sourcefile='functions.py', num_args=2, num_returnvals=1,
+                         output_formats='txt')
+    double = df.Step(concat, (a, a), {}, execount=1)
+    wf.set_output(df.Step(concat, (double.get_result(0), a), {}, execount=2).get_result(0),
+                  'result')
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(u'ab')}, polltime=1.0,
+                                     engine=SubprocessEngine())
+    runner.run()
+    assert 'return.0.txt' in runner.finished[double].get_output()
+    assert 'arg0.txt' in runner.finished[wf.outputs['result'].source.step].command
+    assert runner.output_formats['result'] == 'txt'
+    assert runner.output_files['result'].read('rb') == b'ababab'
+
+
+def test_pool_engine_passes_values_in_memory(add):
+    from molflow.runners.pool import PoolEngine, ValueContainer
+
+    wf, a = new_workflow('pool', 'a')
+    divide = df.Function('divide', sourcefile='functions.py', num_args=2, num_returnvals=1)
+    doubled = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(divide, (doubled, a), {}, execount=1).get_result(0), 'result')
+
+    engine = PoolEngine(maxworkers=2)
+    try:
+        runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(4)}, polltime=1.0,
+                                         engine=engine)
+        runner.run()
+        output = runner.output_files['result']
+        assert isinstance(output, ValueContainer)
+        assert output.value == 2.0
+        assert pickle.loads(output.read('rb')) == 2.0
+
+        # errors inside the function are reported as step failures
+        runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(0)}, polltime=1.0,
+                                         engine=engine)
+        with pytest.raises(localrunner.StepFailure):
+            runner.run()
+    finally:
+        engine.shutdown()
+
+
+def test_pool_engine_runs_functions_without_docker_images():
+    from molflow.runners.pool import PoolEngine
+
+    wf, a = new_workflow('noimage', 'a')
+    add = df.Function('add', python_module='operator', num_args=2, num_returnvals=1)
+    wf.set_output(df.Step(add, (a, a), {}, execount=1).get_result(0), 'result')
+
+    engine = PoolEngine(maxworkers=1)
+    try:
+        runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(4)}, polltime=1.0,
+                                         engine=engine)
+        runner.run()
+        assert runner.output_files['result'].value == 8
+    finally:
+        engine.shutdown()
+
+
+class FakeDockerClient(object):
+    """ Enough of docker's API client for the container pool; containers never run tasks """
+    def __init__(self):
+        self.running = set()
+        self._ids = iter(range(1000))
+
+    def create_host_config(self, binds):
+        return {}
+
+    def create_container(self, image, command, **kwargs):
+        return {'Id': 'container%012d' % next(self._ids)}
+
+    def start(self, containerid):
+        self.running.add(containerid)
+
+    def stop(self, containerid, timeout=None):
+        self.running.discard(containerid)
+
+    def remove_container(self, containerid, force=False):
+        self.running.discard(containerid)
+
+    def inspect_container(self, containerid):
+        return {'State': {'Running': containerid in self.running}}
+
+
+def test_container_pool_drops_stopped_workers(add, monkeypatch):
+    import pyccc
+    from molflow.runners.containerpool import ContainerPoolEngine
+
+    client = FakeDockerClient()
+    monkeypatch.setattr(pyccc.engines, 'Docker', lambda: type('Docker', (), {'client': client}))
+    defdir = testpath / 'test_workflow'
+    engine = ContainerPoolEngine(maxworkers=1)
+    try:
+        def submit(i):
+            job = engine.make_job(df.Step(add, (), {}, execount=i), defdir, [b'1', b'2'])
+            job.submit()
+            return job
+
+        first, second = submit(1), submit(2)
+        assert first.worker is second.worker
+        client.running.clear()  # the container dies
+
+        # its jobs fail right away, and new jobs go to a new container
+        third, fourth = submit(3), submit(4)
+        assert first.done and 'exited unexpectedly' in second.stderr
+        assert third.worker is not first.worker
+        assert engine.workers[third.image] == [third.worker]
+
+        # killing a job stops its container, and says so in the other jobs' errors
+        third.kill()
+        assert 'Killed' in third.stderr
+        assert 'stopped to kill step "add.3"' in fourth.stderr
+        assert engine.workers[third.image] == []
+    finally:
+        engine.shutdown()
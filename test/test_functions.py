@@ -0,0 +1,105 @@
+import pytest
+
+from molflow import definitions as df
+from molflow.definitions import functions
+
+
+@pytest.fixture
+def workflow():
+    wf = df.WorkflowDefinition('arity')
+    return wf, wf.add_input('a')
+
+
+def test_return_values_are_inferred_from_unpacking(workflow):
+    wf, a = workflow
+    split = df.Function('split', python_module='mod')
+    single = df.Function('single', python_module='mod')
+    for i in range(3):  # the same call site, repeatedly
+        first, second, third = split(a)
+    result = single(first)
+
+    assert split.num_returnvals == 3
+    assert single.num_returnvals == 1
+    assert isinstance(result, df.StepResult)
+    assert (first.position, third.position) == (0, 2)
+
+
+def test_return_values_are_inferred_for_many_call_sites(workflow):
+    import time
+    wf, a = workflow
+    numcalls = 3000
+    lines = ['fn%d = df.Function("fn%d", python_module="mod")' % (i, i)
+             for i in range(numcalls)]
+    lines.extend(('x%d, y%d = fn%d(a)' if i % 2 else 'x%d = fn%d(a)') % ((i,) * (2 + i % 2))
+                 for i in range(numcalls))
+    namespace = {'df': df, 'a': a}
+    start = time.time()
+    exec(compile('\n'.join(lines), '<workflow>', 'exec'), namespace)
+    assert time.time() - start < 10  # each call mustn't disassemble the whole module again
+
+    assert namespace['fn0'].num_returnvals == 1
+    assert namespace['fn1'].num_returnvals == 2
+    assert namespace['fn%d' % (numcalls - 1)].num_returnvals == 2
+
+
+def test_call_site_memo_does_not_keep_code_alive(workflow):
+    import gc
+    wf, a = workflow
+    code = compile('x, y = fn(a)', '<workflow>', 'exec')
+    namespace = {'fn': df.Function('fn', python_module='mod'), 'a': a}
+    exec(code, namespace)
+    assert code in functions._CALL_SITES
+    df.Function('other', python_module='mod')(a)  # replaces the cached disassembly
+
+    del code
+    gc.collect()
+    assert not any(c.co_filename == '<workflow>' for c in functions._CALL_SITES.keys())
+
+
+def test_declared_return_values_skip_inspection(workflow, monkeypatch):
+    wf, a = workflow
+    monkeypatch.setattr(functions, '_expecting_args', lambda: pytest.fail('inspected caller'))
+    split = df.Function('split', python_module='mod', num_returnvals=2)
+    results = split(a)
+    assert len(results) == 2
+
+
+def test_call_with_explicit_return_values(workflow):
+    wf, a = workflow
+    split = df.Function('split', python_module='mod')
+    first, second = split.call(a, nout=2)
+    assert split.num_returnvals == 2
+    assert first.step is second.step
+    assert len(split.call(a)) == 2
+
+    with pytest.raises(ValueError):
+        split.call(a, nout=3)
+    with pytest.raises(ValueError):
+        split.call(a, a, nout=2)
+
+
+def test_call_many(workflow):
+    wf, a = workflow
+    add = df.Function('add', python_module='mod')
+    results = add.call_many([(a, i) for i in range(1000)])
+    wf.set_output(add.call(*results[:2]), 'out')
+
+    assert len(results) == 1000
+    assert add.num_args == 2
+    assert add.num_returnvals == 1
+    assert [r.step.fnexecount for r in results[:3]] == [1, 2, 3]
+    assert wf.num_steps == 3
+
+    with pytest.raises(ValueError):
+        add.call_many([(a,)])
+
+
+def test_output_formats():
+    fn = df.Function('split', python_module='mod', num_returnvals=3,
+                     output_formats=['txt', None, 'npy'])
+    assert [fn.output_format(i) for i in range(3)] == ['txt', None, 'npy']
+    assert fn.format_options() == ['--format', '0:txt', '--format', '2:npy']
+    assert df.Function('f', python_module='mod', output_formats='bin').output_format(5) == 'bin'
+
+    with pytest.raises(ValueError):
+        df.Function('f', python_module='mod', output_formats='csv')
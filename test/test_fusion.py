@@ -0,0 +1,66 @@
+import pickle
+from pathlib import Path
+
+from molflow import definitions as df
+from molflow.runners import localrunner
+
+from .helpers import new_workflow
+
+
+def test_fuse_steps_finds_single_consumer_chains(add):
+    from molflow.runners.fusion import FusedStep, fuse_steps
+
+    wf, a = new_workflow('fusable', 'a')
+    first = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    second = df.Step(add, (first, a), {}, execount=2).get_result(0)
+    left = df.Step(add, (second, a), {}, execount=3).get_result(0)  # second has 2 consumers
+    right = df.Step(add, (second, second), {}, execount=4).get_result(0)
+    last = df.Step(add, (right, a), {}, execount=5).get_result(0)
+    wf.set_output(left, 'left')
+    wf.set_output(last, 'last')
+
+    dag = fuse_steps(wf.graph, wf)
+    labels = {unit._label(): unit for unit in dag}
+    assert set(labels) == {'add.1+add.2', 'add.3', 'add.4+add.5'}
+    assert isinstance(labels['add.4+add.5'], FusedStep)
+    assert dag[labels['add.4+add.5']] == {labels['add.1+add.2'], a}
+    assert labels['add.4+add.5'].links[1][1] == [('link', 0, 0), ('arg', 1)]
+
+
+def test_fused_chain_runs_as_one_job(chain_workflow, tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+
+    runner = localrunner.LocalRunner(chain_workflow, {'a': pickle.dumps(1)}, polltime=1.0,
+                                     datadir=str(tmpdir), engine=SubprocessEngine(),
+                                     fuse=True)
+    runner.run()
+    assert pickle.loads(runner.output_files['out'].read('rb')) == 6
+    assert len(runner.finished) == 2  # the fused step, plus an alias for its last step
+
+    # with a data directory (i.e., --saveall), intermediate results are written out too
+    stepdir = tmpdir / 'add.1+add.2+add.3+add.4+add.5'
+    with (stepdir / 'add.2' / 'return.0.pkl').open('rb') as pklfile:
+        assert pickle.load(pklfile) == 3
+
+
+def test_fused_chain_stages_source_files_with_the_same_name(tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+
+    (tmpdir / 'lib').mkdir()
+    (tmpdir / 'functions.py').write("__DOCKER_IMAGE__ = 'python:3.6-slim'\n"
+                                    "def add(a, b):\n    return a+b\n")
+    (tmpdir / 'lib' / 'functions.py').write("__DOCKER_IMAGE__ = 'python:3.6-slim'\n"
+                                            "def scale(a):\n    return 10*a\n")
+    wf = df.WorkflowDefinition('samenames')
+    wf.definition_path = Path(str(tmpdir))
+    a = wf.add_input('a')
+    add = df.Function('add', sourcefile='functions.py', num_args=2, num_returnvals=1)
+    scale = df.Function('scale', sourcefile='lib/functions.py', num_args=1,
+                        num_returnvals=1)
+    doubled = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(scale, (doubled,), {}, execount=1).get_result(0), 'out')
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(2)}, polltime=1.0,
+                                     engine=SubprocessEngine(), fuse=True)
+    runner.run()
+    assert pickle.loads(runner.output_files['out'].read('rb')) == 40
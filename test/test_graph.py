@@ -0,0 +1,59 @@
+import sys
+
+from molflow import definitions as df
+from molflow.runners.dedupe import deduplicate_steps
+
+
+def _diamond():
+    wf = df.WorkflowDefinition('diamond')
+    a = wf.add_input('a')
+    fn = df.Function('fn', python_module='mod', num_returnvals=1)
+    join = df.Function('join', python_module='mod', num_returnvals=1)
+    top = fn.call(a)
+    left, right = fn.call(top), join.call(top, a)
+    bottom = join.call(left, right)
+    wf.set_output(bottom, 'out')
+    return wf, a, [r.step for r in (top, left, right, bottom)]
+
+
+def test_graph_order_and_adjacency():
+    wf, a, (top, left, right, bottom) = _diamond()
+    graph = wf.graph
+
+    assert len(graph) == wf.num_steps == 4
+    assert graph.steps[0] is top and graph.steps[-1] is bottom
+    assert set(graph.downstream(top)) == {left, right}
+    assert graph.upstream(bottom) == [left, right]
+    assert graph.num_upstream(top) == 0
+    assert graph.inputs(right) == [a]
+    assert wf._get_dag() == {top: {a}, left: {top}, right: {top, a}, bottom: {left, right}}
+
+
+def test_graph_is_cached_until_outputs_change():
+    wf, a, (top, left, right, bottom) = _diamond()
+    graph = wf.graph
+    assert wf.graph is graph
+    wf.set_output(df.Function('other', python_module='mod').call(a, nout=1), 'other')
+    assert wf.graph is not graph
+    assert wf.num_steps == 5
+
+
+def test_nodes_have_no_instance_dicts():
+    wf, a, steps = _diamond()
+    for obj in [steps[0], steps[0].get_result(0), a, wf.outputs['out']]:
+        assert not hasattr(obj, '__dict__')
+
+
+def test_deep_chains_do_not_recurse():
+    depth = 5 * sys.getrecursionlimit()
+    wf = df.WorkflowDefinition('deep')
+    fn = df.Function('fn', python_module='mod', num_returnvals=1)
+    result = wf.add_input('a')
+    for i in range(depth):
+        result = fn.call(result)
+    wf.set_output(result, 'out')
+
+    assert wf.num_steps == depth
+    assert wf.graph.steps[-1] is result.step
+    deduped, num_merged = deduplicate_steps(wf)
+    assert num_merged == 0
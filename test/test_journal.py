@@ -0,0 +1,52 @@
+from molflow.runners import localrunner
+from molflow.runners.cache import StepCache
+
+from .helpers import FakeEngine, patch_jobs
+
+
+def test_resume_skips_journaled_steps(chain_workflow, monkeypatch, tmpdir):
+    from molflow.runners.journal import RunJournal
+
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     journal=RunJournal(str(tmpdir)))
+    runner.run()
+    assert len(launched) == 5
+
+    # simulate a run that died after the first 3 steps
+    journal = RunJournal(str(tmpdir), resume=True)
+    for label in ('add.4', 'add.5'):
+        del journal.entries[label]
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     journal=journal)
+    runner.run()
+    assert [step._label() for step in launched[5:]] == ['add.4', 'add.5']
+
+    # changed inputs invalidate the journal
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'2'}, polltime=1.0,
+                                     journal=RunJournal(str(tmpdir), resume=True))
+    runner.run()
+    assert len(launched) == 12
+
+    # starting without --resume discards the journal
+    RunJournal(str(tmpdir))
+    assert not (tmpdir / '.molflow_journal').exists()
+
+
+def test_journal_refers_to_cached_results(chain_workflow, monkeypatch, tmpdir):
+    from molflow.runners.journal import RunJournal
+
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    cache = StepCache(str(tmpdir / 'cache'))
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0, cache=cache,
+                                     journal=RunJournal(str(tmpdir / 'out')))
+    runner.run()
+    assert not (tmpdir / 'out' / '.molflow_journal' / 'steps').exists()
+
+    # resuming uses the cache entries, but not the rest of the cache
+    journal = RunJournal(str(tmpdir / 'out'), resume=True)
+    assert all(entry['stored'] for entry in journal.entries.values())
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b'1'}, polltime=1.0,
+                                     journal=journal)
+    runner.run()
+    assert len(launched) == 5 and set(runner.output_files) == {'out'}
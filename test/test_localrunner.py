@@ -0,0 +1,116 @@
+import pickle
+import time
+
+import pytest
+
+from molflow import definitions as df
+from molflow.runners import localrunner
+
+from .helpers import FakeEngine, new_workflow, patch_jobs
+
+
+@pytest.mark.parametrize('blocking', [True, False])
+def test_runner_does_not_wait_for_poll_interval(chain_workflow, monkeypatch, blocking):
+    launched = patch_jobs(monkeypatch, FakeEngine(blocking=blocking), duration=0.05)
+    runner = localrunner.LocalRunner(chain_workflow, {'a': b''}, maxproc=1, polltime=1.0)
+
+    start = time.time()
+    runner.run()
+    elapsed = time.time() - start
+
+    assert len(launched) == 5
+    assert set(runner.output_files) == {'out'}
+    if blocking:  # waking on completion, rather than sleeping for 5 x 1s
+        assert elapsed < 2.0
+    else:  # adaptive backoff never reaches the full poll interval for these short steps
+        assert elapsed < 5.0
+
+
+def test_steps_launch_only_after_their_dependencies(add, monkeypatch):
+    wf, a = new_workflow('diamond', 'a')
+    top = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    left = df.Step(add, (top, a), {}, execount=2).get_result(0)
+    right = df.Step(add, (top, top), {}, execount=3).get_result(0)
+    bottom = df.Step(add, (left, right), {}, execount=4).get_result(0)
+    wf.set_output(bottom, 'out')
+
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    runner = localrunner.LocalRunner(wf, {'a': b''}, maxproc=4, polltime=1.0)
+    runner.run()
+
+    order = [step._label() for step in launched]
+    assert order[0] == 'add.1'
+    assert set(order[1:3]) == {'add.2', 'add.3'}
+    assert order[3] == 'add.4'
+    assert not runner.queued and not runner.ready
+
+
+@pytest.mark.parametrize('schedule', ['critical-path', 'fifo'])
+def test_schedule_policy_under_cpu_cap(add, monkeypatch, schedule):
+    wf, a = new_workflow('lopsided', 'a')
+    leaf = df.Step(add, (a, a), {}, execount=1).get_result(0)
+    wf.set_output(leaf, 'leaf')
+    chain = a
+    for i in range(4):
+        chain = df.Step(add, (chain, a), {}, execount=i+2).get_result(0)
+    wf.set_output(chain, 'chain')
+
+    launched = patch_jobs(monkeypatch, FakeEngine(), duration=0.01)
+    runner = localrunner.LocalRunner(wf, {'a': b''}, maxproc=1, polltime=1.0,
+                                     schedule=schedule, deduplicate=False)  # add.1 == add.2
+    runner.run()
+
+    if schedule == 'critical-path':  # the long chain starts before the leaf
+        assert launched[0]._label() == 'add.2'
+    else:  # steps start in the order they became ready
+        assert launched[0]._label() == 'add.1'
+
+
+def test_critical_path_lengths_use_durations():
+    from molflow.runners.scheduling import critical_path_lengths
+
+    fast = df.Function('fast', sourcefile='functions.py')
+    slow = df.Function('slow', sourcefile='functions.py')
+    first, second, third = (df.Step(fast, (), {}, 1), df.Step(slow, (), {}, 1),
+                            df.Step(fast, (), {}, 2))
+    dependents = {first: [second, third], second: [], third: []}
+
+    lengths = critical_path_lengths(dependents, {'slow': 10.0})
+    assert lengths == {first: 11.0, second: 10.0, third: 1.0}
+
+
+@pytest.fixture
+def map_workflow():
+    wf, n, a = new_workflow('mapped', 'n', 'a')
+    count_to = df.Function('count_to', sourcefile='functions.py', num_args=1,
+                           num_returnvals=1)
+    add = df.Function('add', sourcefile='functions.py')
+    numbers = df.Step(count_to, (n,), {}, execount=1).get_result(0)
+    wf.set_output(add.map(numbers, a, chunksize=2), 'sums')
+    return wf
+
+
+@pytest.mark.parametrize('numitems', [5, 0])
+def test_map_step_scatters_items_into_chunks(map_workflow, numitems):
+    from molflow.runners.localstep import SubprocessEngine
+
+    runner = localrunner.LocalRunner(map_workflow, {'n': pickle.dumps(numitems),
+                                                    'a': pickle.dumps(10)},
+                                     polltime=1.0, engine=SubprocessEngine())
+    runner.run()
+    result = pickle.loads(runner.output_files['sums'].read('rb'))
+    assert result == [10 + i for i in range(numitems)]
+
+    labels = set(step._label() for step in runner.finished)
+    assert labels == {'count_to.1', 'add.1'} | {'add.1.chunk%d' % i
+                                                for i in range((numitems + 1) // 2)}
+
+
+def test_map_step_cwl_uses_scatter(map_workflow):
+    cwldoc = map_workflow.to_cwl()
+    assert cwldoc['requirements'] == [{'class': 'ScatterFeatureRequirement'}]
+    assert cwldoc['steps']['count_to.1']['in']['unroll'] == {'default': [0]}
+    assert cwldoc['steps']['add.1']['scatter'] == 'arg_0'
+    assert cwldoc['steps']['add.1']['in']['arg_0'] == 'count_to.1/return.0.items'
+    assert cwldoc['steps']['add.1.gather']['in'] == {'chunks': 'add.1/return.0.pkl'}
+    assert cwldoc['outputs']['sums']['outputSource'] == 'add.1.gather/return.0.pkl'
@@ -0,0 +1,89 @@
+from pathlib import Path
+
+from molflow.config import WorkflowConfiguration
+from molflow.plans import PlanCache
+
+WORKFLOW = u"""
+from molflow import definitions as df
+
+wf = df.WorkflowDefinition('planned')
+__workflow__ = wf
+
+a = wf.add_input('a', 'a number', type=int, default=%s)
+add = df.Function(funcname='add', sourcefile='./functions.py', num_returnvals=1)
+wf.set_output(df.Step(add, (a, a), {}, 1).get_result(0), 'doubled')
+"""
+
+FUNCTIONS = u"""
+__DOCKER_IMAGE__ = 'python:3.6'
+
+def add(a, b):
+    return a + b
+"""
+
+
+def _workflowdir(tmpdir, default='2'):
+    path = Path(str(tmpdir)) / 'planned'
+    path.mkdir()
+    (path / 'workflow.py').write_text(WORKFLOW % default)
+    (path / 'functions.py').write_text(FUNCTIONS)
+    (path / 'metadata.yml').write_text(u'description: test\n')
+    return path
+
+
+def _load(path, plans):
+    return WorkflowConfiguration('planned', path, path.parent, plan_cache=plans).workflow
+
+
+def test_plan_is_reused(tmpdir):
+    path = _workflowdir(tmpdir)
+    plans = PlanCache(str(tmpdir / 'plans'))
+    original = _load(path, plans.path)
+    assert plans.load(path) is not None
+
+    planned = _load(path, plans.path)
+    assert planned is not original
+    assert [step._label() for step in planned.steps()] == ['add.1']
+    assert list(planned.inputs) == ['a']
+    assert planned.definition_path == path
+    step, = planned.steps()
+    assert step.fn.get_docker_image(path) == 'python:3.6'
+
+
+def test_plan_is_invalidated_by_changed_files(tmpdir):
+    path = _workflowdir(tmpdir)
+    plans = PlanCache(str(tmpdir / 'plans'))
+    _load(path, plans.path)
+
+    (path / 'functions.py').write_text(FUNCTIONS.replace('3.6', '3.7'))
+    assert plans.load(path) is None
+    step, = _load(path, plans.path).steps()
+    assert step.fn.get_docker_image(path) == 'python:3.7'
+    assert plans.load(path) is not None
+
+    (path / 'workflow.py').write_text(WORKFLOW % '3')
+    assert plans.load(path) is None
+
+
+def test_plan_is_invalidated_by_changed_nested_modules(tmpdir):
+    path = _workflowdir(tmpdir)
+    (path / 'lib').mkdir()
+    (path / 'lib' / '__init__.py').write_text(u'')
+    (path / 'lib' / 'steps.py').write_text(u'SCALE = 1\n')
+    plans = PlanCache(str(tmpdir / 'plans'))
+    _load(path, plans.path)
+    assert plans.load(path) is not None
+
+    (path / 'lib' / 'steps.py').write_text(u'SCALE = 2\n')
+    assert plans.load(path) is None
+
+    _load(path, plans.path)
+    (path / 'lib' / 'other.py').write_text(u'SCALE = 3\n')
+    assert plans.load(path) is None
+
+
+def test_unpicklable_workflows_are_not_planned(tmpdir):
+    path = _workflowdir(tmpdir, default='lambda: 2')
+    plans = PlanCache(str(tmpdir / 'plans'))
+    assert not plans.save(path, _load(path, None))
+    assert plans.load(path) is None
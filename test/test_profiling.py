@@ -0,0 +1,22 @@
+import pickle
+
+from molflow.runners import localrunner
+
+
+def test_profiled_steps_write_profiles(float_workflow, tmpdir):
+    import pstats
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.runners.profiling import StepProfiler
+
+    profiler = StepProfiler(functions=['add'], memory=True, outputdir=str(tmpdir))
+    runner = localrunner.LocalRunner(float_workflow, {'a': pickle.dumps(21)}, polltime=1.0,
+                                     engine=SubprocessEngine(), profiler=profiler)
+    runner.run()
+    assert pickle.loads(runner.output_files['result'].read('rb')) == 42.0
+
+    stepdir = tmpdir / 'add.1'
+    stats = pstats.Stats(str(stepdir / '__profile__.prof'))
+    assert any(funcname == 'add' for _, _, funcname in stats.stats)
+    assert 'cumulative' in (stepdir / '__profile__.txt').read()
+    assert 'Traced memory' in (stepdir / '__allocations__.txt').read()
+    assert not (tmpdir / 'cast_to_float.1').exists()
@@ -0,0 +1,49 @@
+import pickle
+
+from molflow.runners import localrunner
+
+
+def test_step_resource_stats_are_collected(float_workflow, tmpdir):
+    import json
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.runners.resources import format_resource_table
+
+    datadir = tmpdir / 'run'
+    runner = localrunner.LocalRunner(float_workflow, {'a': pickle.dumps(21)}, polltime=1.0,
+                                     datadir=str(datadir), engine=SubprocessEngine())
+    runner.run()
+
+    assert set(runner.step_stats) == {'add.1', 'cast_to_float.1'}
+    stats = runner.step_stats['add.1']
+    assert stats['bytes_read'] == 2 * len(pickle.dumps(21))
+    assert stats['bytes_written'] == len(pickle.dumps(42, protocol=2))
+    assert stats['wall_time'] >= 0 and stats['cpu_user'] >= 0 and stats['peak_rss'] > 0
+    with (datadir / 'add.1' / '__stats__.json').open('r') as statsfile:
+        assert json.load(statsfile) == stats
+
+    table = format_resource_table(runner.step_stats, top=1).splitlines()
+    assert table[0].split()[:3] == ['Step', 'Wall', 'CPU']
+    assert len(table) == 4 and table[-1] == '(1 more not shown)'
+
+
+def test_measured_durations_feed_the_schedule(twice_workflow, tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.runners.resources import DurationHistory
+
+    wf = twice_workflow
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(1)}, polltime=1.0,
+                                     engine=SubprocessEngine())
+    runner.run()
+    assert len(runner.function_times['add']) == 2
+
+    path = str(tmpdir / 'durations.json')
+    history = DurationHistory(path)
+    assert history.durations == {}
+    history.update(runner.function_times)
+    history.save()
+    durations = DurationHistory(path).durations
+    assert set(durations) == {'add'} and durations['add'] > 0
+
+    runner = localrunner.LocalRunner(wf, {'a': pickle.dumps(1)}, durations=durations)
+    assert runner.ready.priorities[wf.steps()[0]] == 2 * durations['add']
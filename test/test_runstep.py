@@ -0,0 +1,96 @@
+import os
+import pickle
+import time
+
+import pytest
+
+from .helpers import testpath
+
+
+@pytest.mark.skipif(pickle.HIGHEST_PROTOCOL < 5, reason='needs pickle protocol 5')
+def test_large_buffers_are_stored_out_of_band(tmpdir):
+    from molflow.static import runstep
+
+    big = bytearray(b'x' * runstep.OOB_MIN_BYTES)
+    value = {'big': pickle.PickleBuffer(big), 'small': pickle.PickleBuffer(bytearray(b'y'))}
+    path = str(tmpdir / 'return.0.pkl')
+    with open(path, 'wb') as outfile:
+        runstep.dump_value(value, outfile, protocol=5)
+    with open(path, 'rb') as infile:
+        contents = infile.read()
+    assert runstep.has_out_of_band_buffers(contents)
+    assert len(runstep.out_of_band_buffers(memoryview(contents))) == 1
+
+    loaded = runstep.load_value(path)
+    assert loaded['small'] == bytearray(b'y')
+    assert isinstance(loaded['big'], memoryview) and loaded['big'] == big
+    loaded['big'][0] = ord('z')  # mapped copy-on-write
+    assert runstep.loads_value(contents)['big'] == big
+
+    with open(path, 'wb') as outfile:  # older protocols write plain pickles
+        runstep.dump_value(big, outfile, protocol=2)
+    with open(path, 'rb') as infile:
+        assert pickle.load(infile) == big
+
+
+def test_return_values_are_written_in_their_formats(tmpdir, monkeypatch):
+    import argparse
+    from molflow.static import runstep
+
+    try:
+        import msgpack
+    except ImportError:
+        msgpack = None
+    values = [u'ATOM  1 \u00c5', b'\x00\x01', 3, {u'a': [1, 2.5, None]}, (1, 2)]
+    cliargs = argparse.Namespace(numreturn=len(values), unroll=[], protocol=2,
+                                 formats=runstep.parse_formats(
+                                     ['0:txt', '1:bin', '2:txt', '3:msgpack', '4:msgpack']))
+    monkeypatch.chdir(str(tmpdir))
+    runstep.serialize_output(values, cliargs)
+
+    expected = ['return.0.txt', 'return.1.bin', 'return.2.pkl',
+                'return.3.msgpack' if msgpack else 'return.3.pkl', 'return.4.pkl']
+    assert sorted(os.listdir(str(tmpdir))) == expected
+    assert (tmpdir / 'return.0.txt').read_binary() == values[0].encode('utf-8')
+    assert [runstep.load_argument(path) for path in expected] == values
+
+
+def test_runstep_serve_reuses_worker_for_several_steps(tmpdir):
+    import json
+    import shutil
+    import subprocess
+    import sys
+    from molflow.run import EXECUTOR
+
+    workdir = str(tmpdir)
+    tasks = {'task000000': ['add', 3, 4], 'task000001': ['add', 5, 6],
+             'task000002': ['divide', 1, 0]}
+    for taskname, (funcname, a, b) in tasks.items():
+        taskdir = os.path.join(workdir, taskname)
+        os.mkdir(taskdir)
+        shutil.copy(str(testpath / 'test_workflow' / 'functions.py'), taskdir)
+        for i, value in enumerate((a, b)):
+            with open(os.path.join(taskdir, 'arg%d.pkl' % i), 'wb') as argfile:
+                pickle.dump(value, argfile)
+        with open(os.path.join(taskdir, 'invocation.json'), 'w') as invocation:
+            json.dump(['--numreturn', '1', '--sourcefile', 'functions.py', funcname,
+                       'arg0.pkl', 'arg1.pkl'], invocation)
+        open(taskdir + '.ready', 'w').close()
+
+    worker = subprocess.Popen([sys.executable, EXECUTOR, '--serve', workdir])
+    try:
+        deadline = time.time() + 30
+        while not all(os.path.exists(os.path.join(workdir, t + '.done')) for t in tasks):
+            assert time.time() < deadline and worker.poll() is None
+            time.sleep(0.05)
+    finally:
+        open(os.path.join(workdir, '__shutdown__'), 'w').close()
+        worker.wait()
+
+    for taskname, expected in (('task000000', 7), ('task000001', 11)):
+        with open(os.path.join(workdir, taskname, 'return.0.pkl'), 'rb') as outfile:
+            assert pickle.load(outfile) == expected
+    faileddir = os.path.join(workdir, 'task000002')
+    assert os.path.exists(os.path.join(faileddir, '__fail__.txt'))
+    with open(os.path.join(faileddir, '__stderr__')) as stderr:
+        assert 'ZeroDivisionError' in stderr.read()
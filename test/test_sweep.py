@@ -0,0 +1,32 @@
+import pickle
+
+from molflow import definitions as df
+from molflow.runners import localrunner
+
+from .helpers import new_workflow
+
+
+def test_sweep_shares_steps_with_identical_inputs(add, tmpdir):
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.runners.sweep import read_sweep_file, sweep_workflow
+
+    wf, a, b = new_workflow('sweep', 'a', 'b')
+    doubled_b = df.Step(add, (b, b), {}, execount=1).get_result(0)
+    wf.set_output(df.Step(add, (a, doubled_b), {}, execount=2).get_result(0), 'sum')
+
+    sweepfile = tmpdir / 'sweep.csv'
+    sweepfile.write('id,a,b\nfirst,1,2\nsecond,3,2\nthird,1,5\n')
+    rows = read_sweep_file(str(sweepfile), wf)
+    assert [rowid for rowid, _ in rows] == ['first', 'second', 'third']
+
+    rows = [(rowid, {name: pickle.dumps(int(value)) for name, value in fields.items()})
+            for rowid, fields in rows]
+    merged, inputs, row_outputs = sweep_workflow(wf, rows)
+    assert merged.num_steps == 5  # add.1 is shared by the first two rows
+    assert sorted(inputs) == ['a@first', 'a@second', 'b@first', 'b@third']
+
+    runner = localrunner.LocalRunner(merged, inputs, polltime=1.0, engine=SubprocessEngine())
+    runner.run()
+    results = {rowid: pickle.loads(runner.output_files[names['sum']].read('rb'))
+               for rowid, names in row_outputs.items()}
+    assert results == {'first': 5, 'second': 7, 'third': 11}
@@ -0,0 +1,31 @@
+import pickle
+
+from molflow.runners import localrunner
+
+
+def test_trace_records_host_and_job_phases(float_workflow, tmpdir):
+    import json
+    from molflow.runners.localstep import SubprocessEngine
+    from molflow.runners.tracing import RunTrace
+
+    trace = RunTrace()
+    runner = localrunner.LocalRunner(float_workflow, {'a': pickle.dumps(21)}, polltime=1.0,
+                                     engine=SubprocessEngine(), trace=trace)
+    runner.run()
+    tracefile = tmpdir / 'trace.json'
+    trace.write(tracefile)
+
+    with tracefile.open('r') as infile:
+        events = json.load(infile)['traceEvents']
+    tracks = {event['args']['name']: event['tid'] for event in events
+              if event['name'] == 'thread_name'}
+    assert set(tracks) == {'scheduler', 'add.1', 'cast_to_float.1'}
+
+    for label in ('add.1', 'cast_to_float.1'):
+        phases = {event['name']: event for event in events
+                  if event['ph'] == 'X' and event['tid'] == tracks[label]}
+        assert {'queued', 'submit', 'running', 'collect',
+                'load function', 'load arguments', 'call', 'serialize'} <= set(phases)
+        running, collect = phases['running'], phases['collect']
+        assert phases['submit']['ts'] <= running['ts'] <= collect['ts']
+        assert phases['call']['cat'] == 'job'
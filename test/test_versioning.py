@@ -0,0 +1,90 @@
+import os
+import stat
+import subprocess
+from pathlib import Path
+
+from molflow.discovery import WorkflowIndex
+from molflow.versioning import discover_versions, refs_key
+
+
+def _git(path, *args):
+    subprocess.check_call(['git', '-c', 'user.name=molflow', '-c', 'user.email=molflow@test',
+                           ] + list(args), cwd=str(path))
+
+
+def _repo(path, tags=()):
+    path.mkdir()
+    (path / 'workflow.py').write_text(u'# workflow\n')
+    _git(path, 'init', '-q')
+    _git(path, 'add', 'workflow.py')
+    _git(path, 'commit', '-q', '-m', 'initial')
+    for tag in tags:
+        _git(path, 'tag', tag)
+    return path
+
+
+def test_refs_key_changes_with_refs(tmpdir):
+    repo = _repo(Path(str(tmpdir)) / 'repo', tags=['v0.1.0'])
+    key = refs_key(repo)
+    assert refs_key(repo) == key
+    _git(repo, 'tag', 'v0.2.0')
+    assert refs_key(repo) != key
+    assert refs_key(Path(str(tmpdir))) is None
+
+
+def test_discover_versions_in_parallel(tmpdir):
+    root = Path(str(tmpdir))
+    paths = [_repo(root / 'first', tags=['v0.1.0', 'v0.10.0', 'v0.2.0', 'other']),
+             _repo(root / 'second'),
+             root / 'unversioned']
+    paths[2].mkdir()
+    first, second, unversioned = discover_versions(paths, threads=3)
+
+    assert [name for name, version in first.git_version_tags] == ['v0.1.0', 'v0.2.0',
+                                                                 'v0.10.0']
+    assert first.git_other_tags == ['other']
+    assert first.default_version() == ('v0.10.0', 'git:latest-version-tag')
+    assert second.default_version()[1] == 'git:current-branch-head'
+    assert unversioned.default_version() == ('Unversioned', 'non-git')
+
+
+def test_versions_are_cached_until_refs_change(tmpdir):
+    root = Path(str(tmpdir))
+    repo = _repo(root / 'repo', tags=['v0.1.0'])
+    index = WorkflowIndex(str(root / 'index.pkl'))
+    discover_versions([repo], index)
+    assert index.versions(repo, refs_key(repo)) is not None
+    index.save()
+
+    warm = WorkflowIndex(str(root / 'index.pkl'))
+    versions, = discover_versions([repo], warm)
+    assert versions.default_version()[0] == 'v0.1.0'
+    assert not warm._changed
+
+    _git(repo, 'tag', 'v0.2.0')
+    versions, = discover_versions([repo], warm)
+    assert versions.default_version()[0] == 'v0.2.0'
+    assert warm._changed
+
+    (repo / 'workflow.py').write_text(u'# changed\n')  # dirty state is never cached
+    versions, = discover_versions([repo], warm)
+    assert versions.git_dirty
+
+
+def test_versions_are_extracted_without_checking_out(tmpdir):
+    from molflow.config import WorkflowConfiguration
+
+    root = Path(str(tmpdir))
+    repo = _repo(root / 'repo', tags=['v0.1.0'])
+    (repo / 'workflow.py').write_text(u'# version 2\n')
+    _git(repo, 'commit', '-q', '-a', '-m', 'second')
+    workflow = WorkflowConfiguration('repo', repo, root, version_cache=root / 'versions')
+
+    old = workflow.at_version('v0.1.0')
+    assert old.path.parent == root / 'versions'
+    assert (old.path / 'workflow.py').read_text() == u'# workflow\n'
+    assert not os.stat(str(old.path / 'workflow.py')).st_mode & stat.S_IWUSR
+    assert (repo / 'workflow.py').read_text() == u'# version 2\n'  # working tree is untouched
+    assert workflow.at_version('v0.1.0').path == old.path
+
+    assert workflow.at_version('master') is workflow  # the current state is used in place
@@ -11,3 +11,7 @@ def divide(a, b):
 
 def cast_to_float(a):
     return float(a)
+
+
+def count_to(n):
+    return list(range(n))